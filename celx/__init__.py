@@ -1 +1,15 @@
-from .application import Browser
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .application import Browser
+
+
+def __getattr__(name: str):
+    """Imports the (heavy) application module only once `Browser` is accessed."""
+
+    if name == "Browser":
+        from .application import Browser  # pylint: disable=import-outside-toplevel
+
+        return Browser
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,22 +1,137 @@
+from __future__ import annotations
+
+import os
 from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+from .tracing import TRACE_FORMATS, Tracer
+
+
+def _print_timeline(timeline: list[tuple[str, float]]) -> None:
+    """Prints a list of (label, perf_counter) milestones relative to the first one."""
+
+    start = timeline[0][1]
+    previous = start
 
-from . import Browser
-from slate import feed
+    for label, timestamp in timeline:
+        print(
+            f"{(timestamp - start) * 1000:>9.2f}ms"
+            + f" (+{(timestamp - previous) * 1000:.2f}ms)  {label}"
+        )
+        previous = timestamp
 
 
-def run(endpoint: str):
+def run(
+    endpoint: str,
+    profile_startup: bool = False,
+    profile: bool = False,
+    trace: str | None = None,
+    trace_format: str = "chrome",
+    lua_log: str | None = None,
+):
     """Runs the application at the given endpoint."""
 
-    with open("debug.lua", "w") as f:
-        ...
+    timeline = [("start", perf_counter())]
+
+    from . import Browser  # pylint: disable=import-outside-toplevel
+    from .lua import LUA_LOG_VAR  # pylint: disable=import-outside-toplevel
+
+    timeline.append(("import celx.application", perf_counter()))
+
+    if lua_log is not None:
+        with open(lua_log, "w", encoding="utf-8"):
+            pass
+
+        os.environ[LUA_LOG_VAR] = lua_log
+
+    tracer = Tracer() if trace is not None else None
 
-    with Browser(endpoint, title="celx") as app:
-        ...
+    try:
+        app = Browser(endpoint, title="celx", profile=profile, tracer=tracer)
+
+        with app:
+            ...
+
+    finally:
+        if tracer is not None and trace is not None:
+            tracer.export(trace, trace_format)
+
+    if profile_startup:
+        _print_timeline(sorted(timeline + app.startup_timeline, key=lambda m: m[1]))
+
+    if profile:
+        print(app.profile_report())
+
+    if profile_startup or profile or trace is not None:
+        return
 
     root = app.find("#root")
     print(root.children[0].content)
     print(app.dump_rules_applied_to(root.children[0].content))
 
+
+def bench(endpoint: str, sessions: int = 1, frames: int = 100, size: str = "80x24"):
+    """Loads the endpoint in headless sessions, and measures their rendering speed."""
+
+    from .headless import (  # pylint: disable=import-outside-toplevel
+        HeadlessBrowser,
+        settle_all,
+    )
+
+    width, height = map(int, size.split("x"))
+
+    start = perf_counter()
+    browsers = [
+        HeadlessBrowser(endpoint, size=(width, height)) for _ in range(sessions)
+    ]
+    unsettled = settle_all(browsers)
+    elapsed = perf_counter() - start
+
+    print(
+        f"loaded {sessions - len(unsettled)}/{sessions} sessions"
+        + f" in {elapsed * 1000:.2f}ms ({sessions / elapsed:.1f} sessions/s)"
+    )
+
+    start = perf_counter()
+
+    for _ in range(frames):
+        for browser in browsers:
+            browser._should_draw = True  # pylint: disable=protected-access
+            browser.frame()
+
+    elapsed = perf_counter() - start
+    total = frames * sessions
+
+    print(
+        f"rendered {total} frames in {elapsed * 1000:.2f}ms"
+        + f" ({total / elapsed:.1f} frames/s, {elapsed / total * 1000:.3f}ms/frame)"
+    )
+
+
+def convert(source: str, output: str | None = None) -> None:
+    """Converts an XML page or fragment into the binary wire format."""
+
+    from . import wire  # pylint: disable=import-outside-toplevel
+
+    path = Path(source)
+
+    with open(path, "rb") as f:
+        data = wire.encode_xml(f.read())
+
+    with open(output or path.with_suffix(".celx"), "wb") as f:
+        f.write(data)
+
+
+def bundle(source: str, output: str, precompile: bool = False) -> None:
+    """Packs an app's directory into a bundle that can be run offline."""
+
+    from .bundle import write_bundle  # pylint: disable=import-outside-toplevel
+
+    count = write_bundle(source, output, precompile=precompile)
+    print(f"bundled {count} files into {output}")
+
+
 def main() -> None:
     """The main entrypoint."""
 
@@ -27,6 +142,76 @@ def main() -> None:
     run_command = subs.add_parser("run")
     run_command.set_defaults(func=run)
     run_command.add_argument("endpoint", help="The endpoint to connect to.")
+    run_command.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print a timeline of imports & initialization after exiting.",
+    )
+    run_command.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile Lua handlers & script lines. Press ctrl-p to toggle the report.",
+    )
+    run_command.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Record timing spans of navigations & interactions to the given file.",
+    )
+    run_command.add_argument(
+        "--trace-format",
+        choices=TRACE_FORMATS,
+        default="chrome",
+        help="The format of the --trace file. Defaults to the Chrome trace format.",
+    )
+    run_command.add_argument(
+        "--lua-log",
+        metavar="PATH",
+        help="Write all Lua code the runtime executes to the given file.",
+    )
+
+    bench_command = subs.add_parser("bench")
+    bench_command.set_defaults(func=bench)
+    bench_command.add_argument("endpoint", help="The endpoint to connect to.")
+    bench_command.add_argument(
+        "-n",
+        "--sessions",
+        type=int,
+        default=1,
+        help="The number of headless sessions to run at once.",
+    )
+    bench_command.add_argument(
+        "--frames",
+        type=int,
+        default=100,
+        help="The number of full redraws to time in every session.",
+    )
+    bench_command.add_argument(
+        "--size",
+        default="80x24",
+        help="The simulated terminal size, as WIDTHxHEIGHT.",
+    )
+
+    convert_command = subs.add_parser("convert")
+    convert_command.set_defaults(func=convert)
+    convert_command.add_argument("source", help="The XML file to convert.")
+    convert_command.add_argument(
+        "-o", "--output", help="The file to write to. Defaults to <source>.celx."
+    )
+
+    bundle_command = subs.add_parser("bundle")
+    bundle_command.set_defaults(func=bundle)
+    bundle_command.add_argument(
+        "source", help="The directory to bundle, laid out like the app's URLs."
+    )
+    bundle_command.add_argument(
+        "output",
+        help="The bundle file to write. Files ending in .zip are written as zips.",
+    )
+    bundle_command.add_argument(
+        "--precompile",
+        action="store_true",
+        help="Store XML files in the binary wire format. Requires msgpack.",
+    )
 
     args = parser.parse_args()
     command = args.func
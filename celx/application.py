@@ -1,68 +1,148 @@
-from functools import wraps
-from pathlib import Path
-from threading import Thread
-from time import time
-from typing import Any, Callable
-from urllib.parse import urlparse
+from __future__ import annotations
 
-from lxml.etree import fromstring as ElementTree, Element
-from xml.dom.minidom import parseString
+from concurrent.futures import Future
+from contextlib import nullcontext
+from copy import deepcopy
+from functools import lru_cache, partial, wraps
+from pathlib import Path
+from queue import Empty, SimpleQueue
+from threading import Event, Lock, Thread, current_thread
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, ContextManager
+from urllib.parse import parse_qsl, urlparse
 from xml.parsers.expat import ExpatError
 
-from celadon import Application, Page, Widget, Container, Tower, Row, Text, Field, Button
-from requests import Session
+from lxml.etree import fromstring as ElementTree, Element
+from celadon import Application, Page, Widget, Container, Tower, Text
+from slate import Key
 from zenith import zml_escape
 
-from .parsing import parse_widget, parse_page
-from .callbacks import (
-    HTTPMethod,
-    Instruction,
-    Verb,
-    TreeMethod,
-)
-from .lua import lua, init_runtime
+from . import wire
+from .bundle import BUNDLE_SCHEMES, BundleResponse, open_bundle
+from .forms import FormSnapshot, encode_form
+from .parsing import apply_rule_set, parse_fragment, parse_page
+from .profiler import LuaProfiler
+from .queries import QueryCache
+from .routes import LocalRoutes
+from .scheduler import FrameScheduler
+from .styling import IncrementalPage, IncrementalRules
+from .callbacks import HTTPMethod, Instruction, Verb, TreeMethod
+from .lua import ScriptLimits, app_envs, init_runtime, lua, release_runtime
+from .optimistic import TreeSnapshot
+from .pages import PageLifecycle, PageState
+from .lazy import LazyFragment  # pylint: disable=unused-import # registers <lazy>
+from .virtual import VirtualList  # pylint: disable=unused-import # registers <vlist>
+
+if TYPE_CHECKING:
+    from requests import Response, Session
+
+    from .host import SubresourceCache
+    from .tracing import Tracer
+    from .transport import TransportMetrics, TransportSettings
+
+__all__ = ["Browser", "PageState"]
+
 
+def _read_chrome(path: Path) -> str:
+    """Reads a chrome definition, only reading it again once it was modified."""
 
-__all__ = ["Browser"]
+    return _read_chrome_version(path, path.stat().st_mtime_ns)
 
 
-def threaded(func: Callable[..., None]) -> Callable[..., None]:
+@lru_cache(maxsize=16)
+def _read_chrome_version(path: Path, _: int) -> str:
+    """Reads a chrome definition, cached by its path & modification time."""
+
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def threaded(func: Callable[..., None]) -> Callable[..., Thread]:
     """Returns a callable that runs the given function in a thread."""
 
     @wraps(func)
-    def _inner(*args, **kwargs) -> None:
-        Thread(target=func, args=args, kwargs=kwargs).start()
+    def _inner(*args, **kwargs) -> Thread:
+        thread = Thread(target=func, args=args, kwargs=kwargs)
+        thread.start()
+
+        return thread
 
     return _inner
 
 
-class Browser(Application):
+# Celadon declares `_rules` as an attribute, but defines it as a property
+class Browser(  # type: ignore[override]
+    PageLifecycle, IncrementalRules, Application
+):
     """An application class for HTTP pages."""
 
-    def __init__(self, domain: str, **app_args: Any) -> None:
-        super().__init__(**app_args)
+    def __init__(
+        self,
+        domain: str,
+        max_cached_pages: int = 5,
+        transport: TransportSettings | None = None,
+        frame_budget_ms: float = 8.0,
+        script_limits: ScriptLimits | None = None,
+        profile: bool = False,
+        tracer: Tracer | None = None,
+        subresources: SubresourceCache | None = None,
+        **app_args: Any,
+    ) -> None:
+        """Initializes the browser.
+
+        Args:
+            domain: The URL to route to on startup.
+            max_cached_pages: The number of inactive pages that are retained after
+                navigating away from them. Older pages are evicted, which frees their
+                widgets, style rules and Lua environments.
+            transport: Compression, connection pooling, retry & timeout settings for
+                the HTTP session. See `celx.transport.TransportSettings`.
+            frame_budget_ms: The time Lua event handlers, timeouts & animation frame
+                callbacks may take up each frame. See `celx.scheduler.FrameScheduler`.
+            script_limits: Instruction & memory quotas for page scripts. See
+                `celx.lua.ScriptLimits`.
+            profile: Whether to profile Lua handlers & script lines. The report can
+                be toggled as an overlay with `ctrl-p`, or read from `profile_report`.
+            tracer: Records timing spans of navigations, requests, parsing, Lua
+                execution, rule application, rendering & instructions.
+            subresources: A cache of sourced styles, scripts & component libraries
+                shared with other browsers. See `celx.host.SubresourceCache`.
+        """
+
+        self.startup_timeline: list[tuple[str, float]] = []
+        self._mark_startup("init")
+
+        self.max_cached_pages = max_cached_pages
+        self.script_limits = script_limits or ScriptLimits()
+        self.profiler = LuaProfiler() if profile else None
+        self.tracer = tracer
+        self.subresources = subresources
+        self._navigation_start = perf_counter()
+        self._profiler_overlay: Text | None = None
+        self.transport = transport
 
-        init_runtime(lua, self)
+        super().__init__(**app_args)
 
         self._registered_components = {}
-        self._page = Page()
+        self._page = IncrementalPage()
         self._url = urlparse(domain)
         self.url = self._url.geturl()
         self.history = []
         self.history_offset = 0
-        self._session = Session()
-        self._session.headers = {
-            "Accepts": "text/celx",
-            "CELX_Request": "true",
-        }
-
-        self._current_instructions: list[list[Instruction]] = []
+        self._session: Session | None = None
+        self._session_lock = Lock()
+        self._runtime_ready = Event()
+        self._ui_queue: SimpleQueue[tuple[Callable[[], Any], Future]] = SimpleQueue()
+        self._ui_thread: Thread | None = None
+        self.scheduler = FrameScheduler(frame_budget_ms, lua, on_error=self._error)
 
+        if profile:
+            self.rule("Text#profiler", anchor="screen", layer=20)
 
-        self.content = Tower(
-            self._build_chrome(),
-            Tower(eid="root"),
-        )
+        self._current_instructions: list[list[Instruction]] = []
+        self.forms = FormSnapshot()
+        self.local_routes = LocalRoutes(lua, owner=lambda: self.page)
+        self.queries = QueryCache(self, lua)
 
         def _clear_instructions(_: Page) -> bool:
             for instructions in self._current_instructions:
@@ -72,38 +152,270 @@ class Browser(Application):
 
         self.on_page_changed += _clear_instructions
 
+        def _reset_queries(_: Page) -> bool:
+            self.queries.reset()
+
+            return True
+
+        self.on_page_changed += _reset_queries
+
+        # The first request goes out while the Lua runtime & chrome are being set up,
+        # its handler waits for `_runtime_ready` before parsing the response.
         self.route(self._url.geturl())
+        self._mark_startup("request sent")
+
+        try:
+            init_runtime(lua, self)
+            self._mark_startup("runtime ready")
+
+            self.content = Tower(
+                self._build_chrome(),
+                Tower(eid="root"),
+            )
+            self._mark_startup("chrome built")
+
+        finally:
+            self._runtime_ready.set()
+
+    def _mark_startup(self, label: str) -> None:
+        """Records a startup milestone, until the first page has been routed to."""
+
+        if not any(name == "page routed" for name, _ in self.startup_timeline):
+            self.startup_timeline.append((label, perf_counter()))
+
+    def call_on_ui(self, func: Callable[[], Any]) -> Future:
+        """Schedules a callable that mutates the widget tree or style rules.
+
+        Mutations produced on worker threads are queued and applied by the draw
+        thread in a single batch at the start of its next frame, so the tree is never
+        modified mid-layout and many results arriving at once only cost one layout
+        pass. Calls made on the draw thread, or while the browser isn't running, are
+        executed immediately.
+
+        Returns:
+            A future resolving to the return value of func.
+        """
+
+        future: Future = Future()
+
+        if not self._is_running or current_thread() is self._ui_thread:
+            self._resolve(func, future)
+            return future
+
+        self._ui_queue.put((func, future))
+        return future
+
+    @staticmethod
+    def _resolve(func: Callable[[], Any], future: Future) -> None:
+        """Runs func, storing its result (or the exception it raised) in future."""
+
+        if not future.set_running_or_notify_cancel():
+            return
+
+        try:
+            future.set_result(func())
+
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            future.set_exception(exc)
+
+    def _drain_ui_queue(self) -> bool:
+        """Applies every queued UI mutation, returning whether there were any."""
+
+        drained = False
+
+        while True:
+            try:
+                func, future = self._ui_queue.get_nowait()
+
+            except Empty:
+                return drained
+
+            self._resolve(func, future)
+            drained = True
+
+    def apply_rules(self) -> bool:
+        """Applies queued UI mutations & scheduled Lua work, then the page's rules."""
+
+        if self._is_running:
+            self._ui_thread = current_thread()
+
+        drained = self._drain_ui_queue()
+        scheduled = self.scheduler.run_frame()
+
+        return super().apply_rules() or drained or scheduled
+
+    def stop(self) -> None:
+        """Stops the browser, cancelling mutations that never got applied.
+
+        Cached pages are evicted, and the Lua runtime lets go of the browser's widget
+        environments, so a stopped browser can be garbage collected.
+        """
+
+        super().stop()
+
+        while True:
+            try:
+                _, future = self._ui_queue.get_nowait()
+
+            except Empty:
+                break
+
+            future.cancel()
+
+        if not lua.is_created:
+            return
+
+        for page in [*self._pages]:
+            if self._page_states.get(page) is PageState.CACHED:
+                self._evict_page(page)
+
+        release_runtime(lua, self)
+
+    def profile_report(self, limit: int = 10) -> str:
+        """Returns the hottest Lua handlers & script lines since startup."""
+
+        if self.profiler is None:
+            raise ValueError("profiling is not enabled")
+
+        self.profiler.collect(lua.get())
+
+        return self.profiler.report(limit)
+
+    def toggle_profiler_overlay(self) -> None:
+        """Shows or hides the profile report on top of the page."""
+
+        if self._profiler_overlay is not None:
+            self.remove(self._profiler_overlay)
+            self._profiler_overlay = None
+            return
+
+        overlay = self._profiler_overlay = Text(self.profile_report(), eid="profiler")
+
+        def _refresh() -> None:
+            if self._profiler_overlay is overlay:
+                overlay.content = self.profile_report()
+                self.timeout(500, _refresh)
+
+        self.pin(overlay)
+        self.timeout(500, _refresh)
+
+    def process_input(self, inp: Key) -> bool:
+        """Handles the profiler overlay's key, passes everything else on."""
+
+        if inp == "ctrl-p" and self.profiler is not None:
+            self.toggle_profiler_overlay()
+            return True
+
+        return super().process_input(inp)
+
+    def _span(self, name: str, **attrs: Any) -> ContextManager[dict[str, Any]]:
+        """Returns a context that records a span if tracing is enabled."""
+
+        if self.tracer is None:
+            return nullcontext(attrs)
+
+        return self.tracer.span(name, **attrs)
+
+    def _send(self, method: str, url: str, span: str, **kwargs: Any) -> Response:
+        """Sends a request, timing its connects, first byte & download when tracing.
+
+        Requests to bundle URLs are answered from the bundle, without the HTTP
+        session ever being created.
+        """
+
+        if urlparse(url).scheme in BUNDLE_SCHEMES:
+            with self._span(span, method=method, url=url) as attrs:
+                resp = BundleResponse.for_request(method, url)
+
+                attrs["status"] = resp.status_code
+                attrs["bytes"] = len(resp.content)
+
+            return resp  # type: ignore[return-value]
+
+        request = getattr(self.session, method.lower())
+
+        if self.tracer is None:
+            return request(url, **kwargs)
+
+        # Imports requests, which the session above has already done
+        from .transport import connect_timings  # pylint: disable=import-outside-toplevel
+
+        with connect_timings() as connects:
+            with self.tracer.span(span, method=method, url=url) as attrs:
+                start = perf_counter()
+                resp = request(url, stream=True, **kwargs)
+                first_byte = perf_counter()
+
+                attrs["status"] = resp.status_code
+                attrs["bytes"] = len(resp.content)
+
+            self.tracer.record("ttfb", start, first_byte, url=url)
+            self.tracer.record("download", first_byte, perf_counter(), url=url)
+
+        for host, connect_start, connect_end in connects:
+            self.tracer.record("connect", connect_start, connect_end, host=host)
+
+        return resp
 
     def _build_chrome(self) -> Widget:
-        with open(Path(__file__).parents[0] / "default_chrome.xml", "r") as f:
-            xml = ElementTree(f.read())
-            default_chrome, scripts = parse_page(xml, self._registered_components, self)
+        xml = ElementTree(_read_chrome(Path(__file__).parents[0] / "default_chrome.xml"))
+        default_chrome, scripts, run_scripts = parse_page(
+            xml, self._registered_components, self
+        )
+        run_scripts()
 
-            for script in scripts:
-                lua.execute(script)
+        for script in scripts:
+            lua.execute(script)
 
         user_chrome = None
-        user_chrome_path = (Path.home() / ".config" / "celx" / "chrome.xml")
+        user_chrome_path = Path.home() / ".config" / "celx" / "chrome.xml"
 
         if user_chrome_path.exists():
-            with open(user_chrome_path, "r") as f:
-                xml = ElementTree(f.read())
+            xml = ElementTree(_read_chrome(user_chrome_path))
 
-                if "disabled" not in xml.attrib:
-                    user_chrome, scripts = parse_page(xml, self._registered_components, self)
+            if "disabled" not in xml.attrib:
+                user_chrome, scripts, run_scripts = parse_page(
+                    xml, self._registered_components, self
+                )
+                run_scripts()
 
-                    for script in scripts:
-                        lua.execute(script)
+                for script in scripts:
+                    lua.execute(script)
 
         return user_chrome or default_chrome
 
-
     @property
     def session(self) -> Session:
-        """Returns the current requests session."""
+        """Returns the current requests session, creating it on first access.
+
+        `requests` is only imported here, so its import cost is paid by whichever
+        thread sends the first request.
+        """
+
+        with self._session_lock:
+            if self._session is None:
+                # pylint: disable-next=import-outside-toplevel
+                from .transport import TransportSettings, build_session
+
+                self._session = build_session(self.transport or TransportSettings())
+
+                if wire.is_available():
+                    self._session.headers["Accept"] = (
+                        f"{wire.CONTENT_TYPE}, text/celx;q=0.9, */*;q=0.8"
+                    )
+
+                self._mark_startup("session ready")
 
         return self._session
 
+    @property
+    def transport_metrics(self) -> TransportMetrics:
+        """Returns request & connection reuse counts for the current session."""
+
+        from .transport import session_metrics  # pylint: disable=import-outside-toplevel
+
+        return session_metrics(self.session)
+
     def __getitem__(self, item: Any) -> Any:
         """Implement `__getitem__` for Lua attribute access."""
 
@@ -115,64 +427,123 @@ class Browser(Application):
         self._raised = error
 
     def _prefix_endpoint(self, endpoint: str) -> str:
-        """Prefixes hierarchy-only endpoints with the current url and its scheme."""
+        """Prefixes hierarchy-only endpoints with the current url and its scheme.
+
+        Within bundles, endpoints are relative to the bundle file instead.
+        """
 
         if endpoint.startswith("/"):
+            if self._url.scheme in BUNDLE_SCHEMES:
+                _, root, _ = open_bundle(self._url.geturl())
+                return root + endpoint
+
             return self._url.scheme + "://" + self._url.netloc + endpoint
 
         return endpoint
 
+    def _parse_response(self, resp: Response) -> Element:
+        """Parses a response into an XML tree based on its content type.
+
+        Responses in the binary wire format are decoded straight into a tree, XML is
+        validated & parsed, and anything else is wrapped as text.
+        """
+
+        # pylint: disable-next=import-outside-toplevel
+        from xml.dom.minidom import parseString
+
+        if resp.headers.get("Content-Type", "").startswith(wire.CONTENT_TYPE):
+            return wire.decode(resp.content)
+
+        # Wrap invalid XML as text
+        xml = resp.text
+
+        try:
+            _ = parseString(xml)
+        except ExpatError:
+            xml = zml_escape(xml)
+            xml = f"<text>{xml}</text>"
+
+        return ElementTree(xml)
+
     def _http(
         self,
         method: HTTPMethod,
         endpoint: str,
         data: dict[str, Any],
         handler: Callable[[Element], None],
+        navigate: bool = True,
+        encoding: str = "FORM",
+        on_error: Callable[[Exception], None] | None = None,
     ) -> Thread:
-        endpoint = self._prefix_endpoint(endpoint)
+        """Sends a request in a thread, and calls handler with the parsed response.
+
+        Args:
+            method: The HTTP method to use.
+            endpoint: The endpoint to send the request to.
+            data: The request's params (for GET) or form data (otherwise).
+            handler: The callback for the response's XML tree.
+            navigate: Whether the endpoint should become the browser's current URL.
+            encoding: The body encoding for non-GET requests, one of `FORM_ENCODINGS`.
+            on_error: Called with the error if the request fails or is answered with
+                an error status. Without it, errors stop the browser.
+        """
 
-        if method is HTTPMethod.GET:
-            request_data = {"params": data}
-        else:
-            request_data = {"data": data}
+        endpoint = self._prefix_endpoint(endpoint)
 
         if not isinstance(method, HTTPMethod):
             self._error(TypeError(f"Invalid method {method!r}."))
 
-        request = getattr(self._session, method.value.lower())
+        request_data = encode_form(method.value, data, encoding)
+
+        if navigate:
+            self._navigation_start = perf_counter()
 
         def _execute() -> None:
-            resp = request(endpoint, **request_data)
+            tree = self._respond_locally(method.value, endpoint, data)
 
-            if not 200 <= resp.status_code < 300:
-                self.stop()
-                resp.raise_for_status()
+            if tree is None:
+                try:
+                    resp = self._send(
+                        method.value, endpoint, "request", **request_data
+                    )
+                    self._mark_startup("response received")
 
-            self._url = urlparse(endpoint)
-            self.url = self._url.geturl()
+                    if not 200 <= resp.status_code < 300:
+                        if on_error is None:
+                            self.stop()
+
+                        resp.raise_for_status()
 
-            # Wrap invalid XML as text
-            # TODO: Treat response differently based on Content-Type
-            xml = resp.text
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    if on_error is None:
+                        raise
 
-            try:
-                _ = parseString(xml)
-            except ExpatError:
-                xml = zml_escape(xml)
-                xml = f"<text>{xml}</text>"
+                    on_error(exc)
+                    return
+
+                with self._span("parse_response", url=endpoint):
+                    tree = self._parse_response(resp)
 
-            tree = ElementTree(xml)
+            if navigate:
+                self._url = urlparse(endpoint)
+                self.url = self._url.geturl()
 
             for sourceable in ["style", "script", "complib"]:
                 for node in tree.findall(f".//{sourceable}[@src]"):
-                    resp = self._session.get(self._prefix_endpoint(node.attrib["src"]))
+                    url = self._prefix_endpoint(node.attrib["src"])
+                    load = partial(self._fetch_subresource, sourceable, url)
 
-                    if not 200 <= resp.status_code < 300:
-                        self.stop()
-                        resp.raise_for_status()
+                    if self.subresources is None:
+                        sourced = load()
+
+                    else:
+                        sourced = self.subresources.get(url, load)
 
                     if sourceable == "complib":
-                        sourced = ElementTree(resp.text)
+                        # Its children are moved into the page, so shared ones are copied
+                        if self.subresources is not None:
+                            sourced = deepcopy(sourced)
+
                         for child in sourced:
                             node.append(child)
 
@@ -180,17 +551,80 @@ class Browser(Application):
                             node.attrib[key] = value
 
                     else:
-                        node.text = resp.text
+                        node.text = sourced
 
                     del node.attrib["src"]
 
-            return handler(tree)
+            self._runtime_ready.wait()
+
+            self._handle_response(handler, tree)
 
         thread = Thread(target=_execute)
         thread.start()
 
         return thread
 
+    def _fetch_subresource(self, sourceable: str, url: str) -> str | Element:
+        """Fetches the source of a style or script, or the tree of a complib."""
+
+        resp = self._send("GET", url, "subresource")
+
+        if not 200 <= resp.status_code < 300:
+            self.stop()
+            resp.raise_for_status()
+
+        if sourceable != "complib":
+            return resp.text
+
+        with self._span("parse_response", url=resp.url):
+            return self._parse_response(resp)
+
+    def _respond_locally(
+        self, method: str, endpoint: str, data: dict[str, Any]
+    ) -> Element | None:
+        """Returns the response of a local route handler, if one answers the request.
+
+        Only requests to the current origin (or bundle) are handled locally, by
+        their path within it. Handlers run on the draw thread, like all other Lua
+        code.
+        """
+
+        url = urlparse(endpoint)
+
+        if len(self.local_routes) == 0 or url.netloc != self._url.netloc:
+            return None
+
+        path = url.path
+
+        if url.scheme in BUNDLE_SCHEMES:
+            _, root, _ = open_bundle(self._url.geturl())
+
+            if not endpoint.startswith(root + "/"):
+                return None
+
+            path = urlparse(endpoint[len(root) :]).path
+
+        params = {**dict(parse_qsl(url.query)), **data}
+
+        with self._span("local_route", method=method, url=endpoint) as attrs:
+            body = self.call_on_ui(
+                partial(self.local_routes.resolve, method, path, params)
+            ).result()
+
+            attrs["hit"] = body is not None
+
+        if body is None:
+            return None
+
+        return ElementTree(body)
+
+    def _handle_response(
+        self, handler: Callable[[Element], None], tree: Element
+    ) -> None:
+        """Calls a response handler with the parsed response, on the request thread."""
+
+        handler(tree)
+
     def _xml_page_route(self, node: Element) -> None:
         """Routes to a page loaded from the given XML."""
 
@@ -200,41 +634,49 @@ class Browser(Application):
             if page_node is None:
                 raise ValueError("no <page /> node found.")
 
-            page = Page(**page_node.attrib)
-
-            widget, scripts = parse_page(page_node, self._registered_components, page)
-
-            for script in scripts:
-                lua.execute(script)
+            page = IncrementalPage(**page_node.attrib)
 
-            self.content = Tower(
-                self._build_chrome(),
-                Tower(widget, eid="root"),
-            )
+            with self._span("parse_page", url=self.url):
+                widget, scripts, run_scripts = parse_page(
+                    page_node, self._registered_components, page
+                )
 
-            page.append(self.content)
+            if widget is None:
+                raise ValueError("no content node found in <page />.")
 
         except Exception as exc:  # pylint: disable=broad-exception-caught
             self._error(exc)
             return
 
-        page.route_name = self._url.geturl()
+        # Scripts & `init` handlers may touch the tree, so they run on the UI thread
+        def _swap_page() -> None:
+            # Routes registered by the page's scripts belong to it, not the active one
+            with self.local_routes.owned_by(page):
+                with self._span("page_scripts", url=self.url):
+                    run_scripts()
+
+                    with lua.limited():
+                        for script in scripts:
+                            lua.execute_script(script)
 
-        # TODO: We don't have to request the page every time we go to it
-        self.append(page)
+                chrome = self._build_chrome()
 
-        self._page = page
-        self._mouse_target = self._page[0]
-        self.on_page_changed(page)
+            page.append(Tower(chrome, Tower(widget, eid="root")))
+            self.forms.track(page[0])
 
-        if page.route_name == "/":
-            self._terminal.set_title(self.title)
+            page.route_name = self._url.geturl()
 
-        else:
-            self._terminal.set_title(page.title)
+            self._show_page(page)
 
-        self.apply_rules()
-        self.page._rules_changed = True
+        try:
+            with self._span("swap_page", url=self.url):
+                self.call_on_ui(_swap_page).result()
+
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            self._error(exc)
+            return
+
+        self._mark_startup("page routed")
 
     @threaded
     def run_instructions(  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
@@ -258,136 +700,309 @@ class Browser(Application):
                     self._error(ValueError("no widget in response"))
                     return
 
-            result, rules = parse_widget(xml, self._registered_components)
+            with self._span("parse_fragment", url=self.url):
+                result, rules, run_scripts = parse_fragment(
+                    xml, self._registered_components
+                )
 
+            # Scripts & `init` handlers may touch the tree, so they run on the UI thread
             if self.page is None:
+                self.call_on_ui(run_scripts).result()
                 return
 
-            # TODO: There might be cases where we don't want to apply styles immediately,
-            #       like when a future "DELETE" instruction is added.
-            for selector, rule in rules.items():
-                self.page.rule(selector, **rule)
+            def _apply_rules(widget: Widget) -> None:
+                with self._span("fragment_scripts", url=self.url):
+                    run_scripts()
 
-            with open("log", "a") as f:
-                f.write(str(rules) + "\n")
+                page = self.page
+                assert isinstance(page, IncrementalPage)
 
-        self._current_instructions.append(instructions)
+                # TODO: There might be cases where we don't want to apply styles
+                #       immediately, like when a future "DELETE" instruction is added.
+                # pylint: disable-next=protected-access
+                page_owned = set(page._user_rules) - self._fragment_selectors()
 
-        try:  # pylint: disable=too-many-nested-blocks
-            for instr in instructions:
-                if instr.verb.value in HTTPMethod.__members__:
-                    endpoint, container = instr.args
-                    assert endpoint is not None
+                with page.scoped_rules(widget):
+                    added = apply_rule_set(page, rules)
 
-                    body: Widget | Page | None = caller.parent
+                self._fragment_rules[widget] = [
+                    selector for selector in added if selector not in page_owned
+                ]
 
-                    if container is not None:
-                        body = self.find(container)
+                self.forms.track(widget)
 
-                        if body is None:
-                            raise ValueError(f"nothing matched selector {container!r}")
+            with self._span("apply_rules", url=self.url):
+                self.call_on_ui(partial(_apply_rules, result)).result()
 
-                    if not isinstance(body, Widget):
-                        raise ValueError(f"request body {body!r} is not serializable")
+        def _update_tree(
+            instr: Instruction,
+            result: Widget,
+            discard: Callable[[Widget], None] | None = None,
+            rollback: TreeSnapshot | None = None,
+        ) -> None:
+            """Inserts result into the tree as described by a tree instruction.
 
-                    content = body.serialize()
+            Args:
+                instr: The tree instruction to execute.
+                result: The widget to insert.
+                discard: Called with the widgets that get removed, defaults to
+                    discarding their rules & Lua environments.
+                rollback: An optimistic update to roll back first, in the same frame.
+            """
 
-                    self._http(
-                        HTTPMethod(instr.verb.value), endpoint, content, _set_result
-                    ).join()
+            discard = discard or self._discard_subtree
 
-                    continue
+            if rollback is not None:
+                for widget in rollback.restore():
+                    self._discard_subtree(widget)
 
-                if instr.verb.value in TreeMethod.__members__:
-                    if result is None:
-                        raise ValueError("no result to update tree with")
+                self.queries.changed(*rollback.roots)
 
-                    selector, modifier = instr.args
-                    assert selector is not None
+            selector, modifier = instr.args
+            assert selector is not None
 
-                    target = self.find(selector)
+            target = self.find(selector)
 
-                    if target is None:
-                        raise ValueError(f"nothing matched selector {selector!r}")
+            if target is None:
+                raise ValueError(f"nothing matched selector {selector!r}")
 
-                    if not isinstance(target, Container):
+            if not isinstance(target, Container):
+                raise ValueError(f"cannot modify tree of non-container {target!r}")
+
+            if instr.verb is Verb.SWAP:
+                offsets = {"before": -1, None: 0, "after": 1}
+
+                if modifier == "IN":
+                    for child in target.children:
+                        discard(child)
+
+                    target.update_children([result])
+
+                elif modifier in offsets:
+                    if not isinstance(target.parent, Container):
                         raise ValueError(
-                            f"cannot modify tree of non-container {target!r}"
+                            "cannot modify tree of non-container parent of"
+                            + repr(target)
                         )
 
-                    if instr.verb is Verb.SWAP:
-                        offsets = {"before": -1, None: 0, "after": 1}
+                    siblings = target.parent.children
+                    replaced = siblings[siblings.index(target) + offsets[modifier]]
+                    discard(replaced)
 
-                        if modifier == "IN":
-                            target.update_children([result])
+                    target.parent.replace(target, result, offset=offsets[modifier])
 
-                        elif modifier in offsets:
-                            if not isinstance(target.parent, Container):
-                                raise ValueError(
-                                    "cannot modify tree of non-container parent of"
-                                    + repr(target)
-                                )
+                    # `replace` keeps the parent, which would leave it within forms
+                    replaced.parent = None
 
-                            target.parent.replace(
-                                target, result, offset=offsets[modifier]
-                            )
+                else:
+                    raise ValueError(
+                        f"unknown modifier {modifier!r} for verb {instr.verb!r}"
+                    )
 
-                        else:
-                            raise ValueError(
-                                f"unknown modifier {modifier!r} for verb {instr.verb!r}"
-                            )
+            elif instr.verb is Verb.INSERT:
+                if modifier == "IN":
+                    target.insert(0, result)
 
-                    elif instr.verb is Verb.INSERT:
-                        if modifier == "IN":
-                            target.insert(0, result)
+                else:
+                    if not isinstance(target.parent, Container):
+                        raise ValueError(
+                            "cannot modify tree of non-container parent of"
+                            + repr(target)
+                        )
 
-                        else:
-                            if not isinstance(target.parent, Container):
-                                raise ValueError(
-                                    "cannot modify tree of non-container parent of"
-                                    + repr(target)
-                                )
+                    index = target.parent.children.index(target)
+                    offsets = {"before": index, "after": index + 1}
 
-                            index = target.parent.children.index(target)
-                            offsets = {"before": index, "after": index + 1}
+                    if modifier not in offsets:
+                        raise ValueError(
+                            f"unknown modifier {modifier!r} for verb {instr.verb!r}"
+                        )
+
+                    target.parent.insert(offsets[modifier], result)
+
+            elif instr.verb is Verb.APPEND:
+                if modifier != "IN":
+                    raise ValueError(
+                        f"unknown modifier {modifier!r} for verb {instr.verb!r}"
+                    )
+
+                target.append(result)
+
+            assert isinstance(self.page, IncrementalPage)
+            self.page.load_type_rules(result)
+
+        def _update_optimistically(
+            source: str, updates: list[Instruction]
+        ) -> TreeSnapshot:
+            """Snapshots the subtrees updates will modify, then applies source.
+
+            Widgets replaced by the optimistic result are kept, so they can be put
+            back if the request fails.
+            """
+
+            roots: list[Widget | Page | None] = []
+
+            for update in updates:
+                selector, modifier = update.args
+                assert selector is not None
+
+                target = self.find(selector)
+
+                if target is None:
+                    raise ValueError(f"nothing matched selector {selector!r}")
+
+                roots.append(target if modifier == "IN" else target.parent)
+
+            if not updates:
+                roots.append(caller.parent)
+
+            snapshot = TreeSnapshot(root for root in roots if isinstance(root, Widget))
+
+            if source.startswith("/"):
+                body = self.local_routes.resolve("GET", source, {})
+
+                if body is None:
+                    raise ValueError(f"no local route answered {source!r}")
+
+                _set_result(ElementTree(body))
+                assert result is not None
+
+                for update in updates:
+                    _update_tree(update, result, discard=lambda _: None)
+
+                return snapshot
+
+            envs = app_envs(lua, self)
+            widget: Widget | Page | None = caller
+            env = None
+
+            while isinstance(widget, Widget) and env is None:
+                env = envs[id(widget)]
+                widget = widget.parent
+
+            func = (env or envs[0])[source]
+
+            if func is None:
+                raise ValueError(f"no Lua function named {source!r}")
+
+            with lua.limited():
+                func(caller)
+
+            return snapshot
+
+        def _roll_back(snapshot: TreeSnapshot) -> None:
+            for widget in snapshot.restore():
+                self._discard_subtree(widget)
+
+            self.queries.changed(*snapshot.roots)
+
+        self._current_instructions.append(instructions)
+
+        optimistic: str | None = None
+        rollback: TreeSnapshot | None = None
 
-                            if modifier not in offsets:
+        try:  # pylint: disable=too-many-nested-blocks
+            for index, instr in enumerate(instructions):
+                with self._span("instruction", verb=instr.verb.value, args=instr.args):
+                    if instr.verb is Verb.OPTIMISTIC:
+                        optimistic = instr.args[0]
+                        continue
+
+                    if instr.verb.value in HTTPMethod.__members__:
+                        endpoint, container = instr.args
+                        assert endpoint is not None
+
+                        body: Widget | Page | None = caller.parent
+
+                        if container is not None:
+                            body = self.find(container)
+
+                            if body is None:
                                 raise ValueError(
-                                    f"unknown modifier {modifier!r}"
-                                    + f" for verb {instr.verb!r}"
+                                    f"nothing matched selector {container!r}"
                                 )
 
-                            target.parent.insert(offsets[modifier], result)
-
-                    elif instr.verb is Verb.APPEND:
-                        if modifier != "IN":
+                        if not isinstance(body, Widget):
                             raise ValueError(
-                                f"unknown modifier {modifier!r} for verb {instr.verb!r}"
+                                f"request body {body!r} is not serializable"
                             )
 
-                        target.append(result)
+                        self.call_on_ui(self.forms.recapture).result()
+                        content = self.forms.collect(body)
 
-                    # TODO: This is hacky as hell, but we need it for widgets to load in
-                    #       .styles
-                    parent = result.parent
-                    self._init_widget(result)
-                    result.parent = parent
+                        snapshot = None
+                        errors: list[Exception] = []
 
-                    continue
+                        if optimistic is not None:
+                            # Updates run until the next request, past any SELECT
+                            updates = []
 
-                if instr.verb is Verb.SELECT:
-                    if result is None:
-                        raise ValueError("no result to select from")
+                            for update in instructions[index + 1 :]:
+                                if update.verb.value in TreeMethod.__members__:
+                                    updates.append(update)
 
-                    if not isinstance(result, Container):
-                        raise ValueError(
-                            f"cannot select from non container ({result!r})"
-                        )
+                                elif update.verb is not Verb.SELECT:
+                                    break
+
+                            snapshot = self.call_on_ui(
+                                partial(_update_optimistically, optimistic, updates)
+                            ).result()
+                            optimistic = None
+
+                            # The server's result replaces ours along with its update
+                            rollback = snapshot if updates else None
+
+                        self._http(
+                            HTTPMethod(instr.verb.value),
+                            endpoint,
+                            content,
+                            _set_result,
+                            encoding=instr.encoding,
+                            on_error=None if snapshot is None else errors.append,
+                        ).join()
+
+                        if errors:
+                            assert snapshot is not None
+
+                            with self._span("rollback", url=endpoint):
+                                self.call_on_ui(partial(_roll_back, snapshot)).result()
+
+                            self._current_instructions.remove(instructions)
+                            return
+
+                        continue
 
-                    assert instr.args[0] is not None
+                    if instr.verb.value in TreeMethod.__members__:
+                        if result is None:
+                            raise ValueError("no result to update tree with")
 
-                    result = self.find(instr.args[0], scope=result)
-                    continue
+                        self.call_on_ui(
+                            partial(_update_tree, instr, result, rollback=rollback)
+                        ).result()
+                        rollback = None
+
+                        continue
+
+                    if instr.verb is Verb.SELECT:
+                        if result is None:
+                            raise ValueError("no result to select from")
+
+                        if not isinstance(result, Container):
+                            raise ValueError(
+                                f"cannot select from non container ({result!r})"
+                            )
+
+                        assert instr.args[0] is not None
+
+                        selected = self.find(instr.args[0], scope=result)
+
+                        if selected is not None and result in self._fragment_rules:
+                            self._fragment_rules[selected] = self._fragment_rules.pop(
+                                result
+                            )
+
+                        result = selected
+                        continue
 
         except Exception as exc:  # pylint: disable=broad-exception-caught
             self._error(exc)
@@ -411,10 +1026,22 @@ class Browser(Application):
 
         self._http(HTTPMethod.GET, self.url, {}, self._xml_page_route)
 
+    def _route_history(self) -> None:
+        """Routes to the history entry at the current offset, from the cache if it can."""
+
+        destination = self.history[-self.history_offset - 1]
+
+        if not self._route_cached(destination):
+            self.route(destination, no_history=True)
+
     def back(self) -> None:
+        """Routes to the previous page in the history, reusing it if it was retained."""
+
         self.history_offset = min(self.history_offset + 1, len(self.history) - 1)
-        self.route(self.history[-self.history_offset-1], no_history=True)
+        self._route_history()
 
     def forward(self) -> None:
+        """Routes to the next page in the history, reusing it if it was retained."""
+
         self.history_offset = max(self.history_offset - 1, 0)
-        self.route(self.history[-self.history_offset-1], no_history=True)
+        self._route_history()
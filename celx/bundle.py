@@ -0,0 +1,342 @@
+"""Offline app bundles, served from a single file without any HTTP involved.
+
+A bundle holds the pages, component libraries, styles & scripts of an app, keyed by
+the paths they would be requested at. It is addressed by a `file://` or
+`celx+bundle://` URL whose path starts with the bundle file's, followed by the page
+to load:
+
+```
+celx run file:///srv/kiosk.celxb/menu
+celx run celx+bundle://kiosk.zip/menu  # relative to the working directory
+```
+
+Two formats are read, both through a memory map of the file:
+
+- zip archives, for bundles put together with any tool
+- indexed bundles written by `write_bundle`: a header, a JSON index of every
+    entry's offset, length & content type, then the entries' contents back to back.
+    Entries are sliced straight out of the map, and XML pages may be stored
+    precompiled into the binary wire format (see `celx.wire`).
+
+Paths resolve to the first entry that exists out of `<path>`, `<path>.celx` (wire
+format), `<path>.xml`, `<path>/index.celx` & `<path>/index.xml`.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import struct
+import zlib
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+from typing import Iterator
+from urllib.parse import unquote, urlparse
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, is_zipfile
+
+from . import wire
+
+__all__ = [
+    "BUNDLE_SCHEMES",
+    "Bundle",
+    "BundleResponse",
+    "open_bundle",
+    "write_bundle",
+]
+
+BUNDLE_SCHEMES = ("file", "celx+bundle")
+
+MAGIC = b"CELXBNDL"
+VERSION = 1
+
+# Magic, version & the length of the index that follows
+HEADER = struct.Struct("<8sIQ")
+
+# The file name & extra field lengths within a zip entry's local header
+ZIP_LOCAL_HEADER_SIZE = 30
+ZIP_NAME_LENGTHS = struct.Struct("<HH")
+ZIP_NAME_LENGTHS_OFFSET = 26
+
+CONTENT_TYPES = {
+    ".celx": wire.CONTENT_TYPE,
+    ".xml": "text/celx",
+    ".yaml": "text/yaml",
+    ".lua": "text/x-lua",
+}
+
+_OPEN_BUNDLES: dict[Path, Bundle] = {}
+_OPEN_LOCK = Lock()
+
+
+def _content_type(name: str) -> str:
+    return CONTENT_TYPES.get(Path(name).suffix, "text/celx")
+
+
+def _candidates(path: str) -> Iterator[str]:
+    """Yields the entry names a request path may be stored under, in order."""
+
+    path = path.strip("/")
+    stem = f"{path}/index" if path else "index"
+
+    if path:
+        yield path
+
+        if wire.is_available():
+            yield f"{path}.celx"
+
+        yield f"{path}.xml"
+
+    if wire.is_available():
+        yield f"{stem}.celx"
+
+    yield f"{stem}.xml"
+
+
+class Bundle:
+    """A memory-mapped bundle file, either a zip archive or an indexed bundle."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._index: dict[str, tuple[int, int, str]] = {}
+        self._deflated: set[str] = set()
+
+        if is_zipfile(path):
+            self._index_zip()
+            return
+
+        magic, version, index_length = HEADER.unpack_from(self._map)
+
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a zip archive or celx bundle")
+
+        if version != VERSION:
+            raise ValueError(f"unsupported bundle version {version!r} in {path}")
+
+        start = HEADER.size
+        index = json.loads(self._map[start : start + index_length])
+        data_start = start + index_length
+
+        self._index = {
+            name: (data_start + offset, length, content_type)
+            for name, (offset, length, content_type) in index.items()
+        }
+
+    def _index_zip(self) -> None:
+        """Indexes where each entry's data starts within the map of a zip archive.
+
+        Only the central directory is read by `ZipFile`, entries are then sliced out
+        of the map (and inflated, if they are compressed) like any other.
+        """
+
+        with ZipFile(self.path) as archive:
+            infos = [info for info in archive.infolist() if not info.is_dir()]
+
+        for info in infos:
+            if info.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+                raise ValueError(
+                    f"unsupported compression for {info.filename!r} in {self.path}"
+                )
+
+            name_length, extra_length = ZIP_NAME_LENGTHS.unpack_from(
+                self._map, info.header_offset + ZIP_NAME_LENGTHS_OFFSET
+            )
+            start = (
+                info.header_offset + ZIP_LOCAL_HEADER_SIZE + name_length + extra_length
+            )
+
+            self._index[info.filename] = (
+                start,
+                info.compress_size,
+                _content_type(info.filename),
+            )
+
+            if info.compress_type == ZIP_DEFLATED:
+                self._deflated.add(info.filename)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def names(self) -> list[str]:
+        """Returns the names of every entry in the bundle."""
+
+        return list(self._index)
+
+    def read(self, name: str) -> bytes:
+        """Returns the contents of an entry."""
+
+        offset, length, _ = self._index[name]
+        data = self._map[offset : offset + length]
+
+        if name in self._deflated:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+
+        return data
+
+    def lookup(self, path: str) -> tuple[str, str] | None:
+        """Finds the entry a request path resolves to.
+
+        Returns:
+            The entry's name & content type, or None if the path isn't bundled.
+        """
+
+        for name in _candidates(path):
+            if name in self._index:
+                return name, self._index[name][2]
+
+        return None
+
+    def close(self) -> None:
+        """Unmaps the bundle file."""
+
+        self._map.close()
+
+
+def open_bundle(url: str) -> tuple[Bundle, str, str]:
+    """Opens (or reuses) the bundle a bundle URL points into.
+
+    The bundle file is the longest prefix of the URL's path that is a file.
+
+    Returns:
+        The bundle, the URL prefix that addresses it & the path within the bundle.
+    """
+
+    parsed = urlparse(url)
+
+    if parsed.scheme == "file":
+        if parsed.netloc not in ("", "localhost"):
+            raise ValueError(f"cannot open remote file URL {url!r}")
+
+        full = unquote(parsed.path)
+        prefix = f"file://{parsed.netloc}"
+
+    else:
+        full = unquote(parsed.netloc + parsed.path)
+        prefix = f"{parsed.scheme}://"
+
+    parts = full.split("/")
+
+    for i in range(len(parts), 0, -1):
+        location = "/".join(parts[:i])
+
+        # Trailing slashes would still resolve to the file
+        if parts[i - 1] == "" or not Path(location).is_file():
+            continue
+
+        path = Path(location).resolve()
+
+        with _OPEN_LOCK:
+            if path not in _OPEN_BUNDLES:
+                _OPEN_BUNDLES[path] = Bundle(path)
+
+            bundle = _OPEN_BUNDLES[path]
+
+        return bundle, prefix + location, "/" + "/".join(parts[i:])
+
+    raise FileNotFoundError(f"no bundle file found in {url!r}")
+
+
+@dataclass
+class BundleResponse:
+    """The parts of a `requests.Response` the browser uses, for bundled entries."""
+
+    url: str
+    status_code: int
+    content: bytes = b""
+    headers: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def text(self) -> str:
+        """Returns the content decoded as UTF-8, which bundled text is stored in."""
+
+        return self.content.decode("utf-8")
+
+    def raise_for_status(self) -> None:
+        """Raises `FileNotFoundError` for missing entries, like requests would."""
+
+        if self.status_code == 404:
+            raise FileNotFoundError(f"{self.url} is not in the bundle")
+
+        if not 200 <= self.status_code < 300:
+            raise OSError(f"bundle responded with {self.status_code} for {self.url}")
+
+    @classmethod
+    def for_request(cls, method: str, url: str) -> BundleResponse:
+        """Answers a request to a bundle URL."""
+
+        if method.upper() != "GET":
+            return cls(url, 405)
+
+        bundle, _, path = open_bundle(url)
+        entry = bundle.lookup(path)
+
+        if entry is None:
+            return cls(url, 404)
+
+        name, content_type = entry
+
+        return cls(url, 200, bundle.read(name), {"Content-Type": content_type})
+
+
+def write_bundle(
+    source: str | Path, output: str | Path, precompile: bool = False
+) -> int:
+    """Writes every file within a directory into a bundle.
+
+    Args:
+        source: The directory to bundle, whose layout mirrors the app's URLs.
+        output: The file to write. Outputs ending in `.zip` are written as zip
+            archives, anything else as an indexed bundle.
+        precompile: Whether to store `.xml` files in the wire format as `.celx`
+            entries, so they needn't be parsed when loaded. Requires `msgpack`.
+
+    Returns:
+        The number of entries written.
+    """
+
+    source = Path(source)
+    files = sorted(path for path in source.rglob("*") if path.is_file())
+    entries: dict[str, tuple[bytes, str]] = {}
+
+    for path in files:
+        name = path.relative_to(source).as_posix()
+        data = path.read_bytes()
+
+        if precompile and path.suffix == ".xml":
+            name = name[: -len(".xml")] + ".celx"
+            data = wire.encode_xml(data)
+
+        entries[name] = (data, _content_type(name))
+
+    if str(output).endswith(".zip"):
+        with ZipFile(output, "w", compression=ZIP_DEFLATED) as archive:
+            for name, (data, _) in entries.items():
+                archive.writestr(name, data)
+
+        return len(entries)
+
+    index: dict[str, tuple[int, int, str]] = {}
+    offset = 0
+
+    for name, (data, content_type) in entries.items():
+        index[name] = (offset, len(data), content_type)
+        offset += len(data)
+
+    encoded_index = json.dumps(index, separators=(",", ":")).encode()
+
+    with open(output, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(encoded_index)))
+        file.write(encoded_index)
+
+        for data, _ in entries.values():
+            file.write(data)
+
+    return len(entries)
@@ -2,10 +2,15 @@ import re
 
 from dataclasses import dataclass
 from enum import Enum
-from typing import Callable
+from functools import lru_cache, partial
+from time import perf_counter
+from typing import Any, Callable
+from weakref import WeakKeyDictionary
 
 from celadon import Widget
 
+from .forms import FORM_ENCODINGS
+
 
 class HTTPMethod(Enum):
     """An enumeration of supported HTTP methods."""
@@ -39,6 +44,10 @@ class Verb(Enum):
     APPEND = TreeMethod.APPEND.value
 
     SELECT = "SELECT"
+    OPTIMISTIC = "OPTIMISTIC"
+
+
+MUTATING_VERBS = (Verb.POST, Verb.PUT, Verb.PATCH, Verb.DELETE)
 
 
 @dataclass
@@ -48,30 +57,180 @@ class Instruction:
     verb: Verb
     args: list[str | None]
 
+    encoding: str = "FORM"
+    """The encoding of the request body for HTTP verbs, set using `AS <encoding>`."""
+
+
+@dataclass
+class Trigger:
+    """Conditions an event must pass before a Chocl callback runs its instructions.
+
+    Set by modifier lines before the first verb:
+
+    ```
+    DEBOUNCE 300ms; CHANGED; MIN-LENGTH 2; GET /search; SWAP IN #results
+    ```
+    """
+
+    debounce_ms: float = 0.0
+    """Only run once no event came in for this long, with the latest value."""
+
+    throttle_ms: float = 0.0
+    """Run at most once per this long. The last event within it runs at its end."""
+
+    changed: bool = False
+    """Only run if the caller's value differs from the one it last ran with."""
+
+    min_length: int = 0
+    """Only run if the caller's value is at least this long."""
+
+
+TRIGGER_MODIFIERS = ("DEBOUNCE", "THROTTLE", "CHANGED", "MIN-LENGTH")
+
+RE_DURATION = re.compile(r"^(\d+(?:\.\d+)?)(ms|s)?$")
+
+
+def _parse_duration(text: str) -> float:
+    """Parses a duration like `300`, `300ms` or `1.5s` into milliseconds."""
+
+    mtch = RE_DURATION.match(text.lower())
 
-def _instruction_runner(instructions: list[Instruction]) -> Callable[[Widget], bool]:
+    if mtch is None:
+        raise ValueError(f"invalid duration {text!r}")
+
+    value = float(mtch[1])
+
+    return value * 1000 if mtch[2] == "s" else value
+
+
+def _parse_modifier(trigger: Trigger, modifier: str, args: list[str]) -> None:
+    """Applies a trigger modifier line to trigger."""
+
+    if modifier == "CHANGED":
+        if args:
+            raise ValueError(f"too many arguments for modifier {modifier!r}")
+
+        trigger.changed = True
+        return
+
+    if len(args) != 1:
+        raise ValueError(f"modifier {modifier!r} takes exactly one argument")
+
+    if modifier == "DEBOUNCE":
+        trigger.debounce_ms = _parse_duration(args[0])
+
+    elif modifier == "THROTTLE":
+        trigger.throttle_ms = _parse_duration(args[0])
+
+    elif modifier == "MIN-LENGTH":
+        if not args[0].isdigit():
+            raise ValueError(f"invalid minimum length {args[0]!r}")
+
+        trigger.min_length = int(args[0])
+
+
+def _instruction_runner(
+    instructions: tuple[Instruction, ...]
+) -> Callable[[Widget], bool]:
     """Creates a function to runs the given instructions on the calller widget's app."""
 
     def _interpret(self: Widget) -> bool:
-        # self.app must be `HttpApplication` by this point.
-        self.app.run_instructions(instructions, self)  # type: ignore
+        # self.app must be `HttpApplication` by this point. Every run gets its own
+        # list, as the app clears it to cancel the run when the page changes.
+        self.app.run_instructions([*instructions], self)  # type: ignore
 
         return True
 
     return _interpret
 
 
-def parse_callback(text: str) -> Callable[[Widget], bool]:
-    """Parses a callback descriptor into a list of Instructions."""
+def _triggered_runner(
+    run: Callable[[Widget], bool], trigger: Trigger
+) -> Callable[[Widget], bool]:
+    """Wraps an instruction runner so it only runs when its trigger allows it.
+
+    Checks happen on the client, before any request is sent. Delayed runs are
+    scheduled on the app's frame scheduler, so they execute on the draw thread.
+    """
+
+    last_values: WeakKeyDictionary[Widget, Any] = WeakKeyDictionary()
+    last_runs: WeakKeyDictionary[Widget, float] = WeakKeyDictionary()
+
+    def _fire(self: Widget) -> bool:
+        value = getattr(self, "value", None)
+
+        if value is not None and len(str(value)) < trigger.min_length:
+            return False
+
+        if trigger.changed:
+            if self in last_values and last_values[self] == value:
+                return False
+
+            last_values[self] = value
+
+        last_runs[self] = perf_counter()
+
+        return run(self)
+
+    def _interpret(self: Widget) -> bool:
+        # Coalesces the delayed runs of this callback on this widget
+        key = ("chocl", id(_interpret), id(self))
+        scheduler = self.app.scheduler  # type: ignore
+
+        if trigger.debounce_ms > 0:
+            scheduler.timeout(trigger.debounce_ms, partial(_fire, self), key=key)
+            return True
+
+        if trigger.throttle_ms > 0 and self in last_runs:
+            elapsed = (perf_counter() - last_runs[self]) * 1000
+
+            if elapsed < trigger.throttle_ms:
+                scheduler.timeout(
+                    trigger.throttle_ms - elapsed, partial(_fire, self), key=key
+                )
+                return True
+
+        scheduler.cancel_timeout(key)
+        _fire(self)
+
+        return True
+
+    return _interpret
+
+
+@lru_cache(maxsize=1024)
+def _compile_callback(text: str) -> tuple[tuple[Instruction, ...], Trigger | None]:
+    """Parses a callback descriptor into its instructions & trigger, memoized by text.
+
+    The results are shared by every widget (and every browser in the process) using
+    the same descriptor, so they must not be mutated.
+    """
 
     lines = re.split("[;\n]", text)
 
     instructions = []
+    trigger = None
     first = True
 
     for line in lines:
         verb_str, *args = line.strip().split()
-        verb = Verb(verb_str.upper().lstrip(":"))
+        keyword = verb_str.upper().lstrip(":")
+
+        # Trigger modifiers come before the first verb
+        if first and keyword in TRIGGER_MODIFIERS:
+            trigger = trigger or Trigger()
+            _parse_modifier(trigger, keyword, args)
+            continue
+
+        verb = Verb(keyword)
+
+        # Applies to the request after it, which checks that it exists
+        if verb is Verb.OPTIMISTIC:
+            if len(args) != 1:
+                raise ValueError(f"verb {verb!r} takes exactly one argument")
+
+            instructions.append(Instruction(verb, [args[0]]))
+            continue
 
         if first and verb.value not in HTTPMethod.__members__:
             raise ValueError(f"first verb must be an HTTP method, got {verb!r}")
@@ -85,6 +244,21 @@ def parse_callback(text: str) -> Callable[[Widget], bool]:
             instructions.append(Instruction(verb, [args[0]]))
 
         else:
+            encoding = "FORM"
+
+            if (
+                verb.value in HTTPMethod.__members__
+                and len(args) > 2
+                and args[-2].upper() == "AS"
+            ):
+                encoding = args[-1].upper()
+                args = args[:-2]
+
+                if encoding not in FORM_ENCODINGS:
+                    raise ValueError(
+                        f"unknown encoding {encoding!r}, expected one of {FORM_ENCODINGS}"
+                    )
+
             if len(args) > 2:
                 raise ValueError(f"too many arguments for verb {verb!r}")
 
@@ -93,8 +267,31 @@ def parse_callback(text: str) -> Callable[[Widget], bool]:
 
             if len(args) == 2:
                 modifier, arg = args
-                modifier = modifier.upper()
 
-            instructions.append(Instruction(verb, [arg, modifier]))
+                # HTTP verbs take a container selector, which is case sensitive
+                if verb.value not in HTTPMethod.__members__:
+                    modifier = modifier.upper()
+
+            instructions.append(Instruction(verb, [arg, modifier], encoding))
+
+    for i, instr in enumerate(instructions):
+        if instr.verb is Verb.OPTIMISTIC and (
+            i + 1 == len(instructions) or instructions[i + 1].verb not in MUTATING_VERBS
+        ):
+            raise ValueError(
+                "OPTIMISTIC must be followed by a POST, PUT, PATCH or DELETE request"
+            )
+
+    return tuple(instructions), trigger
+
+
+def parse_callback(text: str) -> Callable[[Widget], bool]:
+    """Parses a callback descriptor into a function that runs its instructions."""
+
+    instructions, trigger = _compile_callback(text)
+    runner = _instruction_runner(instructions)
+
+    if trigger is not None:
+        return _triggered_runner(runner, trigger)
 
-    return _instruction_runner(instructions)
+    return runner
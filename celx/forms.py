@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable
+from weakref import WeakKeyDictionary, WeakSet
+
+from celadon import Widget
+
+__all__ = ["FormSnapshot", "FORM_ENCODINGS", "encode_form"]
+
+FORM_ENCODINGS = ("FORM", "JSON", "MULTIPART")
+
+
+def _is_input(widget: Widget) -> bool:
+    """Determines whether a widget contributes to serialized form data."""
+
+    return (
+        getattr(widget, "name", None) is not None
+        and type(widget).serialize is not Widget.serialize
+    )
+
+
+def _is_within(widget: Widget, scope: Widget) -> bool:
+    """Determines whether `scope` is the widget or one of its ancestors."""
+
+    current: Any = widget
+
+    while current is not None:
+        if current is scope:
+            return True
+
+        current = getattr(current, "parent", None)
+
+    return False
+
+
+class FormSnapshot:
+    """An up-to-date copy of the values of all tracked input widgets.
+
+    Values are captured on the UI thread as inputs change (after keyboard & mouse
+    events, change events and builds), so collecting a form's data never has to call
+    `serialize` on the widget tree. This makes `collect` safe to use from network
+    threads, and its cost proportional to the number of inputs rather than widgets.
+    Inputs whose values were set by scripts are captured again by `recapture`, which
+    should be called on the UI thread before collecting.
+
+    Inputs are stored under the root they were tracked by (a page or a fragment),
+    so only the roots overlapping a form are looked at when collecting it.
+    """
+
+    def __init__(self) -> None:
+        self._roots: WeakKeyDictionary[
+            Widget, WeakKeyDictionary[Widget, dict[str, Any]]
+        ] = WeakKeyDictionary()
+        self._root_of: WeakKeyDictionary[Widget, Widget] = WeakKeyDictionary()
+        self._stale: WeakSet[Widget] = WeakSet()
+        self._lock = Lock()
+
+    def _capture(self, widget: Widget) -> None:
+        """Stores the current value of an input widget."""
+
+        data = widget.serialize()
+
+        with self._lock:
+            root = self._root_of.get(widget)
+
+            if root is not None:
+                self._roots[root][widget] = data
+                self._stale.discard(widget)
+
+    def _capture_after(self, widget: Widget, method: Callable[..., Any]) -> Callable:
+        """Wraps a widget method so the widget's value is captured after each call."""
+
+        @wraps(method)
+        def _inner(*args: Any, **kwargs: Any) -> Any:
+            result = method(*args, **kwargs)
+            self._capture(widget)
+
+            return result
+
+        return _inner
+
+    def _capture_listener(self, widget: Widget) -> Callable[..., bool]:
+        """Returns an event listener that captures the widget's value."""
+
+        def _listener(*_: Any) -> bool:
+            self._capture(widget)
+            return False
+
+        return _listener
+
+    def track(self, root: Widget) -> None:
+        """Starts tracking every input widget within root."""
+
+        with self._lock:
+            self._roots.setdefault(root, WeakKeyDictionary())
+
+        for widget in root.drawables():
+            if widget in self._root_of or not _is_input(widget):
+                continue
+
+            with self._lock:
+                self._root_of[widget] = root
+
+            self._capture(widget)
+
+            widget.handle_keyboard = self._capture_after(  # type: ignore
+                widget, widget.handle_keyboard
+            )
+            widget.handle_mouse = self._capture_after(  # type: ignore
+                widget, widget.handle_mouse
+            )
+
+            # Catches values set from scripts before the widget is next drawn
+            widget.pre_build += self._capture_listener(widget)
+
+            if hasattr(widget, "on_change"):
+                widget.on_change += self._capture_listener(widget)
+
+    def forget(self, scope: Widget) -> None:
+        """Stops tracking every input within scope, and the roots within it."""
+
+        with self._lock:
+            for root in [*self._roots]:
+                if not _is_within(root, scope):
+                    continue
+
+                for widget in self._roots.pop(root):
+                    self._root_of.pop(widget, None)
+                    self._stale.discard(widget)
+
+            for widget, root in [*self._root_of.items()]:
+                if _is_within(widget, scope):
+                    del self._root_of[widget]
+                    self._roots[root].pop(widget, None)
+                    self._stale.discard(widget)
+
+    def invalidate(self, widget: Widget) -> None:
+        """Marks an input whose value is being set outside of its own events.
+
+        Its value is captured again by the next call to `recapture`.
+        """
+
+        with self._lock:
+            if widget in self._root_of:
+                self._stale.add(widget)
+
+    def recapture(self) -> None:
+        """Captures the values of inputs marked by `invalidate`, on the UI thread."""
+
+        with self._lock:
+            stale = [*self._stale]
+
+        for widget in stale:
+            self._capture(widget)
+
+    def collect(self, scope: Widget) -> dict[str, Any]:
+        """Returns the captured values of all tracked inputs within scope.
+
+        Inputs that are no longer within scope, like ones removed from the tree, are
+        skipped.
+        """
+
+        with self._lock:
+            roots = [(root, [*values.items()]) for root, values in self._roots.items()]
+
+        data: dict[str, Any] = {}
+
+        for root, items in roots:
+            if not (_is_within(root, scope) or _is_within(scope, root)):
+                continue
+
+            for widget, values in items:
+                if _is_within(widget, scope):
+                    data.update(values)
+
+        return data
+
+
+def encode_form(
+    method: str, data: dict[str, Any], encoding: str = "FORM"
+) -> dict[str, Any]:
+    """Returns the `requests` keyword arguments that send data in the given encoding.
+
+    GET requests always send data as query parameters.
+    """
+
+    if method == "GET":
+        return {"params": data}
+
+    if encoding == "JSON":
+        return {"json": data}
+
+    if encoding == "MULTIPART":
+        return {"files": {key: (None, str(value)) for key, value in data.items()}}
+
+    if encoding == "FORM":
+        return {"data": data}
+
+    raise ValueError(f"unknown form encoding {encoding!r}, expected {FORM_ENCODINGS}")
@@ -0,0 +1,355 @@
+"""Running browser sessions without a terminal, for load testing & benchmarks.
+
+A `HeadlessBrowser` renders into an in-memory screen of a simulated size, and is
+driven by calling its methods instead of by user input:
+
+```python
+session = HeadlessBrowser("http://localhost:8000")
+session.settle()
+
+session.trigger("Button#submit")
+session.settle()
+
+print(session.text())
+```
+
+Any number of sessions can live in one process. Widgets and Lua scripts refer to a
+single app at a time, so every session is activated while it does any work: its
+responses are handled & its frames are rendered on the thread that drives it, while
+requests still run concurrently in the background.
+"""
+
+from __future__ import annotations
+
+import re
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import cached_property, partial
+from io import StringIO
+from threading import Event, RLock, Thread
+from time import perf_counter, sleep
+from typing import Any, Callable, Iterable, Iterator, TextIO
+
+from celadon import Widget
+from lxml.etree import Element
+from slate import Color, Key, Terminal
+
+from .application import Browser
+from .callbacks import parse_callback
+from .lua import bind_runtime, lua
+
+__all__ = ["HeadlessTerminal", "HeadlessBrowser", "settle_all"]
+
+RE_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+
+_ACTIVATION_LOCK = RLock()
+# The session last activated, see `HeadlessBrowser.activate`
+_ACTIVE: HeadlessBrowser | None = None
+
+
+@dataclass
+class HeadlessTerminal(Terminal):
+    """A terminal of a fixed, simulated size that only ever draws to memory."""
+
+    stream: TextIO = field(default_factory=StringIO)
+    columns: int = 80
+    rows: int = 24
+
+    frames_drawn: int = field(default=0, init=False)
+    last_render: str = field(default="", init=False)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        """Returns the simulated size (width, height) of the terminal."""
+
+        return self.columns, self.rows
+
+    @property
+    def isatty(self) -> bool:
+        return False
+
+    @cached_property
+    def foreground_color(self) -> Color:
+        return Color.white()
+
+    @cached_property
+    def background_color(self) -> Color:
+        return Color.black()
+
+    def resize(self, size: tuple[int, int]) -> None:
+        """Simulates the terminal being resized."""
+
+        self.columns, self.rows = size
+        self.on_resize(size)
+
+    def write_control(self, sequence: str, flush: bool = True) -> None:
+        """Discards control sequences, as there is nothing to send them to."""
+
+    def draw(self, redraw: bool = False) -> None:
+        """Renders the screen's changes, keeping them in `last_render`."""
+
+        self.last_render = self._screen.render(origin=self.origin, redraw=redraw)
+        self.frames_drawn += 1
+
+    def lines(self) -> list[str]:
+        """Returns the characters on the screen, row by row, without styling."""
+
+        return [
+            RE_ANSI.sub("", "".join(cell[0] for cell in row))
+            for row in self._screen._cells  # pylint: disable=protected-access
+        ]
+
+
+class HeadlessBrowser(Browser):
+    """A browser session rendered to a `HeadlessTerminal`, driven by its methods."""
+
+    _terminal: HeadlessTerminal
+
+    def __init__(
+        self,
+        domain: str,
+        size: tuple[int, int] = (80, 24),
+        terminal: HeadlessTerminal | None = None,
+        **browser_args: Any,
+    ) -> None:
+        """Initializes the session, and starts loading domain.
+
+        Args:
+            domain: The URL to load first.
+            size: The (width, height) of the simulated terminal.
+            terminal: The terminal to render to, instead of a simulated one of size.
+            **browser_args: Passed on to `Browser`.
+        """
+
+        self._workers: list[Thread] = []
+        self._started = Event()
+        self._last_frame = perf_counter()
+
+        browser_args.setdefault("title", "celx")
+        terminal = terminal or HeadlessTerminal(columns=size[0], rows=size[1])
+
+        global _ACTIVE  # pylint: disable=global-statement
+
+        with _ACTIVATION_LOCK:
+            super().__init__(domain, terminal=terminal, **browser_args)
+            _ACTIVE = self
+
+        # Headless sessions are always "running", so mutations wait for a frame
+        self._is_running = True
+        self._started.set()
+
+    @contextmanager
+    def activate(self) -> Iterator[HeadlessBrowser]:
+        """Makes this the session that widgets & Lua scripts refer to as their app.
+
+        Activations are exclusive, so sessions may be driven from multiple threads.
+        """
+
+        global _ACTIVE  # pylint: disable=global-statement
+
+        with _ACTIVATION_LOCK:
+            if _ACTIVE is not self:
+                Widget.app = self
+                bind_runtime(lua, self)
+                _ACTIVE = self
+
+            yield self
+
+    def stop(self) -> None:
+        """Stops the session, which stops it from being the active one."""
+
+        global _ACTIVE  # pylint: disable=global-statement
+
+        with _ACTIVATION_LOCK:
+            super().stop()
+
+            if _ACTIVE is self:
+                _ACTIVE = None
+                Widget.app = None  # type: ignore[assignment]
+
+    @property
+    def busy(self) -> bool:
+        """Determines whether requests, mutations or Lua tasks are still pending.
+
+        Timers are not counted, as they may keep recurring forever.
+        """
+
+        self._workers = [thread for thread in self._workers if thread.is_alive()]
+
+        return bool(self._workers or not self._ui_queue.empty() or self.scheduler.busy)
+
+    def _http(self, *args: Any, **kwargs: Any) -> Thread:
+        thread = super()._http(*args, **kwargs)
+        self._workers.append(thread)
+
+        return thread
+
+    def run_instructions(self, *args: Any, **kwargs: Any) -> Thread:
+        thread = super().run_instructions(*args, **kwargs)
+        self._workers.append(thread)
+
+        return thread
+
+    def _handle_response(
+        self, handler: Callable[[Element], None], tree: Element
+    ) -> None:
+        """Handles responses on the driving thread, where the session is active."""
+
+        self._started.wait()
+        self.call_on_ui(partial(handler, tree)).result()
+
+    def _run_timeouts(self, elapsed_ms: float) -> None:
+        """Counts down `Application.timeout` callbacks, running the due ones."""
+
+        remaining = []
+
+        for callback, timeout in self._timeouts:
+            timeout -= elapsed_ms
+
+            if timeout <= 0:
+                callback()
+                self._should_draw = True
+                continue
+
+            remaining.append((callback, timeout))
+
+        self._timeouts = remaining
+
+    def frame(self) -> bool:
+        """Runs & renders a single frame.
+
+        Returns:
+            Whether anything was redrawn.
+        """
+
+        with self.activate():
+            terminal = self._terminal
+            width, height = terminal.size
+            did_draw = False
+
+            if self.apply_rules() or self._should_draw:
+                terminal.clear()
+
+                for widget in sorted(
+                    [*(self._page or []), *self._children], key=lambda w: w.layer
+                ):
+                    widget.compute_dimensions(width, height)
+
+                    for child in widget.drawables():
+                        origin = child.clipped_position
+
+                        for i, line in enumerate(child.build()):
+                            terminal.write(line, cursor=(origin[0], origin[1] + i))
+
+                self._should_draw = False
+                did_draw = True
+
+            terminal.draw()
+
+            self.on_frame_drawn(self)
+            self.on_frame_drawn.clear()
+
+            now = perf_counter()
+            self._run_timeouts((now - self._last_frame) * 1000)
+            self._last_frame = now
+
+        if self._raised is not None:
+            raise self._raised
+
+        return did_draw
+
+    def settle(self, timeout: float = 10.0) -> bool:
+        """Renders frames until the session is no longer busy.
+
+        Raises:
+            Any error the session ran into.
+
+        Returns:
+            Whether the session settled within timeout seconds.
+        """
+
+        deadline = perf_counter() + timeout
+
+        while True:
+            drew = self.frame()
+
+            if not self.busy:
+                return True
+
+            if perf_counter() >= deadline:
+                return False
+
+            if not drew:
+                sleep(0.001)
+
+    def navigate(self, url: str) -> None:
+        """Starts loading a URL, as if it was typed into the address bar."""
+
+        with self.activate():
+            self.route(url)
+
+    def trigger(self, query: str, event: str = "submit") -> None:
+        """Fires the `on_<event>` event of the widget matching query."""
+
+        with self.activate():
+            widget = self._find_or_fail(query)
+            getattr(widget, f"on_{event}")(widget)
+
+    def dispatch(self, query: str, callback: str) -> None:
+        """Runs a Chocl callback (`GET /path; swap in #body`) as the matched widget."""
+
+        with self.activate():
+            parse_callback(callback)(self._find_or_fail(query))
+
+    def press(self, key: str | Key) -> bool:
+        """Processes a key (like `"enter"` or `"ctrl-p"`) as terminal input."""
+
+        with self.activate():
+            self._should_draw = True
+
+            return self.process_input(key if isinstance(key, Key) else Key((key,)))
+
+    def resize(self, size: tuple[int, int]) -> None:
+        """Resizes the simulated terminal."""
+
+        self._terminal.resize(size)
+
+    def text(self) -> str:
+        """Returns the characters currently on the screen."""
+
+        return "\n".join(self._terminal.lines())
+
+    def _find_or_fail(self, query: str) -> Widget:
+        widget = self.find(query)
+
+        if widget is None:
+            raise ValueError(f"nothing matched selector {query!r}")
+
+        return widget
+
+
+def settle_all(
+    sessions: Iterable[HeadlessBrowser], timeout: float = 10.0
+) -> list[HeadlessBrowser]:
+    """Renders frames for each session in turn until none of them are busy.
+
+    Returns:
+        The sessions that didn't settle within timeout seconds.
+    """
+
+    deadline = perf_counter() + timeout
+    waiting = list(sessions)
+
+    while waiting and perf_counter() < deadline:
+        drew = False
+
+        for session in waiting:
+            drew |= session.frame()
+
+        waiting = [session for session in waiting if session.busy]
+
+        if not drew:
+            sleep(0.001)
+
+    return waiting
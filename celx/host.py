@@ -0,0 +1,265 @@
+"""Serving many terminal users from a single process.
+
+A `SessionHost` runs one browser session per connected terminal (an SSH channel, a
+PTY...), rendering each to the terminal's output stream and feeding it the input
+read from it:
+
+```python
+host = SessionHost("http://localhost:8000")
+Thread(target=host.serve_forever, daemon=True).start()
+
+# For every connection
+session = host.open(channel, size=(80, 24))
+host.feed(session, data)       # whenever input arrives
+host.resize(session, (120, 40)) # whenever the window changes
+host.close(session)            # once the connection ends
+```
+
+Sessions share everything that doesn't change while they run: the Lua runtime,
+parsed style rules, selectors & Chocl callbacks are cached per process, and the
+styles, scripts & component libraries pages source with `src` are fetched once per
+host (see `SubresourceCache`). Each session keeps its own widgets, page scripts'
+globals & widget environments.
+
+For preforked pools, calling `warm` before forking fills the caches once, after
+which the workers share them copy-on-write.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Future
+from functools import partial
+from io import StringIO
+from queue import Empty, SimpleQueue
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Any, Callable, TextIO, TypeVar
+
+from slate import Key
+from slate.core import POSIX_KEY_NAMES, parse_mouse_event
+
+from .headless import HeadlessBrowser, HeadlessTerminal
+
+__all__ = ["SubresourceCache", "StreamTerminal", "SessionHost"]
+
+T = TypeVar("T")
+
+# Alternate buffer, hidden cursor & SGR mouse reporting
+ENTER_SEQUENCE = "\x1b[?1049h\x1b[?25l\x1b[?1000h\x1b[?1006h"
+LEAVE_SEQUENCE = "\x1b[?1006l\x1b[?1000l\x1b[?25h\x1b[?1049l"
+
+
+class SubresourceCache:
+    """Sourced styles, scripts & component libraries shared by many browsers.
+
+    Each URL is only loaded once, concurrent loads of it wait for the first one.
+    Entries are assumed not to change while the cache is in use.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, Future] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, url: str, load: Callable[[], T]) -> T:
+        """Returns the cached entry for url, calling load to create it if needed.
+
+        Failed loads aren't cached, so the next call tries again.
+        """
+
+        with self._lock:
+            future = self._entries.get(url)
+            owner = future is None
+
+            if future is None:
+                future = self._entries[url] = Future()
+
+        if owner:
+            try:
+                future.set_result(load())
+
+            except Exception as exc:
+                with self._lock:
+                    del self._entries[url]
+
+                future.set_exception(exc)
+                raise
+
+        return future.result()
+
+    def clear(self) -> None:
+        """Drops every entry, so they are loaded again on next use."""
+
+        with self._lock:
+            self._entries.clear()
+
+
+class StreamTerminal(HeadlessTerminal):
+    """A terminal of a size told by its connection, that draws to its stream."""
+
+    def write_control(self, sequence: str, flush: bool = True) -> None:
+        self.stream.write(sequence)
+
+        if flush:
+            self.stream.flush()
+
+    def draw(self, redraw: bool = False) -> None:
+        super().draw(redraw)
+
+        if self.last_render:
+            self.write_control(self.last_render)
+
+
+def _parse_keys(data: str) -> Key:
+    """Converts raw terminal input to a key, the same way `slate.getch` does."""
+
+    if event := parse_mouse_event("\x1b" + data.split("\x1b")[-1]):
+        return Key((event,))
+
+    return Key(POSIX_KEY_NAMES.get(data, (data,)))
+
+
+class SessionHost:
+    """Runs a browser session for each connected terminal, rendering them in turn."""
+
+    def __init__(self, domain: str, framerate: int = 60, **browser_args: Any) -> None:
+        """Initializes the host.
+
+        Args:
+            domain: The URL every session starts at.
+            framerate: The number of frames rendered per second, for each session.
+            **browser_args: Passed on to every session's `Browser`.
+        """
+
+        self.domain = domain
+        self.framerate = framerate
+        self.browser_args = browser_args
+        self.subresources = SubresourceCache()
+
+        self._sessions: dict[HeadlessBrowser, SimpleQueue[Callable[[], Any]]] = {}
+        self._lock = Lock()
+        self._is_running = False
+
+    @property
+    def sessions(self) -> list[HeadlessBrowser]:
+        """Returns the open sessions."""
+
+        with self._lock:
+            return list(self._sessions)
+
+    def open(self, stream: TextIO, size: tuple[int, int]) -> HeadlessBrowser:
+        """Starts a session that renders to stream.
+
+        Args:
+            stream: The terminal's output, like a PTY or an SSH channel.
+            size: The (width, height) of the terminal.
+        """
+
+        terminal = StreamTerminal(stream=stream, columns=size[0], rows=size[1])
+        terminal.write_control(ENTER_SEQUENCE)
+
+        session = HeadlessBrowser(
+            self.domain,
+            terminal=terminal,
+            subresources=self.subresources,
+            **self.browser_args,
+        )
+
+        with self._lock:
+            self._sessions[session] = SimpleQueue()
+
+        return session
+
+    def _queue(self, session: HeadlessBrowser, handle: Callable[[], Any]) -> None:
+        """Queues a call for a session's next frame, ignoring closed sessions."""
+
+        with self._lock:
+            inputs = self._sessions.get(session)
+
+        if inputs is not None:
+            inputs.put(handle)
+
+    def feed(self, session: HeadlessBrowser, data: str) -> None:
+        """Queues input read from a session's terminal, handled on its next frame.
+
+        Input for sessions that were already closed is ignored.
+        """
+
+        self._queue(session, partial(session.press, _parse_keys(data)))
+
+    def resize(self, session: HeadlessBrowser, size: tuple[int, int]) -> None:
+        """Queues a resize of a session's terminal, handled on its next frame.
+
+        Resizes of sessions that were already closed are ignored.
+        """
+
+        self._queue(session, partial(session.resize, size))
+
+    def close(self, session: HeadlessBrowser) -> None:
+        """Stops a session, and restores its terminal."""
+
+        with self._lock:
+            if self._sessions.pop(session, None) is None:
+                return
+
+        session.stop()
+        session.terminal.write_control(LEAVE_SEQUENCE)
+
+    def warm(self) -> None:
+        """Loads the domain once, filling the caches sessions share."""
+
+        session = self.open(StringIO(), (80, 24))
+        session.settle()
+        self.close(session)
+
+    def step(self) -> None:
+        """Handles the queued input of every session, and renders a frame for each.
+
+        Sessions that run into an error are closed, showing the error.
+        """
+
+        with self._lock:
+            queues = list(self._sessions.items())
+
+        for session, inputs in queues:
+            try:
+                while True:
+                    try:
+                        handle = inputs.get_nowait()
+
+                    except Empty:
+                        break
+
+                    with session.activate():
+                        handle()
+
+                session.frame()
+
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                self.close(session)
+                session.terminal.write_control(f"{type(exc).__name__}: {exc}\r\n")
+
+    def serve_forever(self) -> None:
+        """Renders sessions at the host's framerate, until `stop` is called."""
+
+        frametime = 1 / self.framerate
+        self._is_running = True
+
+        while self._is_running:
+            start = perf_counter()
+            self.step()
+
+            elapsed = perf_counter() - start
+
+            if elapsed < frametime:
+                sleep(frametime - elapsed)
+
+    def stop(self) -> None:
+        """Stops serving, closing every session."""
+
+        self._is_running = False
+
+        for session in self.sessions:
+            self.close(session)
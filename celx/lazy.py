@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Callable
+
+from celadon import Tower, Widget
+from slate import Event
+
+from .callbacks import Instruction, Verb
+from .lua import WIDGET_TYPES
+
+if TYPE_CHECKING:
+    from .application import Browser
+
+__all__ = ["LazyFragment"]
+
+TRIGGERS = ("reveal", "load")
+
+
+class LazyFragment(Tower):
+    """A placeholder that is swapped for a fragment once it is about to be seen.
+
+    When the placeholder comes within `margin` cells of the visible area of every
+    scrolling container it is in (and of the screen), it fires `on_reveal` and, if it
+    has a `src`, replaces itself with the widget returned by:
+
+        GET <src>
+
+    Its children are displayed until then, so they should have the height of the
+    content they stand in for:
+
+    ```xml
+    <lazy src="/comments" margin="10">
+        <text>Loading comments...</text>
+        <style> height: 20 </style>
+    </lazy>
+    ```
+
+    Without a `src`, `on-reveal` can be used to do anything else, like appending more
+    rows to a list:
+
+    ```xml
+    <lazy on-reveal=":GET /rows?page=2; swap #more"></lazy>
+    ```
+
+    With `trigger="load"`, the fragment is fetched as soon as the placeholder is
+    first displayed instead, letting the rest of the page render first.
+    """
+
+    app: Browser
+
+    on_reveal: Event
+
+    def __init__(
+        self,
+        *children: Widget,
+        src: str = "",
+        trigger: str = "reveal",
+        margin: int = 0,
+        on_reveal: list[Callable[[LazyFragment], bool]] | None = None,
+        **widget_args: Any,
+    ) -> None:
+        """Initializes the placeholder.
+
+        Args:
+            src: The endpoint the fragment is loaded from.
+            trigger: Either "reveal", to load once the placeholder is about to be
+                visible, or "load", to load once it is first displayed.
+            margin: How close (in cells) to the visible area the placeholder needs to
+                be for it to be revealed, so content can be fetched before it's seen.
+            on_reveal: A list of event callbacks to fire when the placeholder is
+                revealed.
+        """
+
+        if trigger not in TRIGGERS:
+            raise ValueError(f"unknown trigger {trigger!r}, expected one of {TRIGGERS}")
+
+        super().__init__(*children, **widget_args)
+
+        self.src = src
+        self.trigger = trigger
+        self.margin = margin
+
+        self.on_reveal = Event("lazy fragment revealed")
+        for callback in on_reveal or []:
+            self.on_reveal += callback
+
+        self._revealed = False
+        self._has_built = False
+
+    def _is_in_view(self) -> bool:
+        """Determines whether we are within `margin` of every area that clips us."""
+
+        margin = self.margin
+
+        left, top = self.position
+        right = left + self.computed_width
+        bottom = top + self.computed_height
+
+        areas = []
+        parent = self.parent
+
+        while isinstance(parent, Widget):
+            areas.append(parent.inner_rect)
+            parent = parent.parent
+
+        if self.app is not None:
+            width, height = self.app.terminal.size
+            areas.append(((0, 0), (width, height)))
+
+        for (start_x, start_y), (end_x, end_y) in areas:
+            if (
+                right <= start_x - margin
+                or left >= end_x + margin
+                or bottom <= start_y - margin
+                or top >= end_y + margin
+            ):
+                return False
+
+        return True
+
+    def reveal(self) -> None:
+        """Fires `on_reveal`, and loads the fragment if there is a `src`.
+
+        This only happens once, calling it again does nothing.
+        """
+
+        if self._revealed:
+            return
+
+        self._revealed = True
+        self.on_reveal(self)
+
+        if self.src == "":
+            return
+
+        query = self.as_query()
+
+        # The placeholder is sent as the (empty) body, so no form data is included
+        self.app.run_instructions(
+            [
+                Instruction(Verb.GET, [self.src, query]),
+                Instruction(Verb.SWAP, [query, None]),
+            ],
+            self,
+        )
+
+    def build(
+        self, *, virt_width: int | None = None, virt_height: int | None = None
+    ) -> list[tuple[Any, ...]]:
+        """Builds the placeholder, revealing it if it is in view."""
+
+        lines = super().build(virt_width=virt_width, virt_height=virt_height)
+
+        if self._revealed:
+            return lines
+
+        if self.trigger == "load":
+            self.reveal()
+
+        # Shrinking siblings are only measured as they are built, so our position is
+        # only right from the frame after the one we were first built in
+        elif not self._has_built:
+            self._has_built = True
+
+            if self.app is not None:
+                self.app._should_draw = True  # pylint: disable=protected-access
+
+        elif self._is_in_view():
+            self.reveal()
+
+        return lines
+
+
+WIDGET_TYPES["lazy"] = LazyFragment
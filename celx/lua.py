@@ -1,16 +1,22 @@
 from __future__ import annotations
 
-from functools import partial
-from typing import TYPE_CHECKING, Any, Callable, Type, TypeVar
-from textwrap import dedent
+import os
+import sys
+from dataclasses import dataclass
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Type
+from weakref import ReferenceType, WeakKeyDictionary, ref
 
-from lupa import LuaRuntime  # type: ignore # pylint: disable=no-name-in-module
 from celadon import Widget, widgets
 from zenith import zml_alias, zml_macro, MacroType, zml_escape, zml_expand_aliases
 
 from .callbacks import parse_callback
+from .queries import note_set
 
 if TYPE_CHECKING:
+    # pylint: disable-next=no-name-in-module
+    from lupa import LuaRuntime, LuaTable  # type: ignore
+
     from .application import HttpApplication
 
 WIDGET_TYPES = {
@@ -19,7 +25,30 @@ WIDGET_TYPES = {
     if isinstance(value, type) and issubclass(value, Widget)
 }
 
-LuaTable = TypeVar("LuaTable")
+# The environment variable naming the file all executed Lua code is appended to
+LUA_LOG_VAR = "CELX_LUA_LOG"
+
+INLINE_STYLES: WeakKeyDictionary[Widget, dict[str, str]] = WeakKeyDictionary()
+_APP_FACTORIES: WeakKeyDictionary[Any, LuaTable] = WeakKeyDictionary()
+_APP_SCOPES: WeakKeyDictionary[Any, LuaTable] = WeakKeyDictionary()
+_APP_ENVS: WeakKeyDictionary[Any, LuaTable] = WeakKeyDictionary()
+
+# The sandbox globals `_app_bindings` may point at an app
+APP_BINDINGS = (
+    "app",
+    "timeout",
+    "routes",
+    "find",
+    "query",
+    "cancel_timeout",
+    "requestAnimationFrame",
+    "cancelAnimationFrame",
+    "spawn",
+    "w",
+)
+
+# The app the runtime is bound to, see `bind_runtime`
+_BOUND_APP: ReferenceType | None = None
 
 LUA_SCOPE_SETUP = """
 builtins = {
@@ -27,12 +56,13 @@ builtins = {
     next = next,
     pairs = pairs,
     pcall = pcall,
+    xpcall = xpcall,
     tonumber = tonumber,
     tostring = tostring,
     type = type,
     coroutine = { create = coroutine.create, resume = coroutine.resume,
         running = coroutine.running, status = coroutine.status,
-        wrap = coroutine.wrap },
+        wrap = coroutine.wrap, yield = coroutine.yield },
     string = { byte = string.byte, char = string.char, find = string.find,
         format = string.format, gmatch = string.gmatch, gsub = string.gsub,
         len = string.len, lower = string.lower, match = string.match,
@@ -199,6 +229,9 @@ sandbox = {
                 return value
             end,
 
+            -- Only reachable through `getmetatable`, which scripts don't have
+            __own = innerScope,
+
             __pairs = function(t)
                 local merged = {{}}
 
@@ -243,9 +276,63 @@ sandbox = {
 }
 """
 
+# Empties a scope created by `initScope`. Sandbox functions keep the scope that last
+# looked them up as their environment, so a released app's scope may stay reachable.
+LUA_SCOPE_CLEAR = """
+function(scope)
+    for _, values in ipairs({scope._children, scope._listeners, getmetatable(scope).__own}) do
+        for key in next, values do
+            values[key] = nil
+        end
+    end
+end
+"""
+
+LUA_HANDLER_BINDER = """
+function(envs, ids, widgets, prefixes)
+    local handlers = {}
+
+    for i, id in ipairs(ids) do
+        local env = envs[id]
 
-def _attr_filter(_, attr, __):
-    """Removes access to sunder and dunder attributes in Lua code."""
+        if env ~= nil then
+            env.self = widgets[i]
+
+            -- Only the env's own functions can be handlers, inherited ones are bound
+            -- by the env that defines them
+            for key, value in next, getmetatable(env).__own do
+                if type(key) == "string"
+                    and type(value) == "function"
+                    and sandbox[key] == nil
+                then
+                    local bind = key == "init"
+
+                    for _, prefix in ipairs(prefixes) do
+                        bind = bind or string.sub(key, 1, #prefix) == prefix
+                    end
+
+                    if bind then
+                        -- Flat, so Python gets every handler in a single pass
+                        table.insert(handlers, id)
+                        table.insert(handlers, key)
+                        table.insert(handlers, builtins.setfenv(value, env))
+                    end
+                end
+            end
+        end
+    end
+
+    return handlers
+end
+"""
+
+
+def _attr_filter(obj, attr, is_setting):
+    """Removes access to sunder and dunder attributes in Lua code.
+
+    Attributes being set are reported to the bound app's live query handles & form
+    snapshot. Reads, by far the most common accesses, aren't reported.
+    """
 
     if not isinstance(attr, str):
         return attr
@@ -253,9 +340,44 @@ def _attr_filter(_, attr, __):
     if attr.startswith("_"):
         raise AttributeError("access denied")
 
+    if is_setting:
+        app = _BOUND_APP() if _BOUND_APP is not None else None
+        note_set(getattr(app, "queries", None), obj, attr)
+
+        forms = getattr(app, "forms", None)
+
+        if forms is not None:
+            forms.invalidate(obj)
+
     return attr
 
 
+def _inline_update(widget: Widget) -> Callable[[dict[str, Any], dict[str, str]], None]:
+    """Returns an `update` method that layers inline styles over rule styles."""
+
+    def _update(attrs: dict[str, Any], style_map: dict[str, str]) -> None:
+        widget.__class__.update(widget, attrs, {**style_map, **INLINE_STYLES[widget]})
+
+    return _update
+
+
+def set_inline_style(widget: Widget, key: str, value: str) -> None:
+    """Sets a style on the widget itself, taking precedence over all rules.
+
+    Unlike adding a rule, this doesn't grow the page's rule list, and only the given
+    widget gets restyled.
+    """
+
+    if widget not in INLINE_STYLES:
+        INLINE_STYLES[widget] = {}
+        widget.update = _inline_update(widget)  # type: ignore
+
+    INLINE_STYLES[widget][key] = value
+
+    # Forces the next `apply_rules` to update (only) this widget
+    widget._last_query = None  # pylint: disable=protected-access
+
+
 class LuaStyleWrapper:
     """Wraps a widget's style object for nice Lua syntax.
 
@@ -274,9 +396,7 @@ class LuaStyleWrapper:
 
             return
 
-        self._widget.app.rule(
-            self._widget.as_query(), score=9999, **{f"{attr}_style": value}
-        )
+        set_inline_style(self._widget, attr, value)
 
     def __call__(self, widget: Widget) -> LuaStyleWrapper:
         return self.__class__(widget)
@@ -321,70 +441,385 @@ def _remove_and_callback_with(
     return False
 
 
-def _widget_factory(envs: LuaTable, typ: Type[Widget]) -> Callable[[LuaTable], Widget]:
-    """Lets Lua instantiate widgets.
+# The kinds of keyword values in flattened factory options
+VALUE, LIST, DICT = 0, 1, 2
 
-    ```
-    Button{"label", on_submit={function() alert("hey") end }}
-    ```
+# The number of flattened slots `w.many` collects before calling into Python
+MANY_BATCH_SLOTS = 256
+
+# Keyword arguments that take a list of event handlers
+EVENT_KWARG_PREFIXES = ("on_", "pre_")
+
+LUA_WIDGET_BRIDGE = """
+function(create, create_many)
+    local function is_integer(key)
+        return math.type(key) == "integer"
+    end
+
+    -- Appends a factory call's options to `out`, so they can be passed to Python in
+    -- a single call. Each call is laid out as:
+    --
+    --   n_args, n_slots, args..., (key, VALUE, value | key, LIST, count, items... |
+    --   key, DICT, count, (key, value)...)...
+    --
+    -- where `n_slots` is the number of slots after it that belong to the call.
+    local function flatten(out, n, options)
+        local header = n
+        local n_args = 0
+        n = n + 2
+
+        for key, value in pairs(options) do
+            if is_integer(key) then
+                n = n + 1
+                out[n] = value
+                n_args = n_args + 1
+            end
+        end
+
+        for key, value in pairs(options) do
+            if not is_integer(key) then
+                n = n + 1
+                out[n] = key
+
+                if type(value) == "table" then
+                    local kind = %(list)d
+
+                    if key ~= "groups" then
+                        for inner in pairs(value) do
+                            if not is_integer(inner) then
+                                kind = %(dict)d
+                                break
+                            end
+                        end
+                    end
+
+                    local count = 0
+                    local count_at = n + 2
+                    out[n + 1] = kind
+                    n = count_at
+
+                    for inner, item in pairs(value) do
+                        if kind == %(dict)d then
+                            n = n + 1
+                            out[n] = inner
+                        end
+
+                        n = n + 1
+                        out[n] = item
+                        count = count + 1
+                    end
+
+                    out[count_at] = count
+                else
+                    out[n + 1] = %(value)d
+                    out[n + 2] = value
+                    n = n + 2
+                end
+            end
+        end
+
+        out[header + 1] = n_args
+        out[header + 2] = n - header - 2
+
+        return n
+    end
+
+    return setmetatable({
+        many = function(specs)
+            local created = {}
+            local out = {}
+            local n = 0
+
+            -- Passing varargs gets slow past a few hundred, so calls are sent in
+            -- batches
+            local function send()
+                local batch = create_many(specs[1], table.unpack(out, 1, n))
+
+                for _, widget in ipairs(batch) do
+                    created[#created + 1] = widget
+                end
+
+                out = {}
+                n = 0
+            end
+
+            for i = 2, #specs do
+                n = flatten(out, n, specs[i])
+
+                if n >= %(batch)d then
+                    send()
+                end
+            end
+
+            if n > 0 then
+                send()
+            end
+
+            return created
+        end,
+    }, {
+        __index = function(t, key)
+            local build = create(key)
+
+            local function factory(options)
+                local out = {}
+                local n = flatten(out, 0, options)
+
+                return build(table.unpack(out, 1, n))
+            end
+
+            rawset(t, key, factory)
+
+            return factory
+        end
+    })
+end
+""" % {"value": VALUE, "list": LIST, "dict": DICT, "batch": MANY_BATCH_SLOTS}
+
+
+def _unflatten(flat: tuple[Any, ...], start: int) -> tuple[list, dict, int]:
+    """Reads the arguments of one factory call out of flattened options.
+
+    See `LUA_WIDGET_BRIDGE` for the layout.
+
+    Returns:
+        The positional & keyword arguments, and the index the next call starts at.
     """
 
-    setfenv = lua.globals().builtins.setfenv
-    getenv = lua.globals().sandbox.env
+    n_args, n_slots = flat[start], flat[start + 1]
+    i = start + 2
+    end = i + n_slots
+
+    args = list(flat[i : i + n_args])
+    kwargs = {}
+    i += n_args
+
+    while i < end:
+        key, kind = flat[i], flat[i + 1]
+        i += 2
+
+        if kind == VALUE:
+            value = flat[i]
+            i += 1
+
+        else:
+            count = flat[i]
+            i += 1
 
-    widget = None
+            if kind == LIST:
+                value = list(flat[i : i + count])
+                i += count
 
-    def _create(options: LuaTable) -> Widget:
-        nonlocal widget
+            else:
+                items = flat[i : i + 2 * count]
+                value = dict(zip(items[::2], items[1::2]))
+                i += 2 * count
 
-        args = []
-        kwargs = {}
+        if key == "groups":
+            value = tuple(value)
 
-        for key, value in options.items():
-            if isinstance(key, int):
-                args.append(value)
-                continue
+        # Allows `on_submit=function() ... end` in place of a list of handlers
+        elif key.startswith(EVENT_KWARG_PREFIXES) and lua_type(value) == "function":
+            value = [value]
 
-            if key == "groups":
-                value = tuple(value.values())
+        kwargs[key] = value
 
-            # Likely a Lua table
-            elif hasattr(value, "values"):
-                if all(isinstance(val, int) for val in list(value)):
-                    value = [*value.values()]
-                else:
-                    value = dict(value.items())
+    return args, kwargs, end
 
-            if callable(value):
-                value = _scope_func(value)
 
-            kwargs[key] = value
+def _widget_factory(
+    typ: Type[Widget],
+    on_create: Callable[[Widget], None] | None = None,
+) -> Callable[..., Widget]:
+    """Lets Lua instantiate widgets.
+
+    ```
+    Button{"label", on_submit=function() alert("hey") end}
+    ```
+
+    Event handlers may be given as a single function, or a list of them.
+
+    The options table is flattened on the Lua side, so a widget only takes a single
+    call into Python to create. `on_create` is called with every widget the factory
+    creates.
+    """
 
+    def _create(*flat: Any) -> Widget:
+        args, kwargs, _ = _unflatten(flat, 0)
         widget = typ(*args, **kwargs)
+
+        if on_create is not None:
+            on_create(widget)
+
         return widget
 
     return _create
 
 
-def _env_getter(envs: LuaTable) -> Callable[[Widget], LuaTable]:
+def _lazy_factories(
+    runtime: LuaRuntime,
+    on_create: Callable[[Widget], None] | None = None,
+) -> LuaTable:
+    """Returns a table that creates widget factories the first time they are indexed.
+
+    ```
+    w.Button{"label"} -- Builds & caches the `Button` factory
+    ```
+
+    `w.many` creates any number of widgets of one type in a single call:
+
+    ```
+    w.many{"Text", {"first"}, {"second", groups={"muted"}}}
+    ```
+    """
+
+    def _get_type(key: str) -> Type[Widget]:
+        if key.lower() not in WIDGET_TYPES:
+            raise AttributeError(f"unknown widget type {key!r}")
+
+        return WIDGET_TYPES[key.lower()]
+
+    def _create_factory(key: str) -> Callable[..., Widget]:
+        return _widget_factory(_get_type(key), on_create)
+
+    def _create_many(key: str, *flat: Any) -> LuaTable:
+        typ = _get_type(key)
+        created = []
+        start = 0
+
+        while start < len(flat):
+            args, kwargs, start = _unflatten(flat, start)
+            created.append(typ(*args, **kwargs))
+
+            if on_create is not None:
+                on_create(created[-1])
+
+        return runtime.table_from(created)
+
+    return runtime.eval(LUA_WIDGET_BRIDGE)(_create_factory, _create_many)
+
+
+def _env_getter(sandbox: LuaTable) -> Callable[[Widget], LuaTable]:
     def _inner(widget: Widget) -> LuaTable:
-        return envs[id(widget)]
+        return sandbox.envs[id(widget)]
 
     return _inner
 
 
+def _app_bindings(runtime: LuaRuntime, app: "HttpApplication") -> dict[str, Any]:
+    """Returns the sandbox globals that refer to app."""
+
+    bindings = {"app": app, "timeout": app.timeout}
+
+    if hasattr(app, "local_routes"):
+        bindings["routes"] = app.local_routes
+
+    if hasattr(app, "queries"):
+        bindings["find"] = app.queries.find
+        bindings["query"] = app.queries.handle
+
+    scheduler = getattr(app, "scheduler", None)
+
+    if scheduler is not None:
+        bindings.update(
+            timeout=scheduler.timeout,
+            cancel_timeout=scheduler.cancel_timeout,
+            requestAnimationFrame=scheduler.request_frame,
+            cancelAnimationFrame=scheduler.cancel_frame,
+            spawn=scheduler.spawn,
+        )
+
+    # Factories cache themselves once indexed, so they are only created once per app
+    if app not in _APP_FACTORIES:
+        forms = getattr(app, "forms", None)
+
+        _APP_FACTORIES[app] = _lazy_factories(
+            runtime, forms.track if forms is not None else None
+        )
+
+    bindings["w"] = _APP_FACTORIES[app]
+
+    return bindings
+
+
+def _app_scope(runtime: LuaRuntime, app: "HttpApplication") -> LuaTable:
+    """Returns the global scope (`envs[0]`) of app's page scripts.
+
+    Every app gets its own, so apps sharing a runtime don't share script globals.
+    Sandbox globals are looked up live instead of being copied into the scope, which
+    keeps references to the app out of it, and lets `bind_runtime` rebind them.
+    """
+
+    if app not in _APP_SCOPES:
+        _APP_SCOPES[app] = runtime.eval(
+            "sandbox.initScope(setmetatable({}, { __index = sandbox }))"
+        )
+
+    return _APP_SCOPES[app]
+
+
+def app_envs(runtime: LuaRuntime, app: "HttpApplication") -> LuaTable:
+    """Returns the environments of app's widget scripts, by widget id.
+
+    Every app gets its own table, which `bind_runtime` exposes as `sandbox.envs`.
+    Scripts can only reach the environments (and through their `self`, the widgets)
+    of the app they belong to. `[0]` is the app's global scope.
+    """
+
+    envs = _APP_ENVS.get(app)
+
+    if envs is None:
+        envs = _APP_ENVS[app] = runtime.table()
+        envs[0] = _app_scope(runtime, app)
+
+    return envs
+
+
+def bind_runtime(runtime: LuaRuntime, app: "HttpApplication") -> None:
+    """Points the globals that refer to an app (`app`, `timeout`, `w`...) at app.
+
+    This lets multiple apps share a runtime, as long as the right one is bound
+    whenever scripts run. Each app's page scripts have their own global scope.
+    """
+
+    global _BOUND_APP  # pylint: disable=global-statement
+
+    sandbox = runtime.globals().sandbox
+    _BOUND_APP = ref(app)
+
+    for key, value in _app_bindings(runtime, app).items():
+        sandbox[key] = value
+
+    sandbox.envs = app_envs(runtime, app)
+
+    limits = getattr(app, "script_limits", None)
+
+    if limits is not None:
+        runtime.limits = limits
+
+    runtime.set_profiler(getattr(app, "profiler", None))
+    runtime.tracer = getattr(app, "tracer", None)
+
+
 def init_runtime(runtime: LuaRuntime, app: "HttpApplication") -> None:
-    """Sets up the global namespace for the given runtime."""
+    """Sets up the global namespace for the given runtime, and binds it to app.
+
+    The namespace is only set up once per runtime. Later calls only bind it to the
+    new app, so the widget environments of earlier apps are kept.
+    """
+
+    if runtime.globals().sandbox is not None:
+        bind_runtime(runtime, app)
+        return
 
     runtime.execute(LUA_SCOPE_SETUP)
 
     sandbox = runtime.globals().sandbox
     runtime.globals().builtins.table.from_py = runtime.table_from
 
-    sandbox.app = app
-    sandbox.timeout = app.timeout
+    runtime.globals().bind_handlers = runtime.eval(LUA_HANDLER_BINDER)
 
-    sandbox.env = _env_getter(sandbox.envs)
+    sandbox.env = _env_getter(sandbox)
     sandbox.styles = LuaStyleWrapper
     sandbox.chocl = parse_callback
     sandbox.len = len
@@ -395,41 +830,136 @@ def init_runtime(runtime: LuaRuntime, app: "HttpApplication") -> None:
         "escape": zml_escape,
         "expand_aliases": zml_expand_aliases,
     }
-    sandbox.w = {
-        key.title(): _widget_factory(sandbox.envs, value)
-        for key, value in WIDGET_TYPES.items()
-    }
 
-    runtime.execute(
-        dedent(
-            """
-        do table.insert(sandbox.stack, _ENV)
-            scope = {}
-            for k, v in pairs(sandbox) do
-                scope[k] = v
-            end
+    bind_runtime(runtime, app)
 
-            sandbox.envs[0] = sandbox.initScope(scope)
-        end
+
+def release_runtime(runtime: LuaRuntime, app: "HttpApplication") -> None:
+    """Drops everything the runtime holds on to for an app that has stopped.
+
+    Every widget environment refers to its widget, and through it to the app, so
+    they are all emptied, along with the app's global scope. If the app is still
+    bound, the sandbox globals that refer to it are unset.
     """
-        )
-    )
 
+    global _BOUND_APP  # pylint: disable=global-statement
 
-class LoggedLuaRuntime(LuaRuntime):
-    FILE = "debug.lua"
+    envs = _APP_ENVS.pop(app, None)
+    scope = _APP_SCOPES.pop(app, None)
+    _APP_FACTORIES.pop(app, None)
 
-    def execute(self, code: str, **kwargs) -> Any:
-        if self.FILE:
-            with open(self.FILE, "a") as f:
-                f.write(code + "\n")
+    clear = runtime.eval(LUA_SCOPE_CLEAR)
 
-        return super().execute(code, **kwargs)
+    if envs is not None:
+        for key, env in [*envs.items()]:
+            clear(env)
+            envs[key] = None
 
+    if scope is not None:
+        clear(scope)
 
-lua = LoggedLuaRuntime(
-    register_eval=False,
-    register_builtins=False,
-    unpack_returned_tuples=True,
-    attribute_filter=_attr_filter,
-)
+    bound = _BOUND_APP() if _BOUND_APP is not None else None
+
+    if bound is not app:
+        return
+
+    sandbox = runtime.globals().sandbox
+    _BOUND_APP = None
+
+    for key in APP_BINDINGS:
+        sandbox[key] = None
+
+    sandbox.envs = runtime.table()
+
+
+def lua_type(obj: Any) -> str | None:
+    """Returns the Lua type of obj, or None if it isn't a Lua object.
+
+    Unlike `lupa.lua_type`, this doesn't import lupa if no runtime was created yet,
+    since there can't be any Lua objects around in that case.
+    """
+
+    lupa = sys.modules.get("lupa")
+
+    if lupa is None:
+        return None
+
+    return lupa.lua_type(obj)
+
+@dataclass
+class ScriptLimits:
+    """Resource quotas for page scripts.
+
+    Every limited execution (running a widget's script, or one step of an event
+    handler, timeout or animation frame callback) gets the full quota. Exceeding it
+    raises a Lua error in the offending script.
+    """
+
+    max_instructions: int | None = 10_000_000
+    """The number of Lua VM instructions an execution may take."""
+
+    max_memory: int | None = 64 * 1024 * 1024
+    """The number of bytes the runtime's memory use may grow by during an execution."""
+
+
+class LazyRuntime:
+    """Stands in for the shared runtime, creating it when it is first used.
+
+    Importing lupa & building the runtime is left for `init_runtime`, so apps can
+    send their first request before paying for it.
+    """
+
+    def __init__(self, factory: Callable[[], LuaRuntime]) -> None:
+        self._factory = factory
+        self._runtime: LuaRuntime | None = None
+        self._lock = Lock()
+
+    @property
+    def is_created(self) -> bool:
+        """Whether the runtime has been created yet."""
+
+        return self._runtime is not None
+
+    def get(self) -> LuaRuntime:
+        """Returns the runtime, creating it on the first call."""
+
+        if self._runtime is None:
+            with self._lock:
+                if self._runtime is None:
+                    self._runtime = self._factory()
+
+        return self._runtime
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.get(), attr)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        if attr.startswith("_"):
+            super().__setattr__(attr, value)
+            return
+
+        setattr(self.get(), attr, value)
+
+
+def _create_runtime() -> LuaRuntime:
+    """Creates the runtime, logging the code it runs only if `LUA_LOG_VAR` is set."""
+
+    # pylint: disable-next=import-outside-toplevel
+    from .runtime import LimitedLuaRuntime, LoggedLuaRuntime
+
+    log_file = os.environ.get(LUA_LOG_VAR)
+
+    runtime = (LoggedLuaRuntime if log_file else LimitedLuaRuntime)(
+        register_eval=False,
+        register_builtins=False,
+        unpack_returned_tuples=True,
+        attribute_filter=_attr_filter,
+    )
+
+    if log_file:
+        runtime.log_file = log_file
+
+    return runtime
+
+
+lua = LazyRuntime(_create_runtime)
@@ -0,0 +1,79 @@
+"""Snapshots of widget subtrees, so optimistic updates can be rolled back.
+
+A Chocl callback can apply its expected result before its request is answered:
+
+```
+:OPTIMISTIC /todo/pending; POST /todos; APPEND IN #todos
+```
+
+`OPTIMISTIC` takes either the path of a local route (see `celx.routes`), whose
+fragment is placed by the tree instructions after the request, or the name of a Lua
+function that is called in the caller's environment. The subtrees those tree
+instructions target (or the caller's parent, if there are none) are snapshotted
+before, and rolled back if the request fails. If it succeeds, the server's result
+replaces the optimistic one.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+from celadon import Container, Widget
+
+__all__ = ["TreeSnapshot"]
+
+SNAPSHOT_ATTRIBUTES = ("content", "value", "disabled", "groups")
+
+
+class TreeSnapshot:
+    """The children & basic attributes of every widget within some subtrees."""
+
+    def __init__(self, roots: Iterable[Widget]) -> None:
+        self.roots = [*roots]
+
+        self._states: list[tuple[Widget, dict[str, Any]]] = []
+        seen: set[int] = set()
+
+        for root in self.roots:
+            for widget in root.drawables():
+                if id(widget) in seen:
+                    continue
+
+                seen.add(id(widget))
+
+                state = {
+                    key: getattr(widget, key)
+                    for key in SNAPSHOT_ATTRIBUTES
+                    if hasattr(widget, key)
+                }
+
+                if isinstance(widget, Container):
+                    state["children"] = [*widget.children]
+
+                self._states.append((widget, state))
+
+    def restore(self) -> list[Widget]:
+        """Rolls the subtrees back to how they were when the snapshot was taken.
+
+        Returns:
+            The widgets that were added to the subtrees since, and are now removed.
+        """
+
+        removed: list[Widget] = []
+
+        for widget, state in self._states:
+            children = state.get("children")
+
+            if children is not None and isinstance(widget, Container):
+                removed.extend(
+                    child
+                    for child in widget.children
+                    if not any(child is old for old in children)
+                )
+                widget.update_children(children)
+
+            for key in SNAPSHOT_ATTRIBUTES:
+                if key in state and getattr(widget, key) != state[key]:
+                    setattr(widget, key, state[key])
+
+        return removed
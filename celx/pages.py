@@ -0,0 +1,276 @@
+"""The lifecycle of routed pages: which are active, retained or evicted.
+
+Navigating away from a page retains it, so going back to it doesn't request, parse
+& style it again. Only `max_cached_pages` inactive pages are retained, older ones are
+evicted along with their widgets, style rules and Lua environments.
+"""
+
+from __future__ import annotations
+
+import sys
+from concurrent.futures import Future
+from enum import Enum
+from functools import partial
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Iterable
+from urllib.parse import ParseResult, urlparse
+from weakref import WeakKeyDictionary
+
+from celadon import Application, Page, Selector, Widget
+
+from .lua import app_envs, lua
+from .styling import IncrementalRules
+
+if TYPE_CHECKING:
+    from .forms import FormSnapshot
+    from .routes import LocalRoutes
+    from .tracing import Tracer
+
+    # Lets mypy check the mixin against the app it's mixed into
+    _AppMixin = Application
+else:
+    _AppMixin = object
+
+__all__ = ["PageLifecycle", "PageState"]
+
+
+class PageState(Enum):
+    """An enumeration of the lifecycle states a routed page can be in."""
+
+    ACTIVE = "active"
+    CACHED = "cached"
+    EVICTED = "evicted"
+
+
+class PageLifecycle(_AppMixin):  # pylint: disable=too-many-instance-attributes
+    """A `Browser` mixin that retains, shows & evicts routed pages.
+
+    It also tracks the rules owned by fragments, so they are removed along with the
+    last fragment using them. What it uses of `Browser`, beyond `Application`, is
+    declared below.
+    """
+
+    max_cached_pages: int
+    content: Widget
+    url: str
+    forms: FormSnapshot
+    local_routes: LocalRoutes
+    tracer: Tracer | None
+    _url: ParseResult
+    _navigation_start: float
+
+    remove_rules: Callable[[Iterable[Selector]], None]
+    call_on_ui: Callable[[Callable[[], Any]], Future]
+    _span: Callable[..., ContextManager[dict[str, Any]]]
+    _prefix_endpoint: Callable[[str], str]
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._page_states: WeakKeyDictionary[Page, PageState] = WeakKeyDictionary()
+        self._page_selectors: dict[Page, list[Selector]] = {}
+        self._fragment_rules: WeakKeyDictionary[Widget, list[Selector]] = (
+            WeakKeyDictionary()
+        )
+
+        super().__init__(*args, **kwargs)
+
+    @property
+    def page_states(self) -> dict[Page, PageState]:
+        """Returns the lifecycle state of every page still referenced anywhere.
+
+        Evicted pages stay listed until they are garbage collected.
+        """
+
+        return dict(self._page_states.items())
+
+    # Like `Application.rule`, this doesn't take `Page.rule`'s `_builtin` argument
+    def rule(  # type: ignore[override]
+        self, query: str | Selector, score: int | None = None, **rules: Any
+    ) -> Selector:
+        """Creates an app-wide rule, remembering which page it was created under."""
+
+        selector = super().rule(query, score=score, **rules)
+
+        page = getattr(self, "_page", None)
+
+        if page in self._page_selectors:
+            self._page_selectors[page].append(selector)
+
+        return selector
+
+    def _retain_page(self, page: Page) -> None:
+        """Adds a page as the active one, evicting pages beyond the cache limit."""
+
+        for other in [*self._pages]:
+            if other is not page and other.route_name == page.route_name:
+                self._evict_page(other)
+
+        previous = self._page
+
+        if previous is not None and previous is not page:
+            if previous in self._page_states:
+                self._page_states[previous] = PageState.CACHED
+
+        if page not in self._pages:
+            self.append(page)
+
+        self._page_states[page] = PageState.ACTIVE
+        self._page_selectors.setdefault(page, [])
+
+        cached = [
+            other
+            for other in self._pages
+            if self._page_states.get(other) is PageState.CACHED
+        ]
+
+        for other in cached[: max(len(cached) - self.max_cached_pages, 0)]:
+            self._evict_page(other)
+
+    def _evict_page(self, page: Page) -> None:
+        """Frees a page, its widgets, its rules and its Lua environments."""
+
+        envs = app_envs(lua, self)
+
+        for widget in page:
+            self.forms.forget(widget)
+
+            for child in widget.drawables():
+                envs[id(child)] = None
+
+        selectors = self._page_selectors.pop(page, [])
+        self.remove_rules(selectors)
+        self.local_routes.drop(page)
+
+        for other in self._pages:
+            if isinstance(other, IncrementalRules):
+                other.remove_rules(selectors)
+
+        page._user_rules.clear()  # pylint: disable=protected-access
+        page._children.clear()  # pylint: disable=protected-access
+
+        if page in self._pages:
+            self._pages.remove(page)
+
+        self._page_states[page] = PageState.EVICTED
+
+        lua.execute("collectgarbage()")
+
+    def _show_page(self, page: Page) -> None:
+        """Makes a page the active one, retaining the previous one in the cache."""
+
+        self._retain_page(page)
+
+        self._page = page
+        self.content = page[0]
+        self._mouse_target = self.content
+        self.on_page_changed(page)
+
+        if page.route_name == "/":
+            self._terminal.set_title(self.title)
+
+        else:
+            self._terminal.set_title(page.title)
+
+        with self._span("apply_rules", url=page.route_name):
+            Application.apply_rules(self)
+
+        if self.tracer is not None:
+            self.on_frame_drawn += partial(
+                self._record_render, page.route_name, perf_counter()
+            )
+
+    def _route_cached(self, destination: str) -> bool:
+        """Shows the retained page of a URL, instead of requesting it again.
+
+        Returns:
+            Whether a retained page was found for the URL.
+        """
+
+        url = self._prefix_endpoint(destination)
+
+        for page in self._pages:
+            if (
+                page.route_name == url
+                and self._page_states.get(page) is PageState.CACHED
+            ):
+                self._url = urlparse(url)
+                self.url = self._url.geturl()
+                self.call_on_ui(partial(self._show_page, page))
+
+                return True
+
+        return False
+
+    def _fragment_selectors(self) -> set[Selector]:
+        """Returns the selectors of all rules owned by live fragments."""
+
+        return {
+            selector
+            for selectors in self._fragment_rules.values()
+            for selector in selectors
+        }
+
+    def _discard_subtree(self, widget: Widget) -> None:
+        """Removes the rules & Lua environments owned by a widget that is removed.
+
+        Rules that came with a fragment are only removed once no other live fragment
+        uses the same selector.
+        """
+
+        envs = app_envs(lua, self)
+        owned: list[Selector] = []
+
+        self.forms.forget(widget)
+
+        for child in widget.drawables():
+            owned.extend(self._fragment_rules.pop(child, []))
+            envs[id(child)] = None
+
+        if not isinstance(self.page, IncrementalRules) or not owned:
+            return
+
+        still_used = self._fragment_selectors()
+
+        self.page.remove_rules(
+            selector for selector in owned if selector not in still_used
+        )
+
+    def _record_render(self, url: str, swapped: float, _: Application) -> bool:
+        """Records the first frame after a page swap, and the navigation's span."""
+
+        if self.tracer is not None:
+            self.tracer.record("first_render", swapped, perf_counter(), url=url)
+            self.tracer.record(
+                "navigation", self._navigation_start, perf_counter(), url=url
+            )
+
+        return False
+
+    def page_memory(self) -> dict[str, dict[str, Any]]:
+        """Returns an estimate of the memory retained by each page.
+
+        The keys are route names, the values contain the page's lifecycle state, the
+        number of widgets, style rules and Lua environments it holds, and the
+        approximate size of its widgets in bytes.
+        """
+
+        envs = app_envs(lua, self)
+        info = {}
+
+        for page, state in self._page_states.items():
+            if state is PageState.EVICTED:
+                continue
+
+            widgets = [child for widget in page for child in widget.drawables()]
+
+            info[page.route_name] = {
+                "state": state.value,
+                "widgets": len(widgets),
+                "rules": len(page._user_rules),  # pylint: disable=protected-access
+                "envs": sum(envs[id(widget)] is not None for widget in widgets),
+                "bytes": sum(
+                    sys.getsizeof(widget) + sys.getsizeof(vars(widget))
+                    for widget in widgets
+                ),
+            }
+
+        return info
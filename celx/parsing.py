@@ -1,16 +1,20 @@
 import re
-from lxml.etree import Element, fromstring, tostring
-
-import lupa
 from copy import deepcopy
 from dataclasses import dataclass
-from typing import Any, Callable
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Any, Callable
 from textwrap import indent, dedent
+from time import perf_counter
 
-from celadon import Widget, load_rules, Page
+from lxml.etree import Element, fromstring, tostring
+from celadon import Widget, load_rules, Page, Selector
 
-from .lua import lua, LuaTable, WIDGET_TYPES
+from .lua import lua, lua_type, WIDGET_TYPES
 from .callbacks import parse_callback
+from .scheduler import as_task
+
+if TYPE_CHECKING:
+    import lupa
 
 STYLE_TEMPLATE = """\
 {query}:
@@ -34,16 +38,40 @@ if _children then table.insert(_children, envs[{script_id}]) end
 
 """
 
+QUERY_PLACEHOLDER = "__celx_query__"
+
 EVENT_PREFIXES = ("on", "pre")
 
-RE_ERROR_LINENO = re.compile('\[string "<python>"\]:(\d+):')
+RE_ERROR_LINENO = re.compile(r'\[string "<(?:python|celx)>"\]:(\d+):')
+
+@dataclass
+class ScriptChunk:
+    """The Lua chunk built from a widget tree's scripts.
+
+    `origins` maps every line of the chunk (by index) to the script id & 1-based line
+    of the user script it came from, or None for generated lines. `scripts` holds
+    each user script's (dedented) lines.
+    """
+
+    code: str
+    origins: list[tuple[int, int] | None]
+    scripts: dict[int, list[str]]
+
+    def locate(self, line: int) -> tuple[int, int] | None:
+        """Returns the script id & script line a 1-based chunk line came from."""
+
+        if not 0 < line <= len(self.origins):
+            return None
+
+        return self.origins[line - 1]
+
 
 @dataclass
 class RuntimeError(Exception):
     funcname: str
     widget: Widget
-    code: str
-    exc: lupa.LuaError
+    chunk: ScriptChunk
+    exc: "lupa.LuaError"
 
     lineno: int = -1
 
@@ -54,25 +82,23 @@ class RuntimeError(Exception):
         self.lineno = int(match[1]) - 1
 
     def __str__(self):
-        dedented = dedent("\n".join(self.code.splitlines()[self.lineno - 4 : self.lineno + 5]))
-        lines = indent(dedented, 2 * " ").splitlines()
-
-        lines[4] = "> " + dedented.splitlines()[4]
+        message = RE_ERROR_LINENO.sub("", str(self.exc)).strip().split("\n")[0]
+        header = f"error in '{self.funcname}': {message or type(self.exc).__name__}"
+        origin = self.chunk.locate(self.lineno + 1) if self.lineno != -1 else None
 
-        start = None
-        end = None
-
-        for i, line in enumerate(lines):
-            if "-- USER CODE BEGIN" in line:
-                start = i
-                continue
+        if origin is None:
+            return f"{header}\n\n{self.widget.as_query()}"
 
-            if "-- USER CODE END" in line:
-                end = i
+        script_id, line = origin
+        lines = self.chunk.scripts[script_id]
+        start = max(line - 5, 0)
 
-        snippet = "\n".join(lines[start:end])
+        snippet = "\n".join(
+            ("> " if i == line - 1 else "  ") + lines[i]
+            for i in range(start, min(line + 4, len(lines)))
+        )
 
-        return f"error in '{self.funcname}'\n\n{self.widget.as_query()}:\n\n" + dedent(snippet)
+        return f"{header}\n\n{self.widget.as_query()}:\n\n" + snippet
 
 # TODO: This breaks `width: shrink` for text
 def lua_formatted_get_content(scope: dict[str, Any]) -> Callable[[Widget], list[str]]:
@@ -116,64 +142,107 @@ def lua_formatted_get_content(scope: dict[str, Any]) -> Callable[[Widget], list[
     return _get_content
 
 
-def parse_rules(text: str, query: str | None = None) -> dict[str, Any]:
-    """Parses a block of YAML rules into a dictionary."""
+@lru_cache(maxsize=1024)
+def _compile_rules(text: str, scoped: bool) -> dict[str, Any]:
+    """Parses a block of YAML rules, memoized by its text.
 
-    if query is None:
+    Scoped rules are parsed under `QUERY_PLACEHOLDER`, which is substituted for the
+    real query by `parse_rules`. This lets widgets with generated ids share a cache
+    entry.
+    """
+
+    if not scoped:
         style = dedent(text)
     else:
         style = STYLE_TEMPLATE.format(
-            query=query, indented_content=indent(dedent(text), 4 * " ")
+            query=QUERY_PLACEHOLDER, indented_content=indent(dedent(text), 4 * " ")
         )
 
     return load_rules(style)
 
 
-def _extract_script(
-    node: Element, node_to_id: dict[Element, int], outer: bool = False, level: int = 0
-) -> str:
-    """Recursively extracts scripts starting from the given node."""
+@lru_cache(maxsize=1024)
+def _compile_selector(query: str) -> Selector:
+    """Parses a selector, memoized by its query."""
 
-    code = ""
+    return Selector.parse(query)
 
-    if outer:
-        code += "_ENV = sandbox.envs[0]\n\n"
 
-    code += indent(
-        LUA_SCRIPT_BEGIN.format(script_id=node_to_id[node]),
-        level * 4 * " ",
-    )
+def parse_rules(text: str, query: str | None = None) -> dict[str, Any]:
+    """Parses a block of YAML rules into a dictionary.
 
-    for child in node:
-        if child.tag == "style":
-            continue
+    Identical blocks are only parsed once, so repeated components and fragments don't
+    pay for YAML parsing again.
+    """
 
-        if child.tag == "script":
-            code += indent(dedent(child.text), (level + 1) * 4 * " ")
-            continue
+    if query is None:
+        return dict(_compile_rules(text, False))
+
+    return {
+        key.replace(QUERY_PLACEHOLDER, query): rule
+        for key, rule in _compile_rules(text, True).items()
+    }
+
+
+def apply_rule_set(page: Page, rules: dict[str, Any]) -> list[Selector]:
+    """Adds all rules from a parsed rule set to the page as a single batch.
+
+    Returns:
+        The selectors of the rules that were added.
+    """
+
+    return [
+        page.rule(_compile_selector(query), **rule) for query, rule in rules.items()
+    ]
+
+
+def _extract_script(
+    node: Element, node_to_id: dict[Element, int], outer: bool = False
+) -> ScriptChunk:
+    """Extracts the scripts of a widget tree into a single chunk.
+
+    The chunk is emitted into one buffer in a single pass over the tree, so building
+    it takes time linear in the size of the tree & its scripts, however deep it is.
+    """
+
+    parts: list[str] = []
+    origins: list[tuple[int, int] | None] = []
+    scripts: dict[int, list[str]] = {}
+
+    def _emit_generated(text: str) -> None:
+        parts.append(text)
+        origins.extend([None] * text.count("\n"))
+
+    def _emit(node: Element) -> None:
+        script_id = node_to_id[node]
+        _emit_generated(LUA_SCRIPT_BEGIN.format(script_id=script_id))
 
-        code += _extract_script(child, node_to_id, level=level + 1)
+        for child in node:
+            if child.tag == "style":
+                continue
 
-    code += indent(LUA_SCRIPT_END.format(script_id=node_to_id[node]), level * 4 * " ")
+            if child.tag == "script":
+                lines = dedent(child.text or "").splitlines()
+                scripts.setdefault(script_id, []).extend(lines)
 
-    return code
+                offset = len(scripts[script_id]) - len(lines)
 
+                for i, line in enumerate(lines):
+                    parts.append(line + "\n")
+                    origins.append((script_id, offset + i + 1))
 
-def _get_pairs(table: LuaTable) -> list[str]:
-    """Iterates through the `__pairs` of a Lua table."""
+                continue
 
-    iterator, state, first_key = lua.globals().pairs(table)
+            _emit(child)
 
-    while True:
-        item = iterator(state, first_key)
+        _emit_generated(LUA_SCRIPT_END.format(script_id=script_id))
 
-        if item is None:
-            break
+    if outer:
+        _emit_generated("_ENV = sandbox.envs[0]\n\n")
 
-        key, value = item
+    _emit(node)
 
-        yield (key, value)
-        first_key = key
+    return ScriptChunk("".join(parts), origins, scripts)
 
 
 # TODO: Technically rules is more like a `dict[str, dict[str, <something>]]`!
@@ -181,11 +250,12 @@ def parse_widget(
     node: Element,
     components: dict[str, tuple[dict[str, Any], str]],
     parse_script: bool = True,
-    result: dict[str, list[Widget, Element]] | None = None,
+    result: dict[int, tuple[Widget, Element]] | None = None,
 ) -> tuple[Widget, dict[str, Any]]:
     """Parses a widget, its scripts & its styling from an XML node."""
 
-    result = result or {}
+    if result is None:
+        result = {}
 
     init: dict[str, str | tuple[str, ...] | list[Callable[[Widget], bool]]] = {}
 
@@ -308,77 +378,211 @@ def parse_widget(
         if child.tag in WIDGET_TYPES:
             result[id(parsed)] = parsed, child
 
-    if parse_script:
-        code = _extract_script(
-            node, {node: s_id for s_id, [_, node] in result.items()}, outer=True
-        )
-
     if not parse_script:
         return widget, rules
 
+    run_scripts(widget, result, _extract_script(node, _script_ids(result), outer=True))
+
+    return widget, rules
+
+
+def parse_fragment(
+    node: Element, components: dict[str, tuple[dict[str, Any], str]]
+) -> tuple[Widget, dict[str, Any], Callable[[], None]]:
+    """Parses a widget & its styling from an XML node, leaving its scripts for later.
+
+    This lets fragments be parsed on a network thread, while their scripts (and
+    `init` handlers) are run on the draw thread, along with their insertion.
+
+    Returns:
+        The widget, its rules and a callable that runs the widget's scripts.
+    """
+
+    result: dict[int, tuple[Widget, Element]] = {}
+    widget, rules = parse_widget(node, components, parse_script=False, result=result)
+
+    chunk = _extract_script(node, _script_ids(result), outer=True)
+
+    return widget, rules, partial(run_scripts, widget, result, chunk)
+
+
+def _script_ids(result: dict[int, tuple[Widget, Element]]) -> dict[Element, int]:
+    """Maps the nodes of parsed widgets to the ids their scripts are known by."""
+
+    return {node: s_id for s_id, [_, node] in result.items()}
+
+
+def run_scripts(
+    widget: Widget, result: dict[int, tuple[Widget, Element]], chunk: ScriptChunk
+) -> None:
+    """Runs the scripts of a parsed widget tree, and binds their event handlers.
+
+    Args:
+        widget: The root of the parsed tree.
+        result: The widgets & nodes of the tree, keyed by their script ids.
+        chunk: The tree's extracted script.
+    """
+
+    if lua.profiler is not None:
+        for s_id, [owner, _] in result.items():
+            lua.profiler.add_source(s_id, owner, chunk)
+
+    # lupa is loaded along with the runtime, see `celx.lua.LazyRuntime`
+    import lupa  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
     sandbox = lua.eval("sandbox")
     envs = lua.eval("sandbox.envs")
-    setfenv = lua.eval("builtins.setfenv")
+    bind_handlers = lua.eval("bind_handlers")
 
     try:
-        lua.execute(code)
+        with lua.limited():
+            lua.execute_script(chunk.code)
     except lupa.LuaSyntaxError as exc:
         # TODO: This could alert() instead and abort exec
         raise exc
+    except lupa.LuaError as exc:
+        for s_id in result:
+            envs[s_id] = None
 
-    for s_id, [widget, _] in reversed(result.items()):
+        raise RuntimeError("script", widget, chunk, exc) from exc
+
+    # Children are bound (and initialized) before their parents
+    owners = [*reversed(result.items())]
+
+    handlers = bind_handlers(
+        envs,
+        lua.table_from([s_id for s_id, _ in owners]),
+        lua.table_from([owner for _, [owner, _] in owners]),
+        lua.table_from(EVENT_PREFIXES),
+    )
+
+    flat = [*handlers.values()]
+
+    for s_id, key, value in zip(flat[::3], flat[1::3], flat[2::3]):
+        owner = result[s_id][0]
+
+        if key == "init":
+            try:
+                with lua.limited():
+                    value()
+
+            except lupa.LuaError as exc:
+                envs[s_id] = None
+                raise RuntimeError(key, owner, chunk, exc) from exc
+
+            continue
+
+        event = getattr(owner, key, None)
+
+        if event is None:
+            raise ValueError(f"invalid event handler {key!r}")
+
+        # Only `pre` handlers run inline, as their results are used right away
+        spawn = sandbox.spawn if key.startswith("on") else None
+
+        event += _report_env_id(value, s_id, chunk, owner, key, spawn)
+
+    for s_id, [owner, _] in owners:
         env = envs[s_id]
 
         if env is None:
             continue
 
-        env.self = widget
+        # Set formatted get content for the widget
+        get_content = lua_formatted_get_content(env)
+        owner.get_content = get_content.__get__(owner, owner.__class__)  # type: ignore
 
-        for key, value in _get_pairs(env):
-            if sandbox[key] is not None:
-                continue
+def _report_env_id(callback, env_id, chunk, widget, key, spawn=None):
+    """Wraps a function and reports its environment id with exceptions it raises.
 
-            if callable(value):
-                if not env.hasOwn(key):
-                    continue
+    If `spawn` is given, the function is run as a task: its first step is run inline,
+    and if it yields, the rest is handed to `spawn` to be scheduled. Functions that
+    finish without yielding return their result like inline calls do. Inline calls
+    are subject to the runtime's script limits, and once the function raises its
+    environment is torn down, which disables every handler from the same script.
+    """
 
-                value = setfenv(value, env)
+    envs = lua.eval("sandbox.envs")
 
-            if key == "init":
-                value()
-                continue
+    def _fail(error: Exception) -> RuntimeError:
+        envs[env_id] = None
+        return RuntimeError(key, widget, chunk, error)
 
-            if isinstance(key, str) and key.startswith(EVENT_PREFIXES):
-                event = getattr(widget, key, None)
+    def _record(start: float, call: bool) -> None:
+        if lua.profiler is not None:
+            lua.profiler.record(env_id, widget, key, perf_counter() - start, call)
 
-                if event is None:
-                    raise ValueError(f"invalid event handler {key!r}")
+        if lua.tracer is not None:
+            lua.tracer.record(
+                "handler", start, perf_counter(), widget=widget.as_query(), event=key
+            )
 
-                assert callable(value)
+    def _task(*args):
+        if lua_type(callback) == "function":
+            task = lua.coroutine(callback, *args)
+        else:
+            task = as_task(callback, *args)
 
-                event += _report_env_id(value, s_id, code, widget, key)
+        call = True
 
-        # Set formatted get content for the widget
-        get_content = lua_formatted_get_content(env)
-        widget.get_content = get_content.__get__(widget, widget.__class__)  # type: ignore
+        while True:
+            start = perf_counter()
 
-    return widget, rules
+            try:
+                value = next(task)
+
+            except StopIteration as stop:
+                _record(start, call)
+                return stop.value
+
+            except Exception as e:
+                raise _fail(e) from e
 
-def _report_env_id(callback, env_id, code, widget, key):
-    """Wraps a function and reports its environment id with exceptions it raises."""
+            _record(start, call)
+            call = False
+
+            # Lua coroutines hand over their return value like a yielded one
+            if lua_type(task) == "thread" and not task:
+                return value
+
+            yield
 
     def _inner(*args, **kwargs):
+        if envs[env_id] is None:
+            return False
+
+        if spawn is not None:
+            task = _task(*args)
+
+            try:
+                with lua.limited():
+                    next(task)
+
+            except StopIteration as stop:
+                return stop.value
+
+            spawn(task)
+            return True
+
+        start = perf_counter()
+
         try:
-            return callback(*args, **kwargs)
+            with lua.limited():
+                return callback(*args, **kwargs)
 
         except Exception as e:
-            raise RuntimeError(key, widget, code, e)
+            raise _fail(e) from e
+
+        finally:
+            _record(start, True)
 
     return _inner
 
 
 def _register_component(
-    node: Element, components: dict[str, str], namespace: str | None = None
+    node: Element,
+    components: dict[str, tuple[dict[str, Any], str]],
+    namespace: str | None = None,
 ) -> None:
     name = None
     params = {}
@@ -399,8 +603,20 @@ def _register_component(
     components[name] = params, node[0]
 
 
-def parse_page(page_node: Element, components: dict[str, str], page: Page) -> tuple[Widget | None, list[str]]:
-    """Parses a page, its scripts & its children from XML node."""
+def parse_page(
+    page_node: Element,
+    components: dict[str, tuple[dict[str, Any], str]],
+    page: Page,
+) -> tuple[Widget | None, list[str], Callable[[], None]]:
+    """Parses a page, its scripts & its children from XML node.
+
+    Like with `parse_fragment`, the content's scripts are left for later, so pages
+    can be parsed on a network thread.
+
+    Returns:
+        The content widget, the page's own scripts and a callable that runs the
+        content's scripts (and `init` handlers). The latter runs first.
+    """
 
     content_nodes = [node for node in page_node if node.tag not in ["component", "complib", "style", "script"]]
 
@@ -408,7 +624,8 @@ def parse_page(page_node: Element, components: dict[str, str], page: Page) -> tu
         raise ValueError("pages must have exactly one content node.", content_nodes)
 
     root = None
-    scripts = [];
+    scripts = []
+    run_root_scripts: Callable[[], None] = lambda: None
 
     for child in page_node:
         if child.tag == "complib":
@@ -424,9 +641,7 @@ def parse_page(page_node: Element, components: dict[str, str], page: Page) -> tu
             continue
 
         if child.tag == "style":
-            for selector, rule in parse_rules(child.text or "").items():
-                page.rule(selector, **rule)
-
+            apply_rule_set(page, parse_rules(child.text or ""))
             continue
 
         if child.tag == "script":
@@ -434,12 +649,10 @@ def parse_page(page_node: Element, components: dict[str, str], page: Page) -> tu
             continue
 
         if child.tag in WIDGET_TYPES or child.tag in components:
-            root, rules = parse_widget(child, components)
-
-            for selector, rule in rules.items():
-                page.rule(selector, **rule)
+            root, rules, run_root_scripts = parse_fragment(child, components)
+            apply_rule_set(page, rules)
 
         else:
             raise ValueError(child.tag)
 
-    return root, scripts
+    return root, scripts, run_root_scripts
@@ -0,0 +1,129 @@
+"""Attributes Lua execution time to the widgets, handlers & script lines it was spent in.
+
+Handlers are timed exactly as they are called, while lines are sampled by the
+runtime's instruction hook every `LimitedLuaRuntime.HOOK_STEP` instructions.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from threading import Lock
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from celadon import Widget
+
+    from .runtime import LimitedLuaRuntime
+    from .parsing import ScriptChunk
+
+__all__ = ["HandlerStats", "LuaProfiler"]
+
+
+@dataclass
+class HandlerStats:
+    """Call counts & timings of a single event handler."""
+
+    query: str
+    event: str
+    calls: int = 0
+    seconds: float = 0.0
+    slowest: float = 0.0
+
+
+class LuaProfiler:
+    """Collects handler timings & line samples, and reports the hottest ones."""
+
+    def __init__(self) -> None:
+        self.handlers: dict[tuple[int, str], HandlerStats] = {}
+        self.lines: dict[tuple[int, int], float] = {}
+
+        self._sources: dict[int, tuple[str, ScriptChunk]] = {}
+        self._lock = Lock()
+
+    def add_source(self, script_id: int, widget: Widget, chunk: ScriptChunk) -> None:
+        """Registers the code chunk a widget's script was executed as part of."""
+
+        self._sources[script_id] = (widget.as_query(), chunk)
+
+    def record(
+        self, script_id: int, widget: Widget, event: str, seconds: float, call: bool
+    ) -> None:
+        """Records time spent in a handler.
+
+        Args:
+            script_id: The id of the script (and widget) the handler belongs to.
+            widget: The widget the handler is bound to.
+            event: The name of the handler's event.
+            seconds: The time the call (or coroutine step) took.
+            call: Whether this is the start of a new call, rather than the resumption
+                of a yielded one.
+        """
+
+        with self._lock:
+            stats = self.handlers.get((script_id, event))
+
+            if stats is None:
+                stats = self.handlers[(script_id, event)] = HandlerStats(
+                    widget.as_query(), event
+                )
+
+            if call:
+                stats.calls += 1
+
+            stats.seconds += seconds
+            stats.slowest = max(stats.slowest, seconds)
+
+    def collect(self, runtime: LimitedLuaRuntime) -> None:
+        """Merges the line samples taken by the runtime since the last collection."""
+
+        samples = runtime.take_samples()
+
+        with self._lock:
+            for key, seconds in samples.items():
+                self.lines[key] = self.lines.get(key, 0.0) + seconds
+
+    def _describe_line(self, script_id: int, line: int) -> tuple[str, str]:
+        """Returns the widget query & `line: source` description of a sampled line."""
+
+        if script_id not in self._sources:
+            return f"<script {script_id}>", str(line)
+
+        query, chunk = self._sources[script_id]
+
+        # Line numbers are relative to the chunk, make them relative to the script
+        origin = chunk.locate(line)
+
+        if origin is None:
+            return query, str(line)
+
+        source_id, source_line = origin
+        source = chunk.scripts[source_id][source_line - 1].strip()
+
+        return query, f"{source_line}: {source}"
+
+    def report(self, limit: int = 10) -> str:
+        """Returns a table of the hottest handlers & script lines."""
+
+        with self._lock:
+            handlers = sorted(
+                self.handlers.values(), key=lambda stats: stats.seconds, reverse=True
+            )[:limit]
+            lines = sorted(
+                self.lines.items(), key=lambda item: item[1], reverse=True
+            )[:limit]
+
+        output = [f"{'handler':<48} {'calls':>7} {'total':>10} {'slowest':>10}"]
+
+        for stats in handlers:
+            output.append(
+                f"{stats.query + ' ' + stats.event:<48.48} {stats.calls:>7}"
+                + f" {stats.seconds * 1000:>8.2f}ms {stats.slowest * 1000:>8.2f}ms"
+            )
+
+        output.extend(["", f"{'line':<67} {'total':>10}"])
+
+        for (script_id, line), seconds in lines:
+            query, source = self._describe_line(script_id, line)
+            output.append(f"{query + ' ' + source:<67.67} {seconds * 1000:>8.2f}ms")
+
+        return "\n".join(output)
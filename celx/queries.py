@@ -0,0 +1,515 @@
+"""Live query handles, returned by `query(selector)` in page scripts.
+
+Handles are cached per selector, and kept up to date as the tree changes instead of
+walking the whole page on every call:
+
+```lua
+local rows = query("Row.data")
+
+timeout(function()
+    rows.set{disabled = false}
+
+    for i, row in rows.items() do
+        row.content = "row " .. i
+    end
+end, 100)
+```
+
+Changes are tracked as they are made: the container methods every children write
+goes through (`insert`, `remove` & `replace`) and the group methods report the
+widgets they change, be it from scripts or Python code. Optimistic rollbacks report
+the subtrees they restore, and the runtime's attribute filter reports scripts
+setting `groups` & `eid`. Attribute reads are never tracked. The next read only
+matches the widgets within the changed subtrees again, and splices them into each
+handle in page order. Navigating resets every handle.
+
+Selectors involving states (`Button/hover`) change without the tree changing, so
+their handles match against the whole page on every read, like `find_all` does.
+
+`find(selector, true)` still returns a plain table of the current matches, read
+through the selector's handle.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from functools import wraps
+from operator import is_
+from typing import TYPE_CHECKING, Any, Callable, Iterator
+
+from celadon import Application, Container, Page, Selector, Widget
+
+if TYPE_CHECKING:
+    from lupa import LuaRuntime, LuaTable
+
+    from .application import Browser
+
+__all__ = ["LiveQuery", "QueryCache", "note_set", "watch_tree"]
+
+# The container methods every other children write goes through
+_STRUCTURE = ("insert", "remove", "replace")
+
+# Methods that change what a widget's selector matches, & the attributes they set
+QUERY_METHODS = ("add_group", "remove_group", "toggle_group")
+QUERY_ATTRIBUTES = frozenset(("groups", "eid"))
+
+
+def _report(
+    method: Callable[..., Any], report: Callable[[QueryCache, Any], None]
+) -> Callable[..., Any]:
+    """Wraps a tree method to report the change it makes to the active app's cache.
+
+    The change is reported before the method runs, so the children from before it
+    can still be noted.
+    """
+
+    @wraps(method)
+    def _method(self: Any, *args: Any, **kwargs: Any) -> Any:
+        cache = getattr(getattr(Widget, "app", None), "queries", None)
+
+        if cache is not None:
+            report(cache, self)
+
+        return method(self, *args, **kwargs)
+
+    _method.reports_queries = True  # type: ignore
+
+    return _method
+
+
+def _roots_changing(cache: QueryCache, page: Page) -> None:
+    """Resets cache if page is the app or its current page, whose roots are matched."""
+
+    if page is cache.app or page is cache.app.page:
+        cache.reset()
+
+
+def watch_tree() -> None:
+    """Makes the tree's mutation methods report their changes to query caches.
+
+    Every write to a container's children goes through `insert`, `remove` or
+    `replace`, whether it's made by Lua code or by the browser itself, so those note
+    the children that are changing. Changes are reported to the cache of
+    `Widget.app`, the active app. This is only done once, no matter how many caches
+    are created.
+    """
+
+    if getattr(Container.insert, "reports_queries", False):
+        return
+
+    watched: list[tuple[type, str, Callable[[QueryCache, Any], None]]] = [
+        *((Container, name, QueryCache.children_changing) for name in _STRUCTURE),
+        *((Widget, name, QueryCache.changed) for name in QUERY_METHODS),
+        *((Page, name, _roots_changing) for name in ("append", "insert", "remove")),
+        (Application, "unpin_last", _roots_changing),
+    ]
+
+    for cls, name, report in watched:
+        setattr(cls, name, _report(getattr(cls, name), report))
+
+
+def note_set(cache: QueryCache | None, obj: Any, attr: str) -> None:
+    """Records the change Lua code is about to make by setting `obj.attr`, if any.
+
+    This is called by the runtime's attribute filter for attributes being set, so
+    the change itself happens right after. Reads aren't reported, tree changes made
+    through methods are reported by the methods themselves, see `watch_tree`.
+
+    Args:
+        cache: The query cache of the app the runtime is bound to. Nothing is
+            recorded if it is None.
+        obj: The object the attribute is set on.
+        attr: The name of the attribute.
+    """
+
+    if cache is not None and attr in QUERY_ATTRIBUTES and isinstance(obj, Widget):
+        cache.changed(obj)
+
+
+def _chain(widget: Widget) -> list[Widget]:
+    """Returns the widgets from widget's top-level ancestor down to widget."""
+
+    chain = [widget]
+
+    while isinstance(chain[-1].parent, Widget):
+        chain.append(chain[-1].parent)
+
+    chain.reverse()
+
+    return chain
+
+
+def _position(siblings: list[Widget], widget: Widget, layered: bool) -> tuple:
+    """Returns where widget is yielded among its siblings by `drawables`."""
+
+    # Widgets don't define equality, so this looks for widget itself
+    try:
+        index = siblings.index(widget)
+
+    # Scrollbars aren't children, and are yielded before them
+    except ValueError:
+        return (float("-inf"), 0)
+
+    return (widget.layer if layered else 0, index)
+
+
+def _precedes(
+    chain: list[Widget], other_chain: list[Widget], roots: list[Widget]
+) -> bool:
+    """Determines whether chain's widget comes before other_chain's in page order.
+
+    Neither widget may be within the other's subtree, except for ancestors of
+    other_chain's widget, which come before it.
+    """
+
+    for depth, (widget, other) in enumerate(zip(chain, other_chain)):
+        if widget is other:
+            continue
+
+        if depth == 0:
+            return _position(roots, widget, False) < _position(roots, other, False)
+
+        parent = chain[depth - 1]
+        assert isinstance(parent, Container)
+
+        siblings = parent.children
+
+        return _position(siblings, widget, True) < _position(siblings, other, True)
+
+    return len(chain) < len(other_chain)
+
+
+def _has_states(selector: Selector | None) -> bool:
+    """Determines whether selector (or any of its parents) matches states."""
+
+    if selector is None:
+        return False
+
+    return (
+        selector.states is not None
+        or _has_states(selector.direct_parent)
+        or _has_states(selector.indirect_parent)
+    )
+
+
+class LiveQuery:
+    """The widgets matching a selector, kept up to date as the page changes.
+
+    Methods are called with `.` from Lua (`rows.each(func)`), and indices are
+    1-based.
+    """
+
+    def __init__(self, cache: QueryCache, query: str) -> None:
+        self.query = query
+        self.selector = Selector.parse(query)
+
+        self._cache = cache
+        self._matches: list[Widget] = []
+        self._stale = True
+        self._tracked = not _has_states(self.selector)
+
+    def __repr__(self) -> str:
+        return f"LiveQuery({self.query!r})"
+
+    def __len__(self) -> int:
+        return len(self.widgets())
+
+    def __iter__(self) -> Iterator[Widget]:
+        return iter(self.widgets())
+
+    @property
+    def is_tracked(self) -> bool:
+        """Whether the handle is updated incrementally, rather than on every read."""
+
+        return self._tracked
+
+    def widgets(self) -> list[Widget]:
+        """Returns the widgets currently matching the selector, in page order."""
+
+        self._cache.sync()
+
+        if self._stale or not self._tracked:
+            self._matches = [*self._cache.app.find_all(self.selector)]
+            self._stale = False
+
+        return self._matches
+
+    def get(self, index: int) -> Widget | None:
+        """Returns the widget at a (1-based) index, or None if there isn't one."""
+
+        widgets = self.widgets()
+
+        if 1 <= index <= len(widgets):
+            return widgets[index - 1]
+
+        return None
+
+    def items(self) -> Callable[..., tuple[int, Widget] | None]:
+        """Returns a Lua iterator over the (index, widget) pairs of the matches.
+
+        ```lua
+        for i, widget in rows.items() do ... end
+        ```
+        """
+
+        widgets = [*self.widgets()]
+        index = 0
+
+        def _next(*_: Any) -> tuple[int, Widget] | None:
+            nonlocal index
+
+            if index >= len(widgets):
+                return None
+
+            index += 1
+
+            return index, widgets[index - 1]
+
+        return _next
+
+    def each(self, func: Callable[[Widget, int], Any]) -> None:
+        """Calls func with every matched widget & its (1-based) index."""
+
+        for index, widget in enumerate([*self.widgets()], start=1):
+            func(widget, index)
+
+    def set(self, attrs: str | LuaTable | dict[str, Any], value: Any = None) -> None:
+        """Sets attributes on every matched widget.
+
+        Either a single attribute is given with its value (`rows.set("disabled",
+        true)`), or a table of them (`rows.set{content = "-", disabled = true}`).
+        """
+
+        if isinstance(attrs, str):
+            attrs = {attrs: value}
+
+        values = dict(attrs.items())
+        widgets = [*self.widgets()]
+
+        # Likely a Lua table
+        if hasattr(values.get("groups"), "values"):
+            values["groups"] = tuple(values["groups"].values())
+
+        for widget in widgets:
+            for key, item in values.items():
+                setattr(widget, key, item)
+
+        if not QUERY_ATTRIBUTES.isdisjoint(values):
+            self._cache.changed(*widgets)
+
+    def table(self) -> LuaTable:
+        """Returns the matches as a Lua table, to use with `ipairs` & `#`."""
+
+        return self._cache.runtime.table_from(self.widgets())
+
+    def _splice(
+        self,
+        subtrees: list[Widget],
+        added: list[Widget],
+        removed: list[Widget],
+        roots: list[Widget],
+    ) -> None:
+        """Updates the matches after a change to the page.
+
+        Args:
+            subtrees: Subtrees whose matches are replaced by matching them again.
+            added: Subtrees that are new to the page, only matched to add to them.
+            removed: Subtrees that were removed from the page, whose matches are
+                dropped. Matches that are no longer attached to the page otherwise
+                are dropped along with them.
+            roots: The top-level widgets of the page, in order.
+        """
+
+        matches = self._matches
+
+        if removed or subtrees:
+            root_ids = set(map(id, roots))
+            dropped_ids = set(map(id, [*subtrees, *removed]))
+
+            matches = [
+                widget
+                for widget in matches
+                if id((chain := _chain(widget))[0]) in root_ids
+                and not any(id(ancestor) in dropped_ids for ancestor in chain)
+            ]
+
+        matched = set(map(id, matches))
+
+        for subtree in [*subtrees, *added]:
+            # Widgets moved without being reported may already be matched
+            found = [
+                widget
+                for widget in subtree.drawables()
+                if id(widget) not in matched and self.selector.matches(widget)
+            ]
+
+            if not found:
+                continue
+
+            chain = _chain(subtree)
+            low, high = 0, len(matches)
+
+            while low < high:
+                middle = (low + high) // 2
+
+                if _precedes(_chain(matches[middle]), chain, roots):
+                    low = middle + 1
+                else:
+                    high = middle
+
+            matches[low:low] = found
+            matched.update(id(widget) for widget in found)
+
+        self._matches = matches
+
+
+class QueryCache:
+    """The live query handles of an app, by selector."""
+
+    def __init__(
+        self, app: Browser, runtime: LuaRuntime, max_handles: int = 128
+    ) -> None:
+        """Initializes the cache.
+
+        Args:
+            app: The app whose page is queried.
+            runtime: The runtime handles create Lua tables with.
+            max_handles: The number of handles updated incrementally. Once more
+                selectors are used, the least recently found ones are matched
+                against the whole page on every read instead.
+        """
+
+        self.app = app
+        self.runtime = runtime
+        self.max_handles = max_handles
+
+        watch_tree()
+
+        self._handles: OrderedDict[str, LiveQuery] = OrderedDict()
+
+        # Changed widgets, with their children from before the change if only those
+        # changed
+        self._changed: dict[int, tuple[Widget, list[Widget] | None]] = {}
+
+    def __len__(self) -> int:
+        return len(self._handles)
+
+    def find(self, query: str, multiple: bool = False) -> Widget | LuaTable | None:
+        """Finds the first widget matching query, or a table of all of them.
+
+        The table is a copy of the matches at the time of the call, read through the
+        selector's handle.
+        """
+
+        if not multiple:
+            return self.app.find(query)
+
+        return self.handle(query).table()
+
+    def handle(self, query: str) -> LiveQuery:
+        """Returns the live handle of a selector, creating it if needed."""
+
+        handle = self._handles.get(query)
+
+        if handle is not None:
+            self._handles.move_to_end(query)
+            return handle
+
+        handle = self._handles[query] = LiveQuery(self, query)
+
+        while len(self._handles) > self.max_handles:
+            _, evicted = self._handles.popitem(last=False)
+            evicted._tracked = False  # pylint: disable=protected-access
+
+        return handle
+
+    def changed(self, *widgets: Widget) -> None:
+        """Marks the subtrees of widgets as changed, so they are matched again."""
+
+        if not self._handles:
+            return
+
+        for widget in widgets:
+            self._changed[id(widget)] = (widget, None)
+
+    def children_changing(self, container: Widget) -> None:
+        """Notes the children of a container that is about to add or remove some.
+
+        Only the children that were added are matched once the change is synced.
+        """
+
+        if not self._handles or not isinstance(container, Container):
+            return
+
+        if id(container) not in self._changed:
+            self._changed[id(container)] = (container, [*container.children])
+
+    def reset(self) -> None:
+        """Makes every handle match against the whole page on its next read."""
+
+        self._changed.clear()
+
+        for handle in self._handles.values():
+            handle._stale = True  # pylint: disable=protected-access
+
+    def sync(self) -> None:
+        """Applies the changes made since the last read to every handle."""
+
+        if not self._changed:
+            return
+
+        changed = [*self._changed.values()]
+        self._changed.clear()
+
+        subtrees: list[Widget] = []
+        added: list[Widget] = []
+        removed: list[Widget] = []
+
+        for widget, before in changed:
+            if before is None or not isinstance(widget, Container):
+                subtrees.append(widget)
+                continue
+
+            children = widget.children
+
+            # The usual case, of children only being appended
+            if len(children) >= len(before) and all(map(is_, before, children)):
+                added.extend(children[len(before) :])
+                continue
+
+            before_ids = set(map(id, before))
+            current_ids = set(map(id, children))
+
+            kept_before = [child for child in before if id(child) in current_ids]
+            kept_now = [child for child in children if id(child) in before_ids]
+
+            # `replace` doesn't unset the parent of the replaced widget
+            removed.extend(child for child in before if id(child) not in current_ids)
+
+            if any(old is not new for old, new in zip(kept_before, kept_now)):
+                subtrees.append(widget)
+                continue
+
+            added.extend(child for child in children if id(child) not in before_ids)
+
+        # pylint: disable-next=protected-access
+        roots = [*(self.app.page or []), *self.app._children]
+        root_ids = {id(root) for root in roots}
+        changed_ids = {id(widget) for widget in [*subtrees, *added]}
+
+        def _is_outermost(widget: Widget) -> bool:
+            """Whether widget is on the page, and not within another changed one."""
+
+            chain = _chain(widget)
+
+            return id(chain[0]) in root_ids and not any(
+                id(ancestor) in changed_ids for ancestor in chain[:-1]
+            )
+
+        subtrees = [widget for widget in subtrees if _is_outermost(widget)]
+        added = [widget for widget in added if _is_outermost(widget)]
+
+        # pylint: disable=protected-access
+        for handle in self._handles.values():
+            if not handle._stale and handle._tracked:
+                handle._splice(subtrees, added, removed, roots)
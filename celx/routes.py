@@ -0,0 +1,200 @@
+"""Client-side route handlers, consulted before a request goes to the network.
+
+Page scripts register Lua handlers for the requests they can answer locally, like a
+service worker would:
+
+```lua
+routes.on("GET", "/panel/:name", function(request)
+    if request.args.name == "help" then
+        return "<text>Press ? for help</text>"
+    end
+
+    -- Returning nothing falls through to the network
+end)
+
+routes.store("/about", "<text>celx v1.0</text>")
+```
+
+Handlers are given a `request` table with the `method`, `path`, `args` (the pattern's
+`:placeholders`) and `params` (query parameters & form data) of the request, and may
+return the XML of a response, or nothing to let the next handler (and eventually
+the network) handle it. GET requests no handler answered are served from the store
+if the path was stored, which handlers can also read with `routes.stored(path)`.
+
+Handlers belong to the page whose scripts registered them, and only answer requests
+while that page is the active one. They are dropped once the page is evicted. The
+store is shared by every page of the app.
+"""
+
+from __future__ import annotations
+
+import re
+
+from contextlib import contextmanager
+from threading import Lock
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Pattern
+
+if TYPE_CHECKING:
+    from .lua import LazyRuntime
+    from .runtime import LimitedLuaRuntime
+
+__all__ = ["LocalRoutes"]
+
+RE_PLACEHOLDER = re.compile(r":([A-Za-z_][A-Za-z0-9_]*)")
+
+
+def _compile_pattern(pattern: str) -> Pattern:
+    """Compiles a route pattern like `/items/:id` or `/static/*` into a regex."""
+
+    if not pattern.startswith("/"):
+        raise ValueError(f"route patterns must start with '/', got {pattern!r}")
+
+    wildcard = pattern.endswith("*")
+    parts = RE_PLACEHOLDER.split(pattern.rstrip("*"))
+
+    # `split` alternates between literal text & placeholder names
+    regex = "".join(
+        f"(?P<{part}>[^/]+)" if i % 2 else re.escape(part)
+        for i, part in enumerate(parts)
+    )
+
+    return re.compile(f"^{regex}{'.*' if wildcard else ''}$")
+
+
+class LocalRoutes:
+    """The route handlers & stored responses registered by page scripts."""
+
+    def __init__(
+        self,
+        runtime: LimitedLuaRuntime | LazyRuntime,
+        owner: Callable[[], Any] | None = None,
+    ) -> None:
+        """Initializes the routes.
+
+        Args:
+            runtime: The runtime handlers are called under the limits of.
+            owner: Returns the page whose handlers answer requests, which is also
+                the one handlers registered outside of `owned_by` belong to.
+                Usually the active page.
+        """
+
+        self.runtime = runtime
+
+        self._owner = owner or (lambda: None)
+        self._registering: list[Any] = []
+        self._handlers: dict[
+            Any, dict[tuple[str, str], tuple[Pattern, Callable[..., Any]]]
+        ] = {}
+        self._store: dict[str, str] = {}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(map(len, self._handlers.values())) + len(self._store)
+
+    def _registering_page(self) -> Any:
+        """Returns the page handlers registered right now belong to."""
+
+        return self._registering[-1] if self._registering else self._owner()
+
+    @contextmanager
+    def owned_by(self, page: Any) -> Iterator[None]:
+        """Makes page the owner of the handlers registered within the context.
+
+        This is used while the scripts of a page that isn't active yet run.
+        """
+
+        self._registering.append(page)
+
+        try:
+            yield
+
+        finally:
+            self._registering.pop()
+
+    def on(self, method: str, pattern: str, handler: Callable[..., Any]) -> None:
+        """Registers a handler, replacing any previous one for the same route."""
+
+        compiled = _compile_pattern(pattern)
+        page = self._registering_page()
+
+        with self._lock:
+            routes = self._handlers.setdefault(page, {})
+            routes[(method.upper(), pattern)] = (compiled, handler)
+
+    def off(self, method: str, pattern: str) -> None:
+        """Removes the handler of a route."""
+
+        page = self._registering_page()
+
+        with self._lock:
+            self._handlers.get(page, {}).pop((method.upper(), pattern), None)
+
+    def drop(self, page: Any) -> None:
+        """Removes every handler registered by page, like once it's evicted."""
+
+        with self._lock:
+            self._handlers.pop(page, None)
+
+    def store(self, path: str, body: str) -> None:
+        """Stores the XML that GET requests to path are answered with."""
+
+        with self._lock:
+            self._store[path] = body
+
+    def stored(self, path: str) -> str | None:
+        """Returns the XML stored for path, if there is any."""
+
+        with self._lock:
+            return self._store.get(path)
+
+    def forget(self, path: str) -> None:
+        """Removes the XML stored for path."""
+
+        with self._lock:
+            self._store.pop(path, None)
+
+    def resolve(self, method: str, path: str, params: dict[str, Any]) -> str | None:
+        """Returns the local response to a request, or None if it needs the network.
+
+        Only the handlers of the owner page are called, in the order they were
+        registered, under the runtime's script limits. This should be called where
+        Lua code may run, i.e. on the draw thread.
+        """
+
+        method = method.upper()
+
+        with self._lock:
+            handlers = [
+                (compiled, handler)
+                for (handler_method, _), (compiled, handler) in self._handlers.get(
+                    self._owner(), {}
+                ).items()
+                if handler_method == method
+            ]
+
+        for compiled, handler in handlers:
+            mtch = compiled.match(path)
+
+            if mtch is None:
+                continue
+
+            request = self.runtime.table_from(
+                {
+                    "method": method,
+                    "path": path,
+                    "args": self.runtime.table_from(mtch.groupdict()),
+                    "params": self.runtime.table_from(params),
+                }
+            )
+
+            with self.runtime.limited():
+                body = handler(request)
+
+            if isinstance(body, str):
+                return body
+
+        if method == "GET":
+            return self.stored(path)
+
+        return None
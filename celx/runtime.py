@@ -0,0 +1,269 @@
+"""The Lua runtime that page scripts run in.
+
+This module imports lupa, so it is only loaded once a runtime is first needed. See
+`celx.lua.lua` for the shared instance.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from threading import RLock
+from typing import TYPE_CHECKING, Any, Callable, Iterator
+
+from lupa import LuaRuntime, LuaSyntaxError  # type: ignore # pylint: disable=no-name-in-module
+
+from .lua import ScriptLimits
+
+if TYPE_CHECKING:
+    from .profiler import LuaProfiler
+    from .tracing import Tracer
+
+__all__ = ["LimitedLuaRuntime", "LoggedLuaRuntime"]
+
+LUA_HOOK_SETUP = """
+local remaining = math.huge
+local exceeded = false
+local step, chunk = ...
+
+local samples = nil
+local last = 0
+
+-- Finds the `env_id` of the widget scope (see `initScope`) a function runs in
+local function env_id_of(fn)
+    local i = 1
+
+    while true do
+        local name, value = debug.getupvalue(fn, i)
+
+        if name == "_ENV" then
+            if type(value) == "table" and rawget(value, "hasOwn") ~= nil then
+                return value.env_id
+            end
+
+            return nil
+        elseif not name then
+            return nil
+        end
+
+        i = i + 1
+    end
+end
+
+-- Finds the innermost frame running page script code, skipping scope metamethods
+local function script_frame()
+    for level = 3, 32 do
+        local info = debug.getinfo(level, "Slf")
+
+        if info == nil or info.source == chunk then
+            return info
+        end
+    end
+end
+
+local function hook()
+    remaining = remaining - step
+
+    if samples ~= nil then
+        local now = os.clock()
+        local info = script_frame()
+        local id = info and env_id_of(info.func)
+
+        if id ~= nil then
+            local key = id .. ":" .. info.currentline
+            samples[key] = (samples[key] or 0) + (now - last)
+        end
+
+        last = now
+    end
+
+    if remaining < 0 then
+        exceeded = true
+        error("instruction limit exceeded", 2)
+    end
+end
+
+debug.sethook(hook, "", step)
+
+-- Re-raises errors caught once the limit is exceeded, so scripts can't carry on
+local function rethrow(ok, ...)
+    if not ok and exceeded then
+        error("instruction limit exceeded", 0)
+    end
+
+    return ok, ...
+end
+
+-- Hooks are per-thread, so each coroutine has to install its own
+local function hooked(fn)
+    return function(...)
+        debug.sethook(hook, "", step)
+        return fn(...)
+    end
+end
+
+local raw_pcall, raw_xpcall = pcall, xpcall
+local raw_create, raw_resume, raw_wrap =
+    coroutine.create, coroutine.resume, coroutine.wrap
+
+-- Replaced before the sandbox's builtins are copied from them
+pcall = function(...) return rethrow(raw_pcall(...)) end
+xpcall = function(...) return rethrow(raw_xpcall(...)) end
+coroutine.create = function(fn) return raw_create(hooked(fn)) end
+coroutine.resume = function(...) return rethrow(raw_resume(...)) end
+coroutine.wrap = function(fn) return raw_wrap(hooked(fn)) end
+
+return {
+    budget = function(count)
+        remaining = count
+        exceeded = false
+        last = os.clock()
+    end,
+
+    load = function(code)
+        local fn, err = load(code, chunk)
+        return fn, err
+    end,
+
+    hooked = hooked,
+
+    profile = function(enabled)
+        samples = enabled and {} or nil
+        last = os.clock()
+    end,
+
+    samples = function()
+        local taken = samples
+        samples = samples and {}
+
+        return taken
+    end,
+}
+"""
+
+
+class LimitedLuaRuntime(LuaRuntime):
+    """A Lua runtime that can enforce `ScriptLimits` on the code it runs."""
+
+    HOOK_STEP = 1000
+    SCRIPT_CHUNK = "<celx>"
+
+    def __new__(cls, **kwargs: Any) -> LimitedLuaRuntime:
+        # Memory can only be limited with lupa's own allocator, which it only uses
+        # when `max_memory` is given on creation (0 meaning no limit).
+        kwargs["max_memory"] = 0
+
+        return super().__new__(cls, **kwargs)
+
+    def __init__(self, **_: Any) -> None:
+        super().__init__()
+
+        self.limits = ScriptLimits()
+        self.profiler: LuaProfiler | None = None
+        self.tracer: Tracer | None = None
+
+        self._limit_lock = RLock()
+        self._limit_depth = 0
+        self._hooks = super().execute(
+            LUA_HOOK_SETUP, self.HOOK_STEP, self.SCRIPT_CHUNK
+        )
+
+    def set_profiler(self, profiler: LuaProfiler | None) -> None:
+        """Starts sampling script lines into the given profiler, or stops if None."""
+
+        self.profiler = profiler
+        self._hooks.profile(profiler is not None)
+
+    def take_samples(self) -> dict[tuple[int, int], float]:
+        """Returns the time spent on each (script id, line) since the last call."""
+
+        samples = self._hooks.samples()
+
+        if samples is None:
+            return {}
+
+        result = {}
+
+        for key, seconds in samples.items():
+            script_id, line = key.split(":")
+            result[(int(script_id), int(line))] = seconds
+
+        return result
+
+    @contextmanager
+    def limited(self) -> Iterator[None]:
+        """Applies the runtime's limits to the Lua code executed within the context.
+
+        Nested contexts share the quota of the outermost one.
+        """
+
+        with self._limit_lock:
+            self._limit_depth += 1
+
+            if self._limit_depth == 1:
+                limits = self.limits
+
+                self._hooks.budget(
+                    float("inf")
+                    if limits.max_instructions is None
+                    else limits.max_instructions
+                )
+
+                if limits.max_memory is not None:
+                    self.set_max_memory(self.get_memory_used() + limits.max_memory)
+
+        try:
+            yield
+
+        finally:
+            with self._limit_lock:
+                self._limit_depth -= 1
+
+                if self._limit_depth == 0:
+                    self._hooks.budget(float("inf"))
+                    self.set_max_memory(0)
+
+    def execute_script(self, code: str) -> Any:
+        """Executes page script code, as a chunk that the profiler samples."""
+
+        func, error = self._hooks.load(code)
+
+        if func is None:
+            raise LuaSyntaxError(error)
+
+        if self.tracer is None:
+            return func()
+
+        with self.tracer.span("lua"):
+            return func()
+
+    def coroutine(self, func: Callable[..., Any], *args: Any) -> Iterator[Any]:
+        """Starts func as a coroutine that is subject to the instruction limit."""
+
+        return iter(self._hooks.hooked(func).coroutine(*args))
+
+
+class LoggedLuaRuntime(LimitedLuaRuntime):
+    """A limited runtime that appends the code it runs to a file, for debugging.
+
+    It is only used when the `CELX_LUA_LOG` environment variable names the file, see
+    `celx.lua.LUA_LOG_VAR`.
+    """
+
+    log_file: str | None = None
+
+    def _log(self, code: str) -> None:
+        if self.log_file:
+            with open(self.log_file, "a", encoding="utf-8") as f:
+                f.write(code + "\n")
+
+    def execute(self, code: str, **kwargs) -> Any:
+        """Logs & executes a piece of code."""
+
+        self._log(code)
+        return super().execute(code, **kwargs)
+
+    def execute_script(self, code: str) -> Any:
+        """Logs & executes a script, under the instruction limit."""
+
+        self._log(code)
+        return super().execute_script(code)
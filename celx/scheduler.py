@@ -0,0 +1,233 @@
+"""A cooperative, frame-budgeted scheduler for Lua callbacks.
+
+Event handlers, timeouts & animation frame callbacks are run as Lua coroutines at the
+start of each frame, for at most `budget_ms` milliseconds in total. A handler that
+calls `coroutine.yield()` is resumed on the next frame, so long-running work can be
+spread out without blocking input or rendering:
+
+```lua
+function on_submit()
+    for i = 1, 10000 do
+        process(i)
+
+        if i % 100 == 0 then coroutine.yield() end
+    end
+end
+```
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from contextlib import nullcontext
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Iterator
+
+from .lua import lua_type
+
+if TYPE_CHECKING:
+    from .lua import LazyRuntime
+    from .runtime import LimitedLuaRuntime
+
+__all__ = ["FrameScheduler", "as_task"]
+
+Task = Iterator[Any]
+
+
+def as_task(func: Callable[..., Any], *args: Any) -> Task:
+    """Returns an iterator that runs func, yielding wherever a Lua function yields.
+
+    Python functions return their result through the iterator's `StopIteration`.
+    """
+
+    if lua_type(func) == "function":
+        # Lua functions are lupa objects, which start coroutines of themselves
+        return iter(func.coroutine(*args))  # type: ignore[attr-defined]
+
+    def _run() -> Task:
+        result = func(*args)
+
+        if isinstance(result, Iterator):
+            return (yield from result)
+
+        return result
+
+    return _run()
+
+
+class FrameScheduler:
+    """Runs tasks, timeouts & animation frame callbacks within a per-frame budget.
+
+    Everything is executed by `run_frame`, which the browser calls on the draw thread
+    at the start of every frame. Scheduling methods are thread-safe.
+    """
+
+    def __init__(
+        self,
+        budget_ms: float = 8.0,
+        runtime: LimitedLuaRuntime | LazyRuntime | None = None,
+        on_error: Callable[[Exception], Any] | None = None,
+    ) -> None:
+        """Initializes the scheduler.
+
+        Args:
+            budget_ms: The time spent running tasks each frame. Tasks are never
+                interrupted, so a task that doesn't yield can still overrun it.
+            runtime: The runtime whose script limits are applied to every step of
+                every task.
+            on_error: Called with the exceptions raised by tasks, which are dropped
+                while the frame carries on with the others. Without it, they are
+                raised from `run_frame`.
+        """
+
+        self.budget_ms = budget_ms
+        self.runtime = runtime
+        self.on_error = on_error
+
+        self._lock = Lock()
+        self._tasks: deque[Task] = deque()
+        self._timers: dict[Hashable, tuple[float, Callable[[], Any]]] = {}
+        self._frame_callbacks: dict[int, Callable[[float], Any]] = {}
+        self._next_handle = 0
+
+    def _task(self, func: Callable[..., Any], *args: Any) -> Task:
+        """Creates a task, starting Lua functions as limited coroutines if possible."""
+
+        if self.runtime is not None and lua_type(func) == "function":
+            return self.runtime.coroutine(func, *args)
+
+        return as_task(func, *args)
+
+    @property
+    def pending(self) -> bool:
+        """Determines whether there are any tasks, timers or frame callbacks waiting."""
+
+        return bool(self._tasks or self._timers or self._frame_callbacks)
+
+    @property
+    def busy(self) -> bool:
+        """Determines whether there are tasks or frame callbacks to run next frame.
+
+        Unlike `pending`, this ignores timers, which may keep recurring forever.
+        """
+
+        return bool(self._tasks or self._frame_callbacks)
+
+    def spawn(self, func: Callable[..., Any] | Task, *args: Any) -> None:
+        """Schedules a function (called with args) or an iterator as a new task."""
+
+        task = func if isinstance(func, Iterator) else self._task(func, *args)
+
+        with self._lock:
+            self._tasks.append(task)
+
+    def timeout(
+        self, delay_ms: float, callback: Callable[[], Any], key: Hashable = None
+    ) -> Hashable:
+        """Schedules callback to be run after delay_ms milliseconds.
+
+        Timeouts are coalesced by their key: scheduling a timeout with the key of a
+        pending one replaces it, only moving the deadline. The key defaults to the
+        callback itself, so a script that schedules the same function again before
+        it ran only gets it called once.
+
+        Returns:
+            The key the timeout can be cancelled by.
+        """
+
+        if key is None:
+            # Every Lua function passed in gets a new wrapper, which compares by
+            # identity. Its string has the address of the function itself.
+            key = str(callback) if lua_type(callback) == "function" else callback
+
+        with self._lock:
+            self._timers[key] = (perf_counter() + delay_ms / 1000, callback)
+
+        return key
+
+    def cancel_timeout(self, key: Hashable) -> None:
+        """Cancels a pending timeout."""
+
+        with self._lock:
+            self._timers.pop(key, None)
+
+    def request_frame(self, callback: Callable[[float], Any]) -> int:
+        """Schedules callback to run at the start of the next frame.
+
+        The callback is passed the frame's timestamp in milliseconds.
+
+        Returns:
+            A handle the request can be cancelled by.
+        """
+
+        with self._lock:
+            self._next_handle += 1
+            self._frame_callbacks[self._next_handle] = callback
+
+            return self._next_handle
+
+    def cancel_frame(self, handle: int) -> None:
+        """Cancels a pending animation frame request."""
+
+        with self._lock:
+            self._frame_callbacks.pop(handle, None)
+
+    def run_frame(self) -> bool:
+        """Runs scheduled work until it is done or the frame's budget is used up.
+
+        Tasks that yield, or that didn't get to run, are continued on the next frame.
+
+        Returns:
+            Whether any work was done.
+        """
+
+        start = perf_counter()
+        deadline = start + self.budget_ms / 1000
+
+        with self._lock:
+            due = [key for key, (time, _) in self._timers.items() if time <= start]
+
+            for key in due:
+                self._tasks.append(self._task(self._timers.pop(key)[1]))
+
+            # Animation frames come first, as they are usually tied to what is drawn
+            frames = [*self._frame_callbacks.values()]
+            self._frame_callbacks.clear()
+
+            self._tasks.extendleft(
+                reversed([self._task(callback, start * 1000) for callback in frames])
+            )
+
+            tasks = self._tasks
+            self._tasks = deque()
+
+        did_work = bool(tasks)
+        limited = self.runtime.limited if self.runtime is not None else nullcontext
+
+        try:
+            while tasks and perf_counter() < deadline:
+                task = tasks.popleft()
+
+                try:
+                    with limited():
+                        next(task)
+
+                except StopIteration:
+                    continue
+
+                except Exception as exc:  # pylint: disable=broad-exception-caught
+                    if self.on_error is None:
+                        raise
+
+                    self.on_error(exc)
+                    continue
+
+                with self._lock:
+                    self._tasks.append(task)
+
+        finally:
+            with self._lock:
+                self._tasks.extendleft(reversed(tasks))
+
+        return did_work
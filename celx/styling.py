@@ -0,0 +1,143 @@
+"""Incremental rule application, so inserting a fragment doesn't restyle the page.
+
+Rules added by a fragment's `<style>` tags are only matched against the widgets of
+the page once, instead of every rule being re-matched against every widget.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator
+
+from celadon import Page, Selector, Widget
+
+__all__ = ["IncrementalRules", "IncrementalPage"]
+
+
+class IncrementalRules:
+    """A `Page` mixin that only restyles the widgets a rule change can affect.
+
+    Celadon re-matches every rule against every widget once any rule is added. Here,
+    added & removed rules are instead matched against the page's widgets once, and
+    only the widgets they match are restyled, along with the widgets whose query has
+    changed (which includes newly inserted ones). Palette rules still cause a full
+    restyle, as they are applied through the terminal rather than a widget.
+
+    Rules added within `scoped_rules` are only matched against the widgets of the
+    given root, which is how fragments add the rules of their `<style>` tags.
+    """
+
+    _rules_changed: bool
+    _children: list[Widget]
+    _user_rules: dict[Selector, Any]
+    _encountered_types: list[type]
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._changed_selectors: list[tuple[Selector, Widget | None]] = []
+        self._merged_rules: dict[Selector, Any] | None = None
+        self._rule_scope: Widget | None = None
+
+        super().__init__(*args, **kwargs)
+
+    @property
+    def _rules(self) -> dict[Selector, Any]:
+        """Returns the merged builtin & user rules, rebuilt only when they change."""
+
+        if self._merged_rules is None:
+            self._merged_rules = super()._rules  # type: ignore
+
+        return self._merged_rules
+
+    def rule(
+        self, query: str | Selector, score: int | None = None, **rules: Any
+    ) -> Selector:
+        """Adds a rule, restyling only the widgets it matches."""
+
+        restyle_all = self._rules_changed
+        selector = super().rule(query, score=score, **rules)  # type: ignore
+
+        self._merged_rules = None
+
+        if not restyle_all and selector.elements != ("Palette",):
+            self._rules_changed = False
+            self._changed_selectors.append((selector, self._rule_scope))
+
+        return selector
+
+    @contextmanager
+    def scoped_rules(self, root: Widget) -> Iterator[None]:
+        """Only matches the rules added within the context against root's widgets."""
+
+        previous, self._rule_scope = self._rule_scope, root
+
+        try:
+            yield
+
+        finally:
+            self._rule_scope = previous
+
+    def remove_rules(self, selectors: Iterable[Selector]) -> None:
+        """Removes user rules, restyling only the widgets they matched."""
+
+        for selector in selectors:
+            if self._user_rules.pop(selector, None) is not None:
+                self._changed_selectors.append((selector, None))
+
+        self._merged_rules = None
+
+    def load_type_rules(self, widget: Widget) -> None:
+        """Loads the builtin rules of any widget type within widget new to the page.
+
+        Widgets inserted into an existing container never go through the page's
+        `_init_widget`, so this has to be called for them explicitly.
+        """
+
+        for child in widget.drawables():
+            if type(child) in self._encountered_types:
+                continue
+
+            self.load_rules(child.rules, _builtin=True)  # type: ignore
+            self._encountered_types.append(type(child))
+
+    def _styled_widgets(self) -> Iterator[Widget]:
+        """Yields every widget the page applies its rules to."""
+
+        for child in self._children:
+            yield from child.drawables()
+
+    @staticmethod
+    def _mark_matching(widgets: Iterable[Widget], selectors: list[Selector]) -> None:
+        """Marks the already styled widgets any of the selectors match for restyling."""
+
+        for widget in widgets:
+            if widget._last_query is None:  # pylint: disable=protected-access
+                continue
+
+            if any(selector.matches(widget) for selector in selectors):
+                # Makes `query_changed` true, so only this widget gets restyled
+                widget._last_query = None  # pylint: disable=protected-access
+
+    def apply_rules(self) -> bool:
+        """Marks the widgets changed rules match for restyling, then applies rules."""
+
+        changed, self._changed_selectors = self._changed_selectors, []
+
+        if changed and not self._rules_changed:
+            scopes: dict[int, tuple[Widget | None, list[Selector]]] = {}
+
+            for selector, scope in changed:
+                scopes.setdefault(id(scope), (scope, []))[1].append(selector)
+
+            for scope, selectors in scopes.values():
+                self._mark_matching(
+                    self._styled_widgets() if scope is None else scope.drawables(),
+                    selectors,
+                )
+
+        return super().apply_rules()  # type: ignore
+
+
+# Celadon declares `_rules` as an attribute, but defines it as a property. `rule`
+# leaves out `_builtin`, which is passed through `**rules` like `Application.rule` does
+class IncrementalPage(IncrementalRules, Page):  # type: ignore[override,misc]
+    """A page that restyles incrementally. See `IncrementalRules`."""
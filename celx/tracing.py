@@ -0,0 +1,146 @@
+"""Timing spans for navigations, requests, parsing, Lua execution & rendering.
+
+Spans are recorded by a `Tracer` passed to the browser, and can be exported either as
+JSON lines (one span per line) or in the Chrome trace event format, which can be
+opened in `chrome://tracing` or Perfetto.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock, current_thread
+from time import perf_counter
+from typing import Any, Iterator
+
+__all__ = ["Span", "Tracer", "TRACE_FORMATS"]
+
+TRACE_FORMATS = ("chrome", "jsonl")
+
+
+@dataclass
+class Span:
+    """A named, timed stage of work."""
+
+    name: str
+    start: float
+    end: float
+    thread: str
+    attrs: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        """The span's duration in seconds."""
+
+        return self.end - self.start
+
+
+class Tracer:
+    """Collects spans from any thread."""
+
+    def __init__(self) -> None:
+        self.origin = perf_counter()
+        self._spans: list[Span] = []
+        self._lock = Lock()
+
+    @property
+    def spans(self) -> list[Span]:
+        """A copy of the spans recorded so far."""
+
+        with self._lock:
+            return [*self._spans]
+
+    def record(self, name: str, start: float, end: float, **attrs: Any) -> None:
+        """Records a span between two `perf_counter` timestamps."""
+
+        span = Span(name, start, end, current_thread().name, attrs)
+
+        with self._lock:
+            self._spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+        """Records the time spent within the context as a span.
+
+        Yields the span's attributes, so more can be added as they become known.
+        """
+
+        start = perf_counter()
+
+        try:
+            yield attrs
+
+        finally:
+            self.record(name, start, perf_counter(), **attrs)
+
+    def to_json_lines(self) -> str:
+        """Returns every span as a JSON object per line, timed relative to `origin`."""
+
+        return "\n".join(
+            json.dumps(
+                {
+                    "name": span.name,
+                    "start_ms": (span.start - self.origin) * 1000,
+                    "duration_ms": span.duration * 1000,
+                    "thread": span.thread,
+                    **span.attrs,
+                },
+                default=str,
+            )
+            for span in self.spans
+        )
+
+    def to_chrome_trace(self) -> dict[str, Any]:
+        """Returns the spans as complete events in the Chrome trace event format."""
+
+        pid = os.getpid()
+        spans = self.spans
+        threads = {
+            name: tid
+            for tid, name in enumerate(dict.fromkeys(span.thread for span in spans))
+        }
+
+        # Metadata events that label thread ids with the threads' names
+        events: list[dict[str, Any]] = [
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": tid,
+                "args": {"name": name},
+            }
+            for name, tid in threads.items()
+        ]
+
+        for span in spans:
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "celx",
+                    "ph": "X",
+                    "ts": (span.start - self.origin) * 1_000_000,
+                    "dur": span.duration * 1_000_000,
+                    "pid": pid,
+                    "tid": threads[span.thread],
+                    "args": span.attrs,
+                }
+            )
+
+        return {"displayTimeUnit": "ms", "traceEvents": events}
+
+    def export(self, path: str | Path, fmt: str = "chrome") -> None:
+        """Writes the spans to a file in one of `TRACE_FORMATS`."""
+
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f"unknown trace format {fmt!r}, expected {TRACE_FORMATS}")
+
+        with open(path, "w", encoding="utf-8") as f:
+            if fmt == "jsonl":
+                f.write(self.to_json_lines() + "\n")
+                return
+
+            json.dump(self.to_chrome_trace(), f, default=str)
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import dataclass
+from threading import local
+from time import perf_counter
+from typing import Any, Iterator
+
+from requests import PreparedRequest, Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3 import response as urllib3_response
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+__all__ = [
+    "TransportSettings",
+    "TransportMetrics",
+    "build_session",
+    "connect_timings",
+    "session_metrics",
+]
+
+DEFAULT_HEADERS = {
+    "Accepts": "text/celx",
+    "CELX_Request": "true",
+}
+
+
+@dataclass
+class TransportSettings:  # pylint: disable=too-many-instance-attributes
+    """Settings for the HTTP session used by the browser."""
+
+    compression: tuple[str, ...] = ("zstd", "br", "gzip", "deflate")
+    """Content encodings to offer, in order of preference.
+
+    Encodings whose decoder isn't installed (`brotli` for br, `zstandard` for zstd) are
+    left out of `Accept-Encoding`.
+    """
+
+    pool_connections: int = 10
+    """The number of hosts to keep connection pools for."""
+
+    pool_maxsize: int = 10
+    """The number of keep-alive connections to keep per host."""
+
+    retries: int = 3
+    """How many times idempotent requests are retried on connection & 5xx errors."""
+
+    backoff_factor: float = 0.3
+    """The base of the exponential backoff between retries, in seconds."""
+
+    connect_timeout: float = 5.0
+    """Seconds to wait for a connection to be established."""
+
+    read_timeout: float = 30.0
+    """Seconds to wait between bytes received from the server."""
+
+    def accept_encoding(self) -> str:
+        """Returns the `Accept-Encoding` value for the supported encodings."""
+
+        available = {
+            "gzip": True,
+            "deflate": True,
+            "br": urllib3_response.brotli is not None,
+            "zstd": urllib3_response.HAS_ZSTD,
+        }
+
+        return ", ".join(
+            encoding for encoding in self.compression if available.get(encoding, False)
+        )
+
+
+@dataclass(frozen=True)
+class TransportMetrics:
+    """Connection reuse counters of a session's connection pools.
+
+    Connections are counted when a pool creates them. A pooled connection the server
+    closed is reopened in place, so it isn't counted again.
+    """
+
+    requests: int
+    connections: int
+
+    @property
+    def reused(self) -> int:
+        """The number of requests that were sent on an already open connection."""
+
+        return max(self.requests - self.connections, 0)
+
+
+_timings = local()
+
+
+@contextmanager
+def connect_timings() -> Iterator[list[tuple[str, float, float]]]:
+    """Collects the connections opened by the current thread within the context.
+
+    Yields a list that is filled with `(host, start, end)` tuples, timed by
+    `perf_counter`. Each covers name resolution, the TCP connection & TLS handshake.
+    """
+
+    timings: list[tuple[str, float, float]] = []
+    _timings.current = timings
+
+    try:
+        yield timings
+
+    finally:
+        _timings.current = None
+
+
+class _ConnectTimer:  # pylint: disable=too-few-public-methods
+    """Reports the time taken by `connect` to `connect_timings`."""
+
+    host: str
+
+    def connect(self) -> None:
+        """Connects, timing it if the thread is collecting timings."""
+
+        start = perf_counter()
+        super().connect()  # type: ignore # pylint: disable=no-member
+
+        timings = getattr(_timings, "current", None)
+
+        if timings is not None:
+            timings.append((self.host, start, perf_counter()))
+
+
+class _TimedHTTPConnection(_ConnectTimer, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_ConnectTimer, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TunedAdapter(HTTPAdapter):
+    """An adapter that applies default timeouts to every request, and times connects."""
+
+    def __init__(self, settings: TransportSettings) -> None:
+        self.timeout = (settings.connect_timeout, settings.read_timeout)
+
+        super().__init__(
+            pool_connections=settings.pool_connections,
+            pool_maxsize=settings.pool_maxsize,
+            max_retries=Retry(
+                total=settings.retries,
+                backoff_factor=settings.backoff_factor,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+    def send(  # type: ignore # pylint: disable=arguments-differ
+        self, request: PreparedRequest, **kwargs: Any
+    ) -> Response:
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        return super().send(request, **kwargs)
+
+
+def build_session(settings: TransportSettings) -> Session:
+    """Creates a session configured by the given settings."""
+
+    session = Session()
+    session.headers.update(DEFAULT_HEADERS)
+    session.headers["Accept-Encoding"] = settings.accept_encoding()
+
+    adapter = _TunedAdapter(settings)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def session_metrics(session: Session) -> TransportMetrics:
+    """Sums up the request & connection counters of a session's live pools."""
+
+    requests = 0
+    connections = 0
+
+    for adapter in {id(value): value for value in session.adapters.values()}.values():
+        # Adapters that don't pool connections through urllib3 have nothing to count
+        if not isinstance(adapter, HTTPAdapter):
+            continue
+
+        pools = adapter.poolmanager.pools
+
+        for key in pools.keys():
+            pool = pools[key]
+
+            requests += pool.num_requests
+            connections += pool.num_connections
+
+    return TransportMetrics(requests, connections)
@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+from copy import deepcopy
+from functools import partial
+from textwrap import dedent
+from time import monotonic
+from typing import TYPE_CHECKING, Any
+
+from lxml.etree import Element
+from celadon import Text, Tower, Widget
+
+from .callbacks import HTTPMethod
+from .lua import WIDGET_TYPES, app_envs, lua
+from .parsing import EVENT_PREFIXES, parse_widget
+
+if TYPE_CHECKING:
+    from .application import Browser
+
+__all__ = ["VirtualList"]
+
+
+def _find_window_node(tree: Element) -> Element | None:
+    """Returns the node whose children are the rows of a fetched window."""
+
+    if tree.tag != "celx":
+        return tree
+
+    for node in tree.findall("./page/*"):
+        if node.tag not in ["style", "script", "component", "complib"]:
+            return node
+
+    return None
+
+
+def _is_recyclable(node: Element) -> bool:
+    """Determines whether a row can be displayed by reusing another row's widget."""
+
+    cls = WIDGET_TYPES.get(node.tag)
+
+    return (
+        cls is not None
+        and issubclass(cls, Text)
+        and len(node) == 0
+        and not any(key.startswith(EVENT_PREFIXES) for key in node.attrib)
+    )
+
+
+class VirtualList(Tower):  # pylint: disable=too-many-instance-attributes
+    """A tower that only materializes the rows within its viewport.
+
+    Rows are fetched in windows of `page_size` from `src`, by sending:
+
+        GET <src>?offset=<first row>&limit=<page_size>
+
+    The response's first widget is the window, its children are the rows. Its `total`
+    attribute sets the total number of rows, so the scrollbar covers all of them:
+
+    ```xml
+    <tower total="100000">
+        <text>row 0</text>
+        <text>row 1</text>
+    </tower>
+    ```
+
+    Only the rows in view, plus `buffer` rows on either side, have widgets. Simple text
+    rows reuse the widgets of rows that scrolled out of view. Every row is expected to
+    be `row_height` cells tall. `<style>` blocks inside rows are ignored, style rows
+    using selectors like `VirtualList > Text` instead.
+
+    Windows that fail to load display as empty rows, and are requested again once
+    they are in view `RETRY_DELAY` seconds later.
+
+    ```xml
+    <vlist src="/logs" page-size="100" buffer="20"></vlist>
+    ```
+    """
+
+    RETRY_DELAY = 5.0
+
+    app: Browser
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *_: Widget,
+        src: str = "",
+        total: int = 0,
+        row_height: int = 1,
+        buffer: int = 10,
+        page_size: int = 50,
+        max_cached_rows: int = 2000,
+        **widget_args: Any,
+    ) -> None:
+        super().__init__(**widget_args)
+
+        self.src = src
+        self.total = total
+        self.row_height = row_height
+        self.buffer = buffer
+        self.page_size = page_size
+        self.max_cached_rows = max_cached_rows
+        self.overflow = ("hide", "auto")  # type: ignore
+
+        self._rows: dict[int, Element] = {}
+        self._loaded_pages: set[int] = set()
+        self._pending_pages: set[int] = set()
+        self._failed_pages: dict[int, float] = {}
+        self._materialized: dict[int, tuple[Element | None, Widget]] = {}
+        self._pool: dict[type, list[Widget]] = {}
+        self._pool_size = 0
+        self._window_range = (0, 0)
+        self._is_stale = True
+
+    def _window(self) -> tuple[int, int]:
+        """Returns the (start, end) indices of the rows that should be materialized."""
+
+        first = self.scroll[1] // self.row_height
+        visible = self._framed_height // self.row_height + 1
+
+        return (
+            max(first - self.buffer, 0),
+            min(first + visible + self.buffer, self.total),
+        )
+
+    def _fetch(self, start: int, end: int) -> None:
+        """Requests every page overlapping [start, end) that isn't loaded yet."""
+
+        if self.src == "":
+            return
+
+        pages = range(start // self.page_size, (max(end, 1) - 1) // self.page_size + 1)
+        now = monotonic()
+
+        for page in pages:
+            if page in self._loaded_pages or page in self._pending_pages:
+                continue
+
+            if now - self._failed_pages.get(page, -self.RETRY_DELAY) < self.RETRY_DELAY:
+                continue
+
+            self._pending_pages.add(page)
+
+            # Responses arrive on the request thread, but are stored by the draw thread
+            self.app._http(  # pylint: disable=protected-access
+                HTTPMethod.GET,
+                self.src,
+                {"offset": page * self.page_size, "limit": self.page_size},
+                partial(self._on_response, page),
+                navigate=False,
+                on_error=partial(self._on_error, page),
+            )
+
+    def _on_response(self, page: int, tree: Element) -> None:
+        """Hands a fetched window over to the draw thread."""
+
+        self.app.call_on_ui(partial(self._receive, page, tree))
+
+    def _on_error(self, page: int, _: Exception) -> None:
+        """Hands a failed window request over to the draw thread."""
+
+        self.app.call_on_ui(partial(self._fail, page))
+
+    def _fail(self, page: int) -> None:
+        """Marks a window whose request failed, so it is retried later."""
+
+        self._pending_pages.discard(page)
+        self._failed_pages[page] = monotonic()
+
+        # Redraws once the window can be retried, in case nothing else does
+        self.app.scheduler.timeout(
+            self.RETRY_DELAY * 1000, self._invalidate, key=(id(self), "retry")
+        )
+
+    def _invalidate(self) -> None:
+        """Makes the next frame restyle & redraw us."""
+
+        self._last_query = None
+
+    def _receive(self, page: int, tree: Element) -> None:
+        """Stores the rows of a fetched window."""
+
+        self._pending_pages.discard(page)
+        self._failed_pages.pop(page, None)
+        node = _find_window_node(tree)
+
+        if node is None:
+            return
+
+        if "total" in node.attrib:
+            self.total = int(node.attrib["total"])
+
+        rows = [child for child in node if child.tag not in ["style", "script"]]
+
+        for i, row in enumerate(rows):
+            self._rows[page * self.page_size + i] = row
+
+        self._loaded_pages.add(page)
+        self._evict_rows()
+
+        self._is_stale = True
+        self._invalidate()
+
+    def _evict_rows(self) -> None:
+        """Forgets the fetched pages furthest from the viewport, beyond the cache limit."""
+
+        center = (self._window_range[0] + self._window_range[1]) // 2 // self.page_size
+        pages = sorted(self._loaded_pages, key=lambda page: abs(page - center))
+
+        while len(self._rows) > self.max_cached_rows and len(pages) > 1:
+            page = pages.pop()
+            self._loaded_pages.discard(page)
+
+            start = page * self.page_size
+
+            for index in range(start, start + self.page_size):
+                self._rows.pop(index, None)
+
+    def _release(self, node: Element | None, widget: Widget) -> None:
+        """Recycles a row widget that scrolled out of view, or frees it."""
+
+        if node is None or _is_recyclable(node):
+            if self._pool_size < 2 * self.buffer + self._framed_height:
+                self._pool.setdefault(type(widget), []).append(widget)
+                self._pool_size += 1
+
+            return
+
+        envs = app_envs(lua, self.app)
+
+        for child in widget.drawables():
+            envs[id(child)] = None
+
+    def _create_row(self, node: Element | None) -> Widget:
+        """Returns a widget displaying the given row, reusing pooled ones if possible."""
+
+        if node is None or _is_recyclable(node):
+            cls = Text if node is None else WIDGET_TYPES[node.tag]
+
+            pooled = self._pool.get(cls)
+
+            if pooled:
+                widget = pooled.pop()
+                self._pool_size -= 1
+
+                # A pooled widget may still be one of our children
+                queries = getattr(self.app, "queries", None)
+
+                if queries is not None:
+                    queries.changed(widget)
+            else:
+                widget = cls()
+
+            # Only text rows are recyclable
+            assert isinstance(widget, Text)
+
+            widget.content = "" if node is None else dedent(node.text or "").strip()
+            widget.groups = () if node is None else tuple(node.get("groups", "").split())
+
+            return widget
+
+        # `parse_widget` mutates its input & expects a parent for components
+        holder = Element("tower")
+        holder.append(deepcopy(node))
+
+        widget, _ = parse_widget(
+            holder[0], self.app._registered_components  # pylint: disable=protected-access
+        )
+
+        return widget
+
+    def _materialize(self, start: int, end: int) -> None:
+        """Makes our children the widgets for rows [start, end)."""
+
+        materialized = {}
+
+        # Our children are set directly, rather than through the methods that report
+        # their changes to live queries
+        queries = getattr(self.app, "queries", None)
+
+        if queries is not None:
+            queries.children_changing(self)
+
+        # Release outdated rows first, so the new ones can reuse their widgets
+        for index, (node, widget) in [*self._materialized.items()]:
+            if start <= index < end and self._rows.get(index) is node:
+                continue
+
+            del self._materialized[index]
+            self._release(node, widget)
+
+        for index in range(start, end):
+            if index in self._materialized:
+                materialized[index] = self._materialized[index]
+                continue
+
+            node = self._rows.get(index)
+
+            widget = self._create_row(node)
+            widget.height = self.row_height
+            widget.parent = self
+
+            materialized[index] = (node, widget)
+
+        self._materialized = materialized
+        self.children = [widget for _, widget in materialized.values()]
+
+        if self._mouse_target not in self.children:
+            self._mouse_target = None
+
+        self._window_range = (start, end)
+        self._is_stale = False
+
+    def get_content(self) -> list[str]:
+        """Materializes the rows in view, and arranges them around the scroll offset."""
+
+        start, end = self._window()
+
+        if self.total == 0 and not self._loaded_pages:
+            self._fetch(0, 1)
+        else:
+            self._fetch(start, end)
+
+        if self._is_stale or (start, end) != self._window_range:
+            self._materialize(start, end)
+
+        start_x = self.position[0] + (self.frame.left != "")
+        start_y = self.position[1] + (self.frame.top != "")
+
+        self.arrange(
+            start_x - self.scroll[0],
+            start_y - self.scroll[1] + start * self.row_height,
+        )
+
+        return [""]
+
+    def build(
+        self, *, virt_width: int | None = None, virt_height: int | None = None
+    ) -> list[tuple[Any, ...]]:
+        # Skip `Container.build`, our virtual height is given by the total row count
+        return Widget.build(
+            self,
+            virt_width=self._outer_dimensions[0],
+            virt_height=max(self.total * self.row_height, 1),
+        )
+
+
+WIDGET_TYPES["vlist"] = VirtualList
@@ -0,0 +1,122 @@
+"""A compact, msgpack-based wire format for celx pages & fragments.
+
+Every element is encoded as a `[tag, attrs, text, tail, children]` array, where empty
+fields are `None`. The payload is `[WIRE_VERSION, <root element>]`.
+
+Servers that can produce it should respond with the `CONTENT_TYPE` content type when
+it is listed in the request's `Accept` header. `msgpack` is an optional dependency,
+without it celx only negotiates XML.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from lxml.etree import Element, SubElement, fromstring
+
+__all__ = [
+    "CONTENT_TYPE",
+    "WIRE_VERSION",
+    "is_available",
+    "encode_element",
+    "encode_xml",
+    "decode",
+]
+
+CONTENT_TYPE = "application/celx+msgpack"
+WIRE_VERSION = 1
+
+
+def is_available() -> bool:
+    """Determines whether `msgpack` can be imported."""
+
+    try:
+        import msgpack  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        return False
+
+    return True
+
+
+def _pack_element(element: Element) -> list[Any]:
+    """Converts an element (and its children) into nested lists.
+
+    Comments & processing instructions are dropped, but the text following them is
+    kept as the tail of the previous element, or the text of the parent.
+    """
+
+    text = element.text
+    children: list[list[Any]] = []
+
+    for child in element:
+        if isinstance(child.tag, str):
+            children.append(_pack_element(child))
+            continue
+
+        if not child.tail:
+            continue
+
+        if children:
+            children[-1][3] = (children[-1][3] or "") + child.tail
+        else:
+            text = (text or "") + child.tail
+
+    return [
+        element.tag,
+        dict(element.attrib) or None,
+        text,
+        element.tail,
+        children or None,
+    ]
+
+
+def _unpack_element(data: list[Any], parent: Element | None = None) -> Element:
+    """Builds an element from its packed form, without parsing any XML."""
+
+    tag, attrs, text, tail, children = data
+
+    if parent is None:
+        element = Element(tag, attrs or {})
+    else:
+        element = SubElement(parent, tag, attrs or {})
+
+    element.text = text
+    element.tail = tail
+
+    for child in children or []:
+        _unpack_element(child, element)
+
+    return element
+
+
+def encode_element(element: Element) -> bytes:
+    """Encodes an lxml element into the wire format.
+
+    This is the helper Python servers can use to respond with `CONTENT_TYPE`.
+    """
+
+    import msgpack  # pylint: disable=import-outside-toplevel
+
+    return msgpack.packb([WIRE_VERSION, _pack_element(element)], use_bin_type=True)
+
+
+def encode_xml(xml: str | bytes) -> bytes:
+    """Converts an XML page or fragment into the wire format."""
+
+    if isinstance(xml, str):
+        xml = xml.encode()
+
+    return encode_element(fromstring(xml))
+
+
+def decode(data: bytes) -> Element:
+    """Decodes a wire format payload into an lxml element tree."""
+
+    import msgpack  # pylint: disable=import-outside-toplevel
+
+    version, root = msgpack.unpackb(data, raw=False)
+
+    if version != WIRE_VERSION:
+        raise ValueError(f"unsupported wire format version {version!r}")
+
+    return _unpack_element(root)
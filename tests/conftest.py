@@ -0,0 +1,45 @@
+"""Fixtures for running apps in headless browser sessions."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Callable
+
+import pytest
+
+from celx.bundle import write_bundle
+
+# A chrome without the default one's scripts & layout, so pages are all there is
+CHROME = '<user-chrome><text eid="chrome">chrome</text></user-chrome>'
+
+
+@pytest.fixture(name="bundle_app")
+def fixture_bundle_app(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Callable[[dict[str, str]], str]:
+    """Returns a function that bundles pages into an app, returning its URL.
+
+    The pages are given by their paths within the app, like `index.xml`.
+    """
+
+    home = tmp_path / "home"
+    chrome = home / ".config" / "celx" / "chrome.xml"
+    chrome.parent.mkdir(parents=True)
+    chrome.write_text(CHROME, encoding="utf-8")
+
+    monkeypatch.setenv("HOME", str(home))
+
+    def _bundle(pages: dict[str, str]) -> str:
+        source = tmp_path / "app"
+
+        for name, content in pages.items():
+            path = source / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content, encoding="utf-8")
+
+        output = tmp_path / "app.celxb"
+        write_bundle(source, output)
+
+        return f"file://{output}"
+
+    return _bundle
@@ -0,0 +1,101 @@
+"""Tests for writing & serving offline app bundles."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from celx import wire
+from celx.bundle import Bundle, BundleResponse, open_bundle, write_bundle
+
+FILES = {
+    "index.xml": b"<celx><page><text>home</text></page></celx>",
+    "menu.xml": b"<celx><page><text>menu</text></page></celx>",
+    "docs/index.xml": b"<celx><page><text>docs</text></page></celx>",
+    "static/app.lua": b"print('hi')",
+    "static/style.yaml": "Text:\n    content: é\n".encode(),
+}
+
+
+@pytest.fixture(name="source")
+def fixture_source(tmp_path: Path) -> Path:
+    source = tmp_path / "app"
+
+    for name, data in FILES.items():
+        path = source / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    return source
+
+
+@pytest.mark.parametrize("filename", ["app.zip", "app.celxb"])
+def test_round_trip(source: Path, tmp_path: Path, filename: str) -> None:
+    output = tmp_path / filename
+
+    assert write_bundle(source, output) == len(FILES)
+
+    bundle = Bundle(output)
+
+    assert sorted(bundle.names()) == sorted(FILES)
+
+    for name, data in FILES.items():
+        assert bundle.read(name) == data
+
+    bundle.close()
+
+
+@pytest.mark.parametrize("filename", ["app.zip", "app.celxb"])
+def test_paths_resolve_to_entries(source: Path, tmp_path: Path, filename: str) -> None:
+    output = tmp_path / filename
+    write_bundle(source, output)
+
+    bundle, root, path = open_bundle(f"file://{output}/menu")
+
+    assert root == f"file://{output}"
+    assert path == "/menu"
+    assert bundle.lookup("/menu") == ("menu.xml", "text/celx")
+    assert bundle.lookup("/") == ("index.xml", "text/celx")
+    assert bundle.lookup("/docs") == ("docs/index.xml", "text/celx")
+    assert bundle.lookup("/static/app.lua") == ("static/app.lua", "text/x-lua")
+    assert bundle.lookup("/missing") is None
+
+
+def test_responses(source: Path, tmp_path: Path) -> None:
+    output = tmp_path / "app.celxb"
+    write_bundle(source, output)
+
+    resp = BundleResponse.for_request("GET", f"file://{output}/static/style.yaml")
+    resp.raise_for_status()
+
+    assert resp.headers == {"Content-Type": "text/yaml"}
+    assert resp.text == FILES["static/style.yaml"].decode()
+
+    missing = BundleResponse.for_request("GET", f"file://{output}/missing")
+
+    with pytest.raises(FileNotFoundError):
+        missing.raise_for_status()
+
+    assert BundleResponse.for_request("POST", f"file://{output}/").status_code == 405
+
+
+def test_precompiled_pages(source: Path, tmp_path: Path) -> None:
+    pytest.importorskip("msgpack")
+
+    output = tmp_path / "app.celxb"
+    write_bundle(source, output, precompile=True)
+
+    bundle, _, _ = open_bundle(f"file://{output}/menu")
+    name, content_type = bundle.lookup("/menu") or ("", "")
+
+    assert (name, content_type) == ("menu.celx", wire.CONTENT_TYPE)
+    assert wire.decode(bundle.read(name)).find("page/text").text == "menu"
+
+
+def test_unknown_files_are_rejected(tmp_path: Path) -> None:
+    path = tmp_path / "app.celxb"
+    path.write_bytes(b"not a bundle, just some bytes")
+
+    with pytest.raises(ValueError):
+        Bundle(path)
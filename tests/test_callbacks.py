@@ -0,0 +1,103 @@
+"""Tests for parsing Chocl callbacks & their trigger modifiers."""
+
+from __future__ import annotations
+
+import pytest
+
+from celx.callbacks import (
+    Instruction,
+    Trigger,
+    Verb,
+    _compile_callback,
+    _triggered_runner,
+)
+from celx.scheduler import FrameScheduler
+
+
+def test_callback_without_modifiers_has_no_trigger() -> None:
+    instructions, trigger = _compile_callback("GET /search; SWAP IN #results")
+
+    assert trigger is None
+    assert instructions == (
+        Instruction(Verb.GET, ["/search", None]),
+        Instruction(Verb.SWAP, ["#results", "IN"]),
+    )
+
+
+def test_modifiers_are_parsed_into_a_trigger() -> None:
+    instructions, trigger = _compile_callback(
+        ":debounce 300ms; THROTTLE 1.5s; CHANGED; MIN-LENGTH 2; GET /search"
+    )
+
+    assert trigger == Trigger(
+        debounce_ms=300, throttle_ms=1500, changed=True, min_length=2
+    )
+    assert [instr.verb for instr in instructions] == [Verb.GET]
+
+
+@pytest.mark.parametrize(
+    ("duration", "expected"), [("250", 250), ("250ms", 250), ("2s", 2000)]
+)
+def test_durations(duration: str, expected: float) -> None:
+    _, trigger = _compile_callback(f"DEBOUNCE {duration}; GET /search")
+
+    assert trigger is not None
+    assert trigger.debounce_ms == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "DEBOUNCE; GET /search",
+        "DEBOUNCE soon; GET /search",
+        "CHANGED now; GET /search",
+        "MIN-LENGTH two; GET /search",
+        "GET /search; DEBOUNCE 300ms",
+    ],
+)
+def test_invalid_modifiers(text: str) -> None:
+    with pytest.raises(ValueError):
+        _compile_callback(text)
+
+
+class _Caller:  # pylint: disable=too-few-public-methods
+    """Stands in for the input widget a callback is triggered by."""
+
+    def __init__(self, value: str) -> None:
+        self.value = value
+        self.app = self
+        self.scheduler = FrameScheduler()
+
+
+def test_changed_and_min_length_skip_runs() -> None:
+    runs = []
+    _, trigger = _compile_callback("CHANGED; MIN-LENGTH 2; GET /search")
+    assert trigger is not None
+
+    interpret = _triggered_runner(lambda caller: runs.append(caller.value), trigger)
+    caller = _Caller("")
+
+    for value in ["a", "ab", "ab", "abc"]:
+        caller.value = value
+        interpret(caller)
+
+    assert runs == ["ab", "abc"]
+
+
+def test_debounce_runs_once_with_the_latest_value() -> None:
+    runs = []
+    interpret = _triggered_runner(
+        lambda caller: runs.append(caller.value), Trigger(debounce_ms=1)
+    )
+    caller = _Caller("")
+
+    for value in ["a", "ab", "abc"]:
+        caller.value = value
+        interpret(caller)
+
+    assert not runs
+
+    while caller.scheduler.pending:
+        caller.scheduler.run_frame()
+
+    assert runs == ["abc"]
@@ -0,0 +1,84 @@
+"""Tests for creating widgets from Lua through the `w.*` factories."""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from celx.headless import HeadlessBrowser
+from celx.lua import app_envs, lua
+
+INDEX = """
+<celx><page><tower eid="body">
+    <button eid="build">build
+        <script>
+            clicks = 0
+
+            function on_submit()
+                local body = find("#body")
+
+                body.append(w.Button{"bare", eid="bare", on_submit=function()
+                    clicks = clicks + 1
+                end})
+
+                body.append(w.Button{"listed", eid="listed", on_submit={
+                    function() clicks = clicks + 10 end,
+                    function() clicks = clicks + 100 end,
+                }})
+
+                for _, text in ipairs(w.many{"Text", {"first"}, {"second", groups={"muted"}}}) do
+                    body.append(text)
+                end
+            end
+        </script>
+    </button>
+</tower></page></celx>
+"""
+
+
+@pytest.fixture(name="session")
+def fixture_session(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[HeadlessBrowser]:
+    url = bundle_app({"index.xml": INDEX})
+    session = HeadlessBrowser(url, size=(40, 10))
+
+    assert session.settle()
+
+    session.trigger("#build")
+    assert session.settle()
+
+    yield session
+
+    session.stop()
+
+
+def _clicks(session: HeadlessBrowser) -> int:
+    with session.activate():
+        return app_envs(lua, session)[id(session.find("#build"))].clicks
+
+
+def test_bare_functions_are_event_handlers(session: HeadlessBrowser) -> None:
+    session.trigger("#bare")
+    assert session.settle()
+
+    assert _clicks(session) == 1
+
+
+def test_handler_lists_are_kept(session: HeadlessBrowser) -> None:
+    session.trigger("#listed")
+    assert session.settle()
+
+    assert _clicks(session) == 110
+
+
+def test_many_creates_every_widget(session: HeadlessBrowser) -> None:
+    with session.activate():
+        texts = [*session.find_all("Text")]
+
+    assert [text.content for text in texts[-2:]] == ["first", "second"]
+    assert texts[-1].groups == ("muted",)
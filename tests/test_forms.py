@@ -0,0 +1,57 @@
+"""Tests for collecting form data from captured input values."""
+
+from __future__ import annotations
+
+from celadon import Field, Tower
+
+from celx.forms import FormSnapshot
+
+
+def _form() -> tuple[FormSnapshot, Tower, Field, Field]:
+    first = Field(name="q", value="old")
+    second = Field(name="other", value="new")
+    root = Tower(Tower(first), second)
+
+    forms = FormSnapshot()
+    forms.track(root)
+
+    return forms, root, first, second
+
+
+def test_collect_skips_removed_inputs() -> None:
+    forms, root, first, _ = _form()
+
+    first.parent.remove(first)
+
+    assert forms.collect(root) == {"other": "new"}
+
+
+def test_forget_drops_inputs_within_scope() -> None:
+    forms, root, first, _ = _form()
+    container = first.parent
+
+    forms.forget(container)
+    root.remove(container)
+
+    assert forms.collect(root) == {"other": "new"}
+
+    # Forgotten inputs are no longer captured, even if they are put back
+    root.append(container)
+    first.value = "changed"
+    forms.invalidate(first)
+    forms.recapture()
+
+    assert forms.collect(root) == {"other": "new"}
+
+
+def test_recapture_reads_inputs_set_by_scripts() -> None:
+    forms, root, first, _ = _form()
+
+    first.value = "from lua"
+    forms.invalidate(first)
+
+    assert forms.collect(root) == {"q": "old", "other": "new"}
+
+    forms.recapture()
+
+    assert forms.collect(root) == {"q": "from lua", "other": "new"}
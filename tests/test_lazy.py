@@ -0,0 +1,85 @@
+"""Tests for revealing & loading `<lazy>` placeholders."""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from celx.headless import HeadlessBrowser
+from celx.lua import app_envs, lua
+
+FILLER = "".join(f"<text>line {i}</text>" for i in range(10))
+
+INDEX = f"""
+<celx><page><tower eid="body">
+    <lazy eid="eager" src="/eager" trigger="load"><text>loading</text></lazy>
+    {FILLER}
+    <lazy eid="comments" src="/comments"><text>loading comments</text></lazy>
+    <lazy eid="more">
+        <script>
+            reveals = 0
+
+            function on_reveal()
+                reveals = reveals + 1
+            end
+        </script>
+    </lazy>
+</tower></page></celx>
+"""
+
+COMMENTS = '<celx><page><text eid="comment">a comment</text></page></celx>'
+EAGER = '<celx><page><text eid="loaded">eager</text></page></celx>'
+
+
+@pytest.fixture(name="session")
+def fixture_session(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[HeadlessBrowser]:
+    url = bundle_app({"index.xml": INDEX, "comments.xml": COMMENTS, "eager.xml": EAGER})
+
+    # Only the chrome & the first few lines fit on the screen
+    session = HeadlessBrowser(url, size=(40, 8))
+
+    assert session.settle()
+
+    yield session
+
+    session.stop()
+
+
+def _reveals(session: HeadlessBrowser) -> int:
+    with session.activate():
+        return app_envs(lua, session)[id(session.find("#more"))].reveals
+
+
+def test_placeholders_wait_until_revealed(session: HeadlessBrowser) -> None:
+    with session.activate():
+        assert session.find("#comments") is not None
+        assert session.find("#comment") is None
+
+        # Placeholders triggered on load don't wait to be seen
+        assert session.find("#eager") is None
+        assert session.find("#loaded") is not None
+
+    assert _reveals(session) == 0
+
+
+def test_revealed_placeholders_are_swapped(session: HeadlessBrowser) -> None:
+    session.resize((40, 20))
+    assert session.settle()
+
+    with session.activate():
+        assert session.find("#comments") is None
+        assert session.find("#comment") is not None
+
+    assert _reveals(session) == 1
+
+    # Placeholders are only revealed once, however many frames they're seen in
+    session.resize((40, 21))
+    assert session.settle()
+
+    assert _reveals(session) == 1
@@ -0,0 +1,72 @@
+"""Tests for rolling optimistic updates back."""
+
+from __future__ import annotations
+
+from celadon import Field, Text, Tower
+
+from celx.optimistic import TreeSnapshot
+
+
+def test_restore_removes_added_widgets() -> None:
+    first = Text("first")
+    root = Tower(first)
+
+    snapshot = TreeSnapshot([root])
+
+    added = Text("pending")
+    root.append(added)
+    root.remove(first)
+
+    removed = snapshot.restore()
+
+    assert removed == [added]
+    assert root.children == [first]
+    assert first.parent is root
+
+
+def test_restore_resets_attributes() -> None:
+    text = Text("original", groups=("a",))
+    field = Field(value="typed")
+    root = Tower(Tower(text), field)
+
+    snapshot = TreeSnapshot([root])
+
+    text.content = "optimistic"
+    text.groups = ("a", "pending")
+    field.value = "cleared"
+
+    assert not snapshot.restore()
+    assert text.content == "original"
+    assert text.groups == ("a",)
+    assert field.value == "typed"
+
+
+def test_restore_nested_changes() -> None:
+    inner = Tower(Text("a"))
+    root = Tower(inner)
+
+    snapshot = TreeSnapshot([root])
+
+    replacement = Tower(Text("b"))
+    root.update_children([replacement])
+
+    added = Text("c")
+    inner.append(added)
+
+    removed = snapshot.restore()
+
+    assert removed == [replacement, added]
+    assert root.children == [inner]
+    assert [child.content for child in inner.children] == ["a"]
+
+
+def test_overlapping_roots_are_restored_once() -> None:
+    child = Tower(Text("a"))
+    root = Tower(child)
+
+    snapshot = TreeSnapshot([root, child])
+
+    child.append(Text("b"))
+
+    assert len(snapshot.restore()) == 1
+    assert len(child.children) == 1
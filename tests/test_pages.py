@@ -0,0 +1,143 @@
+"""Tests for routing to, retaining & evicting pages."""
+
+from __future__ import annotations
+
+from typing import Any, Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from celadon import Page, Tower
+from lxml.etree import fromstring
+
+from celx.headless import HeadlessBrowser
+from celx.lua import app_envs, lua
+from celx.pages import PageState
+from celx.parsing import parse_page
+from celx.runtime import LimitedLuaRuntime
+
+INDEX = """
+<celx><page>
+    <script>page_ran = true</script>
+    <tower eid="body">
+        <text eid="greeting">...
+            <script>
+                function init()
+                    self.content = "hello"
+                end
+            </script>
+        </text>
+    </tower>
+</page></celx>
+"""
+
+
+COUNTER = """
+<celx><page>
+    <tower eid="body">
+        <button eid="counter">count
+            <script>
+                hits = 0
+
+                function on_submit()
+                    hits = hits + 1
+                end
+            </script>
+        </button>
+    </tower>
+</page></celx>
+"""
+
+
+@pytest.fixture(name="session")
+def fixture_session(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[HeadlessBrowser]:
+    pages = {"index.xml": COUNTER, "second.xml": COUNTER, "third.xml": COUNTER}
+    session = HeadlessBrowser(bundle_app(pages), size=(40, 10), max_cached_pages=1)
+
+    assert session.settle()
+
+    yield session
+
+    session.stop()
+
+
+def _go(session: HeadlessBrowser, move: Callable[[], None]) -> None:
+    with session.activate():
+        move()
+
+    assert session.settle()
+
+
+def _hits(session: HeadlessBrowser) -> int:
+    with session.activate():
+        return app_envs(lua, session)[id(session.find("#counter"))].hits
+
+
+def test_back_and_forward_restore_cached_pages(session: HeadlessBrowser) -> None:
+    index = session.page
+    session.trigger("#counter")
+
+    _go(session, lambda: session.route("/second"))
+    second = session.page
+
+    assert session.page_states[index] is PageState.CACHED
+
+    _go(session, session.back)
+
+    # The retained page is shown again, along with its script state
+    assert session.page is index
+    assert session.page_states[second] is PageState.CACHED
+    assert _hits(session) == 1
+
+    _go(session, session.forward)
+
+    assert session.page is second
+    assert _hits(session) == 0
+
+
+def test_pages_beyond_the_cache_are_evicted(session: HeadlessBrowser) -> None:
+    index = session.page
+    counter = session.find("#counter")
+    session.trigger("#counter")
+
+    _go(session, lambda: session.route("/second"))
+    _go(session, lambda: session.route("/third"))
+
+    # Only one inactive page is retained, along with its widgets & environments
+    assert session.page_states[index] is PageState.EVICTED
+    assert not [*index]
+
+    with session.activate():
+        assert app_envs(lua, session)[id(counter)] is None
+
+    # Going back requests the page again, rather than showing the evicted one
+    _go(session, session.back)
+    _go(session, session.back)
+
+    assert session.page is not index
+    assert session.page.route_name == index.route_name
+    assert _hits(session) == 0
+
+
+def test_parsing_a_page_leaves_its_scripts_for_later(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    executed = []
+
+    def _execute_script(_: LimitedLuaRuntime, code: str) -> Any:
+        executed.append(code)
+
+    monkeypatch.setattr(LimitedLuaRuntime, "execute_script", _execute_script)
+
+    node = fromstring(INDEX).find("page")
+    widget, scripts, _ = parse_page(node, {}, Page())
+
+    # Page requests are parsed on a network thread, scripts run on the UI thread
+    assert not executed
+    assert isinstance(widget, Tower)
+    assert widget.children[0].content == "..."
+    assert len(scripts) == 1
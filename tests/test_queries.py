@@ -0,0 +1,116 @@
+"""Tests for keeping live query handles up to date."""
+
+from __future__ import annotations
+
+from typing import Iterator
+
+import pytest
+
+from celadon import Selector, Text, Tower, Widget
+
+from celx.queries import QueryCache, note_set
+
+
+class _App:
+    """The parts of a browser a query cache reads the page through."""
+
+    def __init__(self, *roots: Widget) -> None:
+        self.page = list(roots)
+        self._children: list[Widget] = []
+        self.queries = QueryCache(self, None)  # type: ignore
+
+    def find_all(self, query: str | Selector) -> Iterator[Widget]:
+        selector = Selector.parse(query) if isinstance(query, str) else query
+
+        for root in self.page:
+            for widget in root.drawables():
+                if selector.matches(widget):
+                    yield widget
+
+
+def _cache(monkeypatch: pytest.MonkeyPatch, *roots: Widget) -> tuple[_App, QueryCache]:
+    app = _App(*roots)
+
+    # Tree methods report to the cache of the active app
+    monkeypatch.setattr(Widget, "app", app, raising=False)
+
+    return app, app.queries
+
+
+def _matches(cache: QueryCache, query: str) -> list[str]:
+    return [widget.content for widget in cache.handle(query).widgets()]
+
+
+def test_added_children_are_spliced_in_page_order(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    first = Tower(Text("a", groups=("row",)))
+    second = Tower(Text("c", groups=("row",)))
+
+    app, cache = _cache(monkeypatch, first, second)
+
+    assert _matches(cache, "Text.row") == ["a", "c"]
+
+    second.insert(0, Text("b", groups=("row",)))
+    first.append(Text("a2", groups=("row",)))
+
+    handle = cache.handle("Text.row")
+
+    assert _matches(cache, "Text.row") == ["a", "a2", "b", "c"]
+    assert handle.widgets() == [*app.find_all("Text.row")]
+
+
+def test_changed_groups_are_matched_again(monkeypatch: pytest.MonkeyPatch) -> None:
+    texts = [Text(str(i)) for i in range(4)]
+    root = Tower(*texts)
+
+    _, cache = _cache(monkeypatch, root)
+
+    assert not _matches(cache, "Text.row")
+
+    for text in reversed(texts[1:3]):
+        note_set(cache, text, "groups")
+        text.groups = ("row",)
+
+    assert _matches(cache, "Text.row") == ["1", "2"]
+
+    texts[1].remove_from_parent()
+    texts[3].add_group("row")
+
+    assert _matches(cache, "Text.row") == ["2", "3"]
+
+
+def test_handles_survive_python_side_swaps(monkeypatch: pytest.MonkeyPatch) -> None:
+    old = Tower(Text("old", groups=("row",)))
+    root = Tower(Text("first", groups=("row",)), old)
+
+    app, cache = _cache(monkeypatch, root)
+    handle = cache.handle("Text.row")
+
+    assert _matches(cache, "Text.row") == ["first", "old"]
+
+    # Like a SWAP instruction, or a <lazy> revealing its content
+    new = Tower(Text("new", groups=("row",)), Text("newer", groups=("row",)))
+    root.replace(old, new)
+
+    assert _matches(cache, "Text.row") == ["first", "new", "newer"]
+
+    new.update_children([Text("swapped", groups=("row",))])
+
+    assert _matches(cache, "Text.row") == ["first", "swapped"]
+    assert handle.widgets() == [*app.find_all("Text.row")]
+
+
+def test_sets_without_a_cache_are_ignored(monkeypatch: pytest.MonkeyPatch) -> None:
+    text = Text("a")
+    root = Tower(text)
+
+    _, cache = _cache(monkeypatch, root)
+
+    assert not _matches(cache, "Text.row")
+
+    note_set(None, text, "groups")
+    text.groups = ("row",)
+
+    # The change wasn't reported, so the handle keeps its old matches
+    assert not _matches(cache, "Text.row")
@@ -0,0 +1,97 @@
+"""Tests for answering requests with the route handlers of page scripts."""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from celx.headless import HeadlessBrowser
+
+INDEX = """
+<celx><page>
+    <script>
+        routes.on("GET", "/panel/:name", function(request)
+            return '&lt;text eid="panel"&gt;index ' .. request.args.name .. '&lt;/text&gt;'
+        end)
+    </script>
+    <tower eid="out"><text>empty</text></tower>
+</page></celx>
+"""
+
+OTHER = """
+<celx><page>
+    <tower eid="out"><text>empty</text></tower>
+</page></celx>
+"""
+
+PANEL = '<celx><page><text eid="panel">network help</text></page></celx>'
+
+LOAD = ":GET /panel/help; swap in #out"
+
+
+@pytest.fixture(name="session")
+def fixture_session(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[HeadlessBrowser]:
+    url = bundle_app({"index.xml": INDEX, "other.xml": OTHER, "panel/help.xml": PANEL})
+    session = HeadlessBrowser(url, size=(40, 10), max_cached_pages=1)
+
+    assert session.settle()
+
+    yield session
+
+    session.stop()
+
+
+def _panel(session: HeadlessBrowser) -> str | None:
+    with session.activate():
+        panel = session.find("#panel")
+
+    return None if panel is None else panel.content
+
+
+def test_handlers_answer_requests(session: HeadlessBrowser) -> None:
+    session.dispatch("#out", LOAD)
+    assert session.settle()
+
+    assert _panel(session) == "index help"
+
+
+def test_handlers_only_answer_their_page(session: HeadlessBrowser) -> None:
+    session.navigate("/other")
+    assert session.settle()
+
+    session.dispatch("#out", LOAD)
+    assert session.settle()
+
+    assert _panel(session) == "network help"
+
+    # Going back to the cached page makes its handlers answer again
+    with session.activate():
+        session.back()
+
+    assert session.settle()
+
+    session.dispatch("#out", LOAD)
+    assert session.settle()
+
+    assert _panel(session) == "index help"
+
+
+def test_evicted_pages_drop_their_handlers(session: HeadlessBrowser) -> None:
+    assert len(session.local_routes) == 1
+
+    session.navigate("/other")
+    assert session.settle()
+
+    assert len(session.local_routes) == 1
+
+    # Only one inactive page is kept, so index is evicted
+    session.navigate("/panel/help")
+    assert session.settle()
+
+    assert len(session.local_routes) == 0
@@ -0,0 +1,72 @@
+"""Tests for the script limits of the Lua runtime."""
+
+from __future__ import annotations
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from lupa import LuaError  # type: ignore # pylint: disable=no-name-in-module
+
+from celx.lua import ScriptLimits
+from celx.runtime import LimitedLuaRuntime
+
+
+@pytest.fixture(name="runtime")
+def fixture_runtime() -> LimitedLuaRuntime:
+    runtime = LimitedLuaRuntime()
+    runtime.limits = ScriptLimits(max_instructions=100_000, max_memory=None)
+
+    return runtime
+
+
+def _run(runtime: LimitedLuaRuntime, code: str) -> object:
+    with runtime.limited():
+        return runtime.execute(code)
+
+
+def test_endless_loop_is_stopped(runtime: LimitedLuaRuntime) -> None:
+    with pytest.raises(LuaError, match="instruction limit exceeded"):
+        _run(runtime, "while true do end")
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "while true do pcall(function() while true do end end) end",
+        "while true do xpcall(function() while true do end end, print) end",
+        "while true do pcall(error, 'x') end",
+        """
+        local co = coroutine.create(function() while true do end end)
+        while true do coroutine.resume(co) end
+        """,
+        "coroutine.wrap(function() while true do end end)()",
+        """
+        while true do
+            pcall(function() while true do end end)
+            local x = 0
+            for i = 1, 1000000 do x = x + i end
+        end
+        """,
+    ],
+    ids=["pcall", "xpcall", "pcall-error", "resume", "wrap", "pcall-then-loop"],
+)
+def test_caught_limit_errors_are_raised_again(
+    runtime: LimitedLuaRuntime, code: str
+) -> None:
+    with pytest.raises(LuaError, match="instruction limit exceeded"):
+        _run(runtime, code)
+
+
+def test_caught_errors_within_the_limit(runtime: LimitedLuaRuntime) -> None:
+    assert _run(runtime, "return pcall(error, 'oops', 0)") == (False, "oops")
+
+
+def test_every_execution_gets_the_full_quota(runtime: LimitedLuaRuntime) -> None:
+    with pytest.raises(LuaError):
+        _run(runtime, "while true do end")
+
+    assert _run(runtime, "local x = 0; for i = 1, 1000 do x = x + i end; return x") == (
+        500500
+    )
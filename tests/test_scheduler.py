@@ -0,0 +1,72 @@
+"""Tests for coalescing timeouts in the frame scheduler."""
+
+from __future__ import annotations
+
+from time import sleep
+
+import pytest
+
+from celx.scheduler import FrameScheduler
+
+
+def _run_due(scheduler: FrameScheduler) -> None:
+    sleep(0.002)
+
+    while scheduler.pending:
+        scheduler.run_frame()
+
+
+def test_repeated_timeouts_collapse() -> None:
+    scheduler = FrameScheduler()
+    calls = []
+
+    def _refresh() -> None:
+        calls.append("refresh")
+
+    keys = {scheduler.timeout(1, _refresh) for _ in range(50)}
+    _run_due(scheduler)
+
+    assert len(keys) == 1
+    assert calls == ["refresh"]
+
+
+def test_distinct_callbacks_and_keys_are_kept() -> None:
+    scheduler = FrameScheduler()
+    calls = []
+
+    scheduler.timeout(1, lambda: calls.append("first"))
+    scheduler.timeout(1, lambda: calls.append("second"))
+    scheduler.timeout(1, lambda: calls.append("keyed"), key="a")
+    scheduler.timeout(1, lambda: calls.append("other key"), key="b")
+    _run_due(scheduler)
+
+    assert sorted(calls) == ["first", "keyed", "other key", "second"]
+
+
+def test_repeated_lua_timeouts_collapse() -> None:
+    pytest.importorskip("lupa")
+
+    # pylint: disable-next=import-outside-toplevel
+    from celx.runtime import LimitedLuaRuntime
+
+    runtime = LimitedLuaRuntime()
+    scheduler = FrameScheduler(runtime=runtime)
+    runtime.globals().timeout = scheduler.timeout
+
+    runtime.execute(
+        """
+        calls = 0
+
+        function refresh()
+            calls = calls + 1
+        end
+
+        for _ = 1, 50 do timeout(1, refresh) end
+
+        -- Separate closures are separate callbacks
+        for _ = 1, 2 do timeout(1, function() calls = calls + 10 end) end
+        """
+    )
+    _run_due(scheduler)
+
+    assert runtime.globals().calls == 21
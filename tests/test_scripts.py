@@ -0,0 +1,124 @@
+"""Tests for building, running & binding the scripts of widget trees."""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from lxml.etree import fromstring
+
+from celx.headless import HeadlessBrowser
+from celx.lua import app_envs, lua
+from celx.parsing import RuntimeError as ScriptError
+from celx.parsing import _extract_script
+
+INDEX = """
+<celx><page><tower eid="body">
+    <script>outer = 1</script>
+    <tower>
+        <script>middle = 2</script>
+        <button eid="broken">broken
+            <script>
+                local first = 1
+
+                function on_submit()
+                    error("broken on purpose")
+                end
+            </script>
+        </button>
+    </tower>
+</tower></page></celx>
+"""
+
+BOUND = """
+<celx><page><tower eid="outer">
+    <script>
+        -- Values named like handlers are left alone
+        one = 3
+        pre_count = 0
+
+        built = {}
+
+        function on_build()
+            built[self.eid] = true
+        end
+    </script>
+    <button eid="inner">inner
+        <script>inner_ran = true</script>
+    </button>
+</tower></page></celx>
+"""
+
+
+@pytest.fixture(name="session")
+def fixture_session(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[HeadlessBrowser]:
+    url = bundle_app({"index.xml": INDEX})
+    session = HeadlessBrowser(url, size=(40, 10))
+
+    assert session.settle()
+
+    yield session
+
+    session.stop()
+
+
+def test_errors_point_to_their_script_line(session: HeadlessBrowser) -> None:
+    with pytest.raises(ScriptError) as info:
+        session.trigger("#broken")
+
+    lines = str(info.value).splitlines()
+
+    assert lines[0] == "error in 'on_submit': broken on purpose"
+    assert '>     error("broken on purpose")' in lines
+
+
+def test_deep_trees_emit_each_script_once() -> None:
+    depth = 200
+    script = "<script>depth = depth + 1</script>"
+
+    node = fromstring("<tower>" * depth + "</tower>" * depth)
+
+    for inner in node.iter():
+        inner.append(fromstring(script))
+
+    ids = {inner: i for i, inner in enumerate(node.iter("tower"))}
+    chunk = _extract_script(node, ids, outer=True)
+
+    assert chunk.code.count("depth = depth + 1") == depth
+
+    # Scripts aren't re-indented for every level they are nested in
+    assert max(len(line) for line in chunk.code.splitlines()) < 80
+
+    # Children are emitted before the rest of their parent's scripts
+    lines = [
+        line for line, origin in enumerate(chunk.origins, 1) if origin is not None
+    ]
+
+    assert chunk.locate(lines[0]) == (depth - 1, 1)
+    assert chunk.locate(lines[-1]) == (0, 1)
+
+
+def test_handlers_are_only_bound_by_their_own_env(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> None:
+    session = HeadlessBrowser(bundle_app({"index.xml": BOUND}), size=(40, 10))
+
+    try:
+        assert session.settle()
+
+        with session.activate():
+            env = app_envs(lua, session)[id(session.find("#inner"))]
+
+            # The inner env inherits `on_build`, but it is bound to the outer tower
+            assert env.inner_ran
+            assert [*env.built.keys()] == ["outer"]
+            assert env.self is session.find("#inner")
+
+    finally:
+        session.stop()
@@ -0,0 +1,93 @@
+"""Tests for running multiple headless sessions in one process."""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from celx.headless import HeadlessBrowser
+from celx.lua import app_envs, lua
+
+PAGE = """
+<celx><page><tower eid="body">
+    <button eid="counter">count
+        <script>
+            secret = "counter"
+            hits = 0
+
+            function on_submit()
+                hits = hits + 1
+            end
+        </script>
+    </button>
+</tower></page></celx>
+"""
+
+
+def _run(session: HeadlessBrowser, code: str) -> object:
+    with session.activate():
+        return lua.execute("_ENV = sandbox.envs[0]\n" + code)
+
+
+def _env(session: HeadlessBrowser, query: str) -> object:
+    with session.activate():
+        return app_envs(lua, session)[id(session.find(query))]
+
+
+@pytest.fixture(name="sessions")
+def fixture_sessions(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[list[HeadlessBrowser]]:
+    url = bundle_app({"index.xml": PAGE})
+    sessions = [HeadlessBrowser(url, size=(40, 10)) for _ in range(2)]
+
+    for session in sessions:
+        assert session.settle()
+
+    yield sessions
+
+    for session in sessions:
+        session.stop()
+
+
+def test_scripts_only_reach_their_own_envs(sessions: list[HeadlessBrowser]) -> None:
+    code = """
+    local count = 0
+
+    for _, env in pairs(envs) do
+        if env.secret ~= nil then count = count + 1 end
+    end
+
+    return count
+    """
+
+    assert [_run(session, code) for session in sessions] == [1, 1]
+
+
+def test_handlers_update_their_own_session(sessions: list[HeadlessBrowser]) -> None:
+    first, second = sessions
+
+    first.trigger("#counter")
+    first.trigger("#counter")
+    second.trigger("#counter")
+
+    assert _env(first, "#counter").hits == 2
+    assert _env(second, "#counter").hits == 1
+
+
+def test_stop_releases_envs(sessions: list[HeadlessBrowser]) -> None:
+    first, second = sessions
+    widget = second.find("#counter")
+    env = _env(second, "#counter")
+
+    second.stop()
+
+    assert env.self is None
+    assert _env(first, "#counter").secret == "counter"
+
+    # Stopped sessions get a fresh table, which holds none of their widgets
+    assert app_envs(lua, second)[id(widget)] is None
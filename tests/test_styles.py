@@ -0,0 +1,107 @@
+"""Tests for inline Lua styles & the rules fragments bring along."""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from celx.headless import HeadlessBrowser
+
+INDEX = """
+<celx><page><tower eid="body">
+    <text eid="label">label</text>
+    <button eid="paint">paint
+        <script>
+            function on_submit()
+                styles(find("#label")).content = "red"
+            end
+        </script>
+    </button>
+    <tower eid="out"><text>empty</text></tower>
+</tower></page></celx>
+"""
+
+FRAGMENT = """
+<celx><page><tower eid="fragment">
+    <text eid="sized">sized<style>width: 7</style></text>
+</tower></page></celx>
+"""
+
+EMPTY = '<celx><page><tower eid="empty"></tower></page></celx>'
+
+
+@pytest.fixture(name="session")
+def fixture_session(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[HeadlessBrowser]:
+    url = bundle_app({"index.xml": INDEX, "fragment.xml": FRAGMENT, "empty.xml": EMPTY})
+    session = HeadlessBrowser(url, size=(40, 10))
+
+    assert session.settle()
+
+    yield session
+
+    session.stop()
+
+
+def _rule_count(session: HeadlessBrowser) -> int:
+    assert session.page is not None
+
+    return len(session.page._user_rules)  # pylint: disable=protected-access
+
+
+def test_lua_styles_are_inline(session: HeadlessBrowser) -> None:
+    rules = _rule_count(session)
+
+    session.trigger("#paint")
+    assert session.settle()
+
+    with session.activate():
+        label = session.find("#label")
+
+    assert label is not None
+    assert label.style_map["idle"]["content"] == "red"
+
+    # Setting a style again doesn't add a rule for each assignment
+    session.trigger("#paint")
+    assert session.settle()
+
+    assert _rule_count(session) == rules
+
+
+def test_inline_styles_survive_restyles(session: HeadlessBrowser) -> None:
+    session.trigger("#paint")
+    assert session.settle()
+
+    # The fragment's rule restyles the page
+    session.dispatch("#out", ":GET /fragment; swap in #out")
+    assert session.settle()
+
+    with session.activate():
+        label = session.find("#label")
+
+    assert label is not None
+    assert label.style_map["idle"]["content"] == "red"
+
+
+def test_fragment_rules_leave_with_their_fragment(session: HeadlessBrowser) -> None:
+    rules = _rule_count(session)
+
+    session.dispatch("#out", ":GET /fragment; swap in #out")
+    assert session.settle()
+
+    with session.activate():
+        sized = session.find("#sized")
+
+    assert sized is not None
+    assert sized.width == 7
+    assert _rule_count(session) == rules + 1
+
+    session.dispatch("#out", ":GET /empty; swap in #out")
+    assert session.settle()
+
+    assert _rule_count(session) == rules
@@ -0,0 +1,106 @@
+"""Tests for fetching & recycling the rows of virtual lists."""
+
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+import pytest
+
+pytest.importorskip("lupa")
+
+# pylint: disable=wrong-import-position
+from celx.headless import HeadlessBrowser
+from celx.lua import lua
+from celx.virtual import VirtualList
+
+# Windows are answered by a local route, so rows are numbered by their offset
+INDEX = """
+<celx><page>
+    <script>
+        fetched = {}
+
+        routes.on("GET", "/rows", function(request)
+            local offset = tonumber(request.params.offset)
+            local rows = ""
+
+            table.insert(fetched, offset)
+
+            for i = offset, offset + tonumber(request.params.limit) - 1 do
+                rows = rows .. "&lt;text&gt;row " .. i .. "&lt;/text&gt;"
+            end
+
+            return '&lt;tower total="1000"&gt;' .. rows .. '&lt;/tower&gt;'
+        end)
+    </script>
+    <tower eid="body">
+        <vlist eid="list" src="/rows" page-size="20" buffer="2">
+            <style>height: 8</style>
+        </vlist>
+    </tower>
+</page></celx>
+"""
+
+
+@pytest.fixture(name="session")
+def fixture_session(
+    bundle_app: Callable[[dict[str, str]], str],
+) -> Iterator[HeadlessBrowser]:
+    url = bundle_app({"index.xml": INDEX})
+    session = HeadlessBrowser(url, size=(40, 20))
+
+    assert session.settle()
+
+    yield session
+
+    session.stop()
+
+
+def _vlist(session: HeadlessBrowser) -> VirtualList:
+    with session.activate():
+        vlist = session.find("#list")
+
+    assert isinstance(vlist, VirtualList)
+
+    return vlist
+
+
+def _fetched(session: HeadlessBrowser) -> list[int]:
+    with session.activate():
+        fetched = lua.execute("_ENV = sandbox.envs[0]\nreturn fetched")
+
+    return [*fetched.values()]
+
+
+def _scroll(session: HeadlessBrowser, vlist: VirtualList, lines: int) -> None:
+    for _ in range(lines):
+        session.press(f"mouse:scroll_down@3;{vlist.position[1] + 2}")
+
+    assert session.settle()
+
+
+def test_windows_are_fetched_as_they_come_into_view(session: HeadlessBrowser) -> None:
+    vlist = _vlist(session)
+
+    # 8 visible rows, plus the 2 buffered rows below & the partially visible one
+    assert [row.content for row in vlist.children] == [f"row {i}" for i in range(11)]
+    assert _fetched(session) == [0]
+
+    _scroll(session, vlist, 15)
+
+    assert [row.content for row in vlist.children] == [
+        f"row {i}" for i in range(13, 26)
+    ]
+    assert _fetched(session) == [0, 20]
+
+
+def test_text_rows_reuse_widgets(session: HeadlessBrowser) -> None:
+    vlist = _vlist(session)
+    before = {id(row) for row in vlist.children}
+
+    _scroll(session, vlist, 15)
+
+    after = {id(row) for row in vlist.children}
+
+    # Every row scrolled out of view is displayed again as one scrolled into it
+    assert len(before & after) == len(before)
+    assert len(after) == 13
@@ -0,0 +1,45 @@
+"""Tests for the msgpack wire format."""
+
+from __future__ import annotations
+
+import pytest
+from lxml.etree import tostring
+
+from celx import wire
+
+pytest.importorskip("msgpack")
+
+
+def _round_trip(xml: str) -> str:
+    return tostring(wire.decode(wire.encode_xml(xml))).decode()
+
+
+def test_round_trip_keeps_structure() -> None:
+    xml = (
+        '<celx><page title="Home"><tower eid="root">'
+        '<text groups="a b">Hello</text> between <button>Go</button>after'
+        "</tower></page></celx>"
+    )
+
+    assert _round_trip(xml) == xml
+
+
+def test_comment_tails_are_kept() -> None:
+    xml = "<tower>start<!-- first --> one<text>x</text>two<!-- second --> three</tower>"
+
+    assert _round_trip(xml) == "<tower>start one<text>x</text>two three</tower>"
+
+
+def test_processing_instruction_tails_are_kept() -> None:
+    xml = "<tower><?pi data?>lead<text/><?pi data?>trail</tower>"
+
+    assert _round_trip(xml) == "<tower>lead<text/>trail</tower>"
+
+
+def test_unknown_version_is_rejected() -> None:
+    import msgpack  # pylint: disable=import-outside-toplevel
+
+    with pytest.raises(ValueError):
+        wire.decode(
+            msgpack.packb([wire.WIRE_VERSION + 1, ["tower", None] + [None] * 3])
+        )